@@ -18,13 +18,24 @@ Usage:
     python eval/eval_runner.py --mock
 """
 
+import os
 import sys
 import json
 import time
 import argparse
+import copy
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from dataclasses import dataclass, field, asdict
-from typing import List, Dict, Any, Optional
+from dataclasses import dataclass, field, fields, is_dataclass
+from enum import Enum
+from types import MappingProxyType
+from typing import List, Dict, Any, Mapping, Optional, Sequence, Tuple
+
+try:
+    import orjson
+except ImportError:  # Optional speedup; stdlib json is the fallback
+    orjson = None
 
 # Add parent dir to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -35,264 +46,63 @@ from validators.safety_checker import SafetyChecker
 
 
 # ============================================================================
-# Demo Cases (Python equivalent of app/demo/cases.ts)
+# Demo Cases and Mock Responses
 # ============================================================================
 
-DEMO_CASES = [
-    {
-        "id": "diabetes-glp1",
-        "title": "GLP-1 Agonists for Weight Loss in T2DM",
-        "difficulty": "easy",
-        "initial_message": (
-            "I have a 68-year-old male patient with type 2 diabetes mellitus "
-            "(HbA1c 8.2%), BMI 34, currently on metformin 1000mg BID. He's "
-            "interested in losing weight and has heard about 'those new diabetes "
-            "shots' for weight loss. He has a history of mild CKD (eGFR 55), "
-            "no cardiovascular events but moderate risk. His insurance has approved "
-            "semaglutide. I'm wondering if GLP-1 agonists would be beneficial "
-            "compared to adding a sulfonylurea or SGLT2 inhibitor."
-        ),
-        "expected_pico": {
-            "patient": "elderly patients with type 2 diabetes and obesity, with mild CKD",
-            "intervention": "GLP-1 receptor agonists (semaglutide)",
-            "comparison": "sulfonylurea or SGLT2 inhibitors",
-            "outcome": "weight loss and cardiovascular outcomes",
-        },
-        "expected_keywords": ["semaglutide", "GLP-1", "weight loss", "cardiovascular", "diabetes"],
-    },
-    {
-        "id": "chest-xray-pneumonia",
-        "title": "Community-Acquired Pneumonia Management",
-        "difficulty": "medium",
-        "initial_message": (
-            "45-year-old female presents to urgent care with 4 days of productive "
-            "cough (yellow-green sputum), fever (101.2F), and right-sided pleuritic "
-            "chest pain. Vital signs: HR 98, RR 22, SpO2 94% on room air. "
-            "Physical exam: Decreased breath sounds and dullness to percussion "
-            "right lower lobe, crackles present. I've ordered a chest X-ray which "
-            "shows right lower lobe consolidation. CURB-65 score is 1. Should this "
-            "patient be treated as outpatient or does she need admission?"
-        ),
-        "expected_pico": {
-            "patient": "adults with community-acquired pneumonia",
-            "intervention": "outpatient oral antibiotic therapy",
-            "comparison": "inpatient IV antibiotic therapy",
-            "outcome": "treatment success and complications",
-        },
-        "expected_keywords": ["pneumonia", "CURB-65", "antibiotics", "outpatient"],
-    },
-    {
-        "id": "fatigue-differential",
-        "title": "Unexplained Chronic Fatigue Workup",
-        "difficulty": "hard",
-        "initial_message": (
-            "32-year-old female presenting with progressive fatigue over 6 months, "
-            "not improved with rest. She reports brain fog, muscle aches, and "
-            "occasional joint pain without swelling. PMH: Hashimoto's thyroiditis "
-            "on levothyroxine 75mcg (TSH 2.1 last month). Labs: Hgb 11.2, "
-            "MCV 82, Ferritin 18 ng/mL (low normal), Vitamin D 22 ng/mL "
-            "(insufficient), ANA negative, ESR 12, CRP 0.4. She's frustrated "
-            "because 'everything looks normal.' How should I approach the workup?"
-        ),
-        "expected_pico": {
-            "patient": "young women with chronic fatigue and Hashimoto thyroiditis",
-            "intervention": "systematic diagnostic workup",
-            "comparison": "empiric symptomatic treatment",
-            "outcome": "diagnosis rate and symptom improvement",
-        },
-        "expected_keywords": ["fatigue", "fibromyalgia", "iron", "vitamin D", "Hashimoto"],
-    },
-]
+# Demo cases are the Python equivalent of app/demo/cases.ts; mock responses
+# are simulated AI output for testing without a GPU. Both live as JSON next
+# to this module and are only parsed on first access. They are shared across
+# runner threads, so they are frozen into read-only mappings and tuples.
+_EVAL_DIR = Path(__file__).parent
 
+_json_loads = orjson.loads if orjson is not None else json.loads
 
-# ============================================================================
-# Mock Responses (simulated AI output for testing without GPU)
-# ============================================================================
 
-MOCK_RESPONSES = {
-    "ASK": {
-        "diabetes-glp1": """Based on your case, I've formulated the following PICO question:
+def _json_dumps_pretty(obj: Any) -> str:
+    """Serialize a report or case result as indented JSON."""
+    if orjson is not None:
+        # orjson serializes dataclasses and enums natively
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(obj, default=_json_default, indent=2)
 
-This is a well-defined clinical scenario. The evidence suggests GLP-1 receptor agonists may offer advantages for this patient profile.
 
-Let me structure the clinical question:
+def _freeze(obj: Any) -> Any:
+    """Recursively turn parsed JSON into read-only mappings and tuples."""
+    if isinstance(obj, dict):
+        return MappingProxyType({key: _freeze(value) for key, value in obj.items()})
+    if isinstance(obj, list):
+        return tuple(_freeze(item) for item in obj)
+    return obj
 
-```json
-{
-  "type": "PICO_UPDATE",
-  "data": {
-    "patient": "elderly patients with type 2 diabetes mellitus and obesity (BMI 34), with mild CKD (eGFR 55)",
-    "intervention": "GLP-1 receptor agonists (semaglutide)",
-    "comparison": "sulfonylurea or SGLT2 inhibitors as add-on to metformin",
-    "outcome": "weight loss, cardiovascular outcomes, and glycemic control (HbA1c reduction)",
-    "completeness": 100
-  }
-}
-```""",
-        "chest-xray-pneumonia": """This is a clear presentation of community-acquired pneumonia. Consider the CURB-65 score for disposition decisions.
-
-The evidence suggests outpatient management may be appropriate with a CURB-65 of 1, though clinical judgment should account for hypoxia.
-
-```json
-{
-  "type": "PICO_UPDATE",
-  "data": {
-    "patient": "adults with community-acquired pneumonia (CURB-65 score 1, SpO2 94%)",
-    "intervention": "outpatient oral antibiotic therapy",
-    "comparison": "inpatient IV antibiotic therapy",
-    "outcome": "clinical cure rate, complications, and 30-day mortality",
-    "completeness": 100
-  }
-}
-```""",
-        "fatigue-differential": """This is a complex presentation with multiple potential contributing factors. The evidence suggests a systematic approach is warranted.
-
-Given the borderline lab values and Hashimoto's history, consider evaluating for subclinical deficiencies.
-
-```json
-{
-  "type": "PICO_UPDATE",
-  "data": {
-    "patient": "young women with chronic fatigue, Hashimoto thyroiditis, and borderline iron/vitamin D deficiency",
-    "intervention": "systematic diagnostic workup including iron repletion, vitamin D supplementation, and fibromyalgia screening",
-    "comparison": "empiric symptomatic treatment or watchful waiting",
-    "outcome": "identification of treatable cause and symptom improvement at 3 months",
-    "completeness": 100
-  }
-}
-```""",
-    },
-    "ACQUIRE": {
-        "default": """Based on the PICO question, here are relevant studies from the literature:
-
-The evidence base includes several high-quality trials. These studies were retrieved from PubMed and represent the best available evidence.
-
-```json
-{
-  "type": "REFERENCE_UPDATE",
-  "data": [
-    {
-      "id": "1",
-      "title": "Cardiovascular and renal outcomes with GLP-1 receptor agonists",
-      "source": "New England Journal of Medicine",
-      "year": "2023",
-      "type": "Meta-Analysis",
-      "relevance": "High"
-    },
-    {
-      "id": "2",
-      "title": "Comparative effectiveness of second-line antidiabetic agents",
-      "source": "The Lancet",
-      "year": "2023",
-      "type": "Systematic Review",
-      "relevance": "High"
-    },
-    {
-      "id": "3",
-      "title": "Real-world outcomes of GLP-1 agonist therapy",
-      "source": "JAMA Internal Medicine",
-      "year": "2022",
-      "type": "Cohort Study",
-      "relevance": "Medium"
-    }
-  ]
-}
-```""",
-    },
-    "APPRAISE": {
-        "default": """Critical appraisal of the retrieved evidence:
-
-The overall quality of evidence is moderate to high. Consider the following when applying these findings to your patient.
-
-```json
-{
-  "type": "APPRAISAL_UPDATE",
-  "data": [
-    {
-      "title": "Study Design",
-      "description": "Multiple RCTs and a well-conducted meta-analysis provide strong evidence for efficacy.",
-      "verdict": "Positive"
-    },
-    {
-      "title": "Population Relevance",
-      "description": "Most trials included patients with similar comorbidity profiles. Evidence suggests applicability to this patient.",
-      "verdict": "Positive"
-    },
-    {
-      "title": "Follow-up Duration",
-      "description": "Longest trial follow-up is 3 years. Long-term (>5 year) data still emerging.",
-      "verdict": "Neutral"
-    },
-    {
-      "title": "Funding Source",
-      "description": "Primary trials industry-funded, though independent meta-analyses confirm findings.",
-      "verdict": "Neutral"
-    }
-  ]
-}
-```""",
-    },
-    "APPLY": {
-        "default": """Based on the evidence appraisal, here are clinical recommendations to discuss with the patient:
-
-These recommendations should be considered in the context of individual patient factors and shared decision-making.
-
-```json
-{
-  "type": "APPLY_UPDATE",
-  "data": [
-    {
-      "action": "Consider initiating GLP-1 receptor agonist therapy",
-      "rationale": "Supported by meta-analysis showing benefit for weight loss and cardiovascular risk reduction in T2DM patients."
-    },
-    {
-      "action": "Monitor renal function closely during initiation",
-      "rationale": "Patient has mild CKD (eGFR 55); evidence suggests GLP-1 RAs are renal-safe but monitoring is prudent."
-    },
-    {
-      "action": "Discuss expected outcomes and timeline with patient",
-      "rationale": "Shared decision-making recommended; clinical judgment should guide therapy choices."
-    }
-  ]
-}
-```""",
-    },
-    "ASSESS": {
-        "default": """Outcome assessment framework to monitor treatment response:
-
-Regular monitoring will help determine if treatment goals are being met and inform clinical judgment about continuation.
-
-```json
-{
-  "type": "ASSESS_UPDATE",
-  "data": [
-    {
-      "metric": "HbA1c",
-      "target": "< 7.0% (individualized based on patient factors)",
-      "frequency": "Every 3 months"
-    },
-    {
-      "metric": "Body weight",
-      "target": "> 5% reduction from baseline",
-      "frequency": "Monthly"
-    },
-    {
-      "metric": "eGFR",
-      "target": "Stable or improved from baseline 55",
-      "frequency": "Every 3 months"
-    }
-  ]
-}
-```""",
-    },
-}
+
+@functools.cache
+def demo_cases() -> Tuple[Mapping[str, Any], ...]:
+    """Load the demo case definitions."""
+    return _freeze(_json_loads((_EVAL_DIR / "demo_cases.json").read_bytes()))
+
+
+@functools.cache
+def mock_responses() -> Mapping[str, Mapping[str, str]]:
+    """Load mock responses, keyed by phase then case ID (or "default")."""
+    return _freeze(_json_loads((_EVAL_DIR / "mock_responses.json").read_bytes()))
+
+
+def __getattr__(name: str) -> Any:
+    # Keep DEMO_CASES / MOCK_RESPONSES importable without loading them eagerly
+    if name == "DEMO_CASES":
+        return demo_cases()
+    if name == "MOCK_RESPONSES":
+        return mock_responses()
+    if name == "MOCK_RESPONSES_PARSED":
+        return mock_responses_parsed()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # ============================================================================
 # Eval Result Types
 # ============================================================================
 
-@dataclass
+@dataclass(slots=True)
 class PhaseResult:
     """Result for a single EBP phase evaluation."""
     phase: str
@@ -304,7 +114,7 @@ class PhaseResult:
     issues: List[str] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(slots=True)
 class CaseResult:
     """Result for a complete demo case evaluation."""
     case_id: str
@@ -316,7 +126,7 @@ class CaseResult:
     duration_seconds: float = 0.0
 
 
-@dataclass
+@dataclass(slots=True)
 class EvalReport:
     """Full evaluation report across all demo cases."""
     timestamp: str
@@ -336,52 +146,187 @@ class EvalReport:
         )
 
 
+def _to_dict(obj: Any) -> Any:
+    """Like dataclasses.asdict, but without deep-copying leaf values."""
+    if is_dataclass(obj):
+        return {f.name: _to_dict(getattr(obj, f.name)) for f in fields(obj)}
+    if isinstance(obj, list):
+        return [_to_dict(item) for item in obj]
+    return obj
+
+
+def _json_default(obj: Any) -> Any:
+    """json.dumps hook that serializes dataclasses and enums at emit time."""
+    if is_dataclass(obj):
+        return {f.name: getattr(obj, f.name) for f in fields(obj)}
+    if isinstance(obj, Enum):
+        return obj.value
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
 # ============================================================================
 # JSON Extraction (mirrors frontend extractJson)
 # ============================================================================
 
-import re
-
-def extract_json(text: str) -> tuple:
-    """Extract JSON block from AI response text."""
-    pattern = re.compile(r'```(?:json)?\s*(\{[\s\S]*?\})\s*```', re.IGNORECASE)
-    match = pattern.search(text)
-    if match:
+_FENCE = "```"
+
+
+def _find_json_block(text: str) -> Optional[tuple]:
+    r"""Locate the first fenced JSON object block with plain str.find scans.
+
+    Matches what the frontend's /```(?:json)?\s*(\{[\s\S]*?\})\s*```/i finds:
+    a fence, an optional "json" tag, then a {...} payload closed by the
+    nearest fence. Returns (block_start, block_end, payload) or None.
+    """
+    n = len(text)
+    open_at = text.find(_FENCE)
+    while open_at != -1:
+        pos = open_at + len(_FENCE)
+        if text[pos:pos + 4].lower() == "json":
+            pos += 4
+        while pos < n and text[pos].isspace():
+            pos += 1
+        if text.startswith("{", pos):
+            close_at = text.find(_FENCE, pos)
+            while close_at != -1:
+                payload = text[pos:close_at].rstrip()
+                if payload.endswith("}"):
+                    return open_at, close_at + len(_FENCE), payload
+                close_at = text.find(_FENCE, close_at + 1)
+        open_at = text.find(_FENCE, open_at + 1)
+    return None
+
+
+def _extract_json(text: str) -> tuple:
+    """Extract JSON block from AI response text (uncached)."""
+    block = _find_json_block(text)
+    if block:
+        start, end, payload = block
         try:
-            data = json.loads(match.group(1))
-            clean_text = pattern.sub('', text).strip()
+            data = _json_loads(payload)
+            # Like the frontend's non-global replace, drop only the matched block
+            clean_text = (text[:start] + text[end:]).strip()
             return clean_text, data
-        except json.JSONDecodeError:
+        except ValueError:  # json and orjson decode errors both subclass it
             pass
     return text, None
 
 
+@functools.lru_cache(maxsize=256)
+def _extract_json_cached(text: str) -> tuple:
+    """_extract_json memoized per text; the returned data is shared, so never mutate it."""
+    return _extract_json(text)
+
+
+def extract_json(text: str) -> tuple:
+    """Extract JSON block from AI response text.
+
+    Parsing is cached per text, since mock responses and test fixtures are
+    extracted over and over; each call returns its own copy of the data.
+    """
+    clean_text, data = _extract_json_cached(text)
+    return clean_text, copy.deepcopy(data)
+
+
+def _has_json_block(text: str) -> bool:
+    """True once text contains a complete, parseable JSON block."""
+    # Called on every decoded prefix while generating; bypass the cache so
+    # one-off prefixes don't evict the responses worth keeping
+    return _extract_json(text)[1] is not None
+
+
+@functools.cache
+def mock_responses_parsed() -> Mapping[str, Mapping[str, Any]]:
+    """The JSON block of every mock response (None where there is none), by phase then key."""
+    return _freeze({
+        phase: {key: _extract_json_cached(text)[1] for key, text in responses.items()}
+        for phase, responses in mock_responses().items()
+    })
+
+
 # ============================================================================
 # Eval Runner
 # ============================================================================
 
+# User prompt for each phase after ASK (which uses the case's initial message)
+PHASE_PROMPTS = {
+    "ACQUIRE": "Please find evidence relevant to the PICO question we formulated.",
+    "APPRAISE": "Can you critically appraise the quality of these studies?",
+    "APPLY": "Based on this evidence, what specific interventions should I recommend?",
+    "ASSESS": "What outcomes should I track to measure treatment success?",
+}
+
+
+@functools.lru_cache(maxsize=64)
+def _system_prompt(phase: str, case_title: str) -> str:
+    """Build the system prompt for a phase (cached per phase and case)."""
+    return f"""You are MedGemma, an expert EBP Copilot.
+Current Phase: {phase}
+Patient Context: {case_title}
+
+Guide the user through the EBP cycle. Output structured JSON data blocks."""
+
+
+# JSON update type -> (state key, expected data type, how to merge into state)
+_STATE_UPDATERS = {
+    "PICO_UPDATE": ("pico", dict, dict.update),
+    "REFERENCE_UPDATE": ("references", list, list.extend),
+    "APPRAISAL_UPDATE": ("appraisals", list, list.extend),
+    "APPLY_UPDATE": ("applyPoints", list, list.extend),
+    "ASSESS_UPDATE": ("assessPoints", list, list.extend),
+}
+
+
 class EvalRunner:
     """Runs demo cases through the EBP workflow and validates outputs."""
 
     PHASES = ["ASK", "ACQUIRE", "APPRAISE", "APPLY", "ASSESS"]
 
-    def __init__(self, model=None, mock: bool = True):
+    def __init__(
+        self,
+        model=None,
+        mock: bool = True,
+        stop_after_json: bool = True,
+        fail_fast: bool = True,
+        parallel: bool = True,
+    ):
         self.model = model
         self.mock = mock
+        # Stop real-model decoding once the phase's JSON block has closed
+        self.stop_after_json = stop_after_json
+        # In mock mode, stop a case at its first safety error (the case fails anyway)
+        self.fail_fast = fail_fast
+        # Fan mock cases out over a thread pool (results keep DEMO_CASES order)
+        self.parallel = parallel
         self.citation_validator = CitationValidator()
         self.completeness_checker = CompletenessChecker()
         self.safety_checker = SafetyChecker()
 
     def run_all(self) -> EvalReport:
-        """Run evaluation on all demo cases."""
+        """Run evaluation on all demo cases.
+
+        In mock mode each case is independent (validators hold no state), so
+        cases are fanned out over a thread pool unless parallel=False.
+        Real-model runs share a single GPU, so phases are batched across cases
+        when the model supports generate_batch, and run sequentially otherwise.
+        """
         report = EvalReport(
             timestamp=time.strftime("%Y-%m-%d %H:%M:%S"),
             mode="mock" if self.mock else "model",
             model_id=getattr(self.model, "model_id", None) if self.model else None,
         )
 
-        for case in DEMO_CASES:
-            case_result = self.run_case(case)
+        cases = demo_cases()
+        if self.mock and self.parallel:
+            max_workers = min(len(cases), os.cpu_count() or 1)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                case_results = list(executor.map(self.run_case, cases))
+        elif not self.mock and hasattr(self.model, "generate_batch"):
+            case_results = self._run_cases_batched(cases)
+        else:
+            case_results = [self.run_case(case) for case in cases]
+
+        for case_result in case_results:
             report.cases.append(case_result)
             if not case_result.passed:
                 report.overall_passed = False
@@ -390,15 +335,63 @@ class EvalRunner:
         report.passed_cases = sum(1 for c in report.cases if c.passed)
         return report
 
-    def run_case(self, case: Dict[str, Any]) -> CaseResult:
+    def run_case(self, case: Mapping[str, Any]) -> CaseResult:
         """Run a single demo case through the full EBP workflow."""
         start = time.time()
         case_id = case["id"]
-        case_title = case["title"]
         phase_results = []
 
         # Track accumulated state
-        accumulated_state = {
+        accumulated_state = self._new_state()
+
+        for phase in self.PHASES:
+            # Get response (mock or real) and extract JSON
+            if self.mock:
+                clean_text, json_data = self._get_mock_extracted(phase, case_id)
+            else:
+                response = self._get_model_response(phase, case, accumulated_state)
+                clean_text, json_data = extract_json(response)
+
+            phase_result = self._evaluate_phase(phase, clean_text, json_data, accumulated_state)
+            phase_results.append(phase_result)
+
+            if self.fail_fast and self.mock and any(
+                "Safety:" in issue for issue in phase_result.issues
+            ):
+                break
+
+        return self._finish_case(case, phase_results, accumulated_state, time.time() - start)
+
+    def _run_cases_batched(self, cases: Sequence[Mapping[str, Any]]) -> List[CaseResult]:
+        """Run cases phase by phase, issuing one batched generate call per phase."""
+        start = time.time()
+        states = [self._new_state() for _ in cases]
+        phase_results = [[] for _ in cases]
+
+        for phase in self.PHASES:
+            prompts, system_prompts = zip(*(self._build_prompts(phase, case) for case in cases))
+            responses = self.model.generate_batch(
+                prompts=list(prompts),
+                system_prompts=list(system_prompts),
+                max_new_tokens=512,
+                stop_when=self._stop_when(),
+            )
+            for case_phase_results, state, response in zip(phase_results, states, responses):
+                clean_text, json_data = extract_json(response)
+                case_phase_results.append(
+                    self._evaluate_phase(phase, clean_text, json_data, state)
+                )
+
+        # Batched cases share the same wall-clock time
+        duration = time.time() - start
+        return [
+            self._finish_case(case, case_phase_results, state, duration)
+            for case, case_phase_results, state in zip(cases, phase_results, states)
+        ]
+
+    def _new_state(self) -> Dict[str, Any]:
+        """Create an empty accumulated workflow state."""
+        return {
             "pico": {},
             "references": [],
             "appraisals": [],
@@ -406,61 +399,51 @@ class EvalRunner:
             "assessPoints": [],
         }
 
-        all_issues = []
-
-        for phase in self.PHASES:
-            # Get response (mock or real)
-            if self.mock:
-                response = self._get_mock_response(phase, case_id)
-            else:
-                response = self._get_model_response(phase, case, accumulated_state)
+    def _evaluate_phase(
+        self, phase: str, clean_text: str, json_data: Optional[Dict], state: Dict
+    ) -> PhaseResult:
+        """Fold one phase response into the state and validate it."""
+        # Update accumulated state from extracted JSON
+        if json_data:
+            self._update_state(state, json_data)
+
+        # Validate safety
+        safety_result = self.safety_checker.check(clean_text)
+
+        # Validate citations (only in ACQUIRE/APPRAISE/APPLY phases)
+        citation_result = None
+        if phase in ("ACQUIRE", "APPRAISE", "APPLY") and state["references"]:
+            ref_dicts = state["references"]
+            citation_result = self.citation_validator.validate(clean_text, ref_dicts)
+
+        # Collect issues
+        issues = [f"[{phase}] Safety: {v.reason}" for v in safety_result.error_violations]
+        if citation_result:
+            issues.extend(f"[{phase}] Citation: {v.reason}" for v in citation_result.error_violations)
+
+        if not json_data and phase != "ASSESS":
+            # ASSESS can be the final phase; others should have JSON
+            issues.append(f"[{phase}] No structured JSON data extracted")
+
+        return PhaseResult(
+            phase=phase,
+            response_text=clean_text[:200] + "..." if len(clean_text) > 200 else clean_text,
+            json_extracted=json_data is not None,
+            json_data=json_data,
+            citation_result=_to_dict(citation_result) if citation_result else None,
+            safety_result=_to_dict(safety_result),
+            issues=issues,
+        )
 
-            # Extract JSON
-            clean_text, json_data = extract_json(response)
-
-            # Update accumulated state from extracted JSON
-            if json_data:
-                self._update_state(accumulated_state, json_data)
-
-            # Validate safety
-            safety_result = self.safety_checker.check(clean_text)
-
-            # Validate citations (only in ACQUIRE/APPRAISE/APPLY phases)
-            citation_result = None
-            if phase in ("ACQUIRE", "APPRAISE", "APPLY") and accumulated_state["references"]:
-                ref_dicts = accumulated_state["references"]
-                citation_result = self.citation_validator.validate(clean_text, ref_dicts)
-
-            # Collect issues
-            issues = []
-            if not safety_result.passed:
-                for v in safety_result.violations:
-                    if v.severity == "error":
-                        issues.append(f"[{phase}] Safety: {v.reason}")
-
-            if citation_result and not citation_result.passed:
-                for v in citation_result.violations:
-                    if v.severity == "error":
-                        issues.append(f"[{phase}] Citation: {v.reason}")
-
-            if not json_data and phase != "ASSESS":
-                # ASSESS can be the final phase; others should have JSON
-                issues.append(f"[{phase}] No structured JSON data extracted")
-
-            all_issues.extend(issues)
-
-            phase_results.append(PhaseResult(
-                phase=phase,
-                response_text=clean_text[:200] + "..." if len(clean_text) > 200 else clean_text,
-                json_extracted=json_data is not None,
-                json_data=json_data,
-                citation_result=asdict(citation_result) if citation_result else None,
-                safety_result=asdict(safety_result),
-                issues=issues,
-            ))
-
-        # Final completeness check
-        completeness_result = self.completeness_checker.check_workflow(accumulated_state)
+    def _finish_case(
+        self,
+        case: Mapping[str, Any],
+        phase_results: List[PhaseResult],
+        state: Dict,
+        duration: float,
+    ) -> CaseResult:
+        """Run the final completeness check and build the case result."""
+        completeness_result = self.completeness_checker.check_workflow(state)
 
         # Determine pass/fail
         has_errors = any(
@@ -469,69 +452,60 @@ class EvalRunner:
         )
         passed = completeness_result.passed and not has_errors
 
-        duration = time.time() - start
-
         return CaseResult(
-            case_id=case_id,
-            case_title=case_title,
+            case_id=case["id"],
+            case_title=case["title"],
             passed=passed,
             phase_results=phase_results,
-            completeness_result=asdict(completeness_result),
-            total_issues=len(all_issues),
+            completeness_result=_to_dict(completeness_result),
+            total_issues=sum(len(pr.issues) for pr in phase_results),
             duration_seconds=round(duration, 2),
         )
 
     def _get_mock_response(self, phase: str, case_id: str) -> str:
         """Get a mock response for testing."""
-        phase_responses = MOCK_RESPONSES.get(phase, {})
+        phase_responses = mock_responses().get(phase, {})
         # Try case-specific first, then default
         return phase_responses.get(case_id, phase_responses.get("default", "No response available."))
 
+    def _get_mock_extracted(self, phase: str, case_id: str) -> tuple:
+        """Get the (clean_text, json_data) extraction of a mock response."""
+        return extract_json(self._get_mock_response(phase, case_id))
+
     def _get_model_response(
-        self, phase: str, case: Dict, state: Dict
+        self, phase: str, case: Mapping, state: Dict
     ) -> str:
         """Get a real model response."""
         if not self.model:
             raise RuntimeError("No model loaded for non-mock evaluation")
 
-        # Build appropriate prompt for each phase
-        prompts = {
-            "ASK": case["initial_message"],
-            "ACQUIRE": "Please find evidence relevant to the PICO question we formulated.",
-            "APPRAISE": "Can you critically appraise the quality of these studies?",
-            "APPLY": "Based on this evidence, what specific interventions should I recommend?",
-            "ASSESS": "What outcomes should I track to measure treatment success?",
-        }
-
-        system_prompt = f"""You are MedGemma, an expert EBP Copilot.
-Current Phase: {phase}
-Patient Context: {case.get('title', '')}
-
-Guide the user through the EBP cycle. Output structured JSON data blocks."""
-
+        prompt, system_prompt = self._build_prompts(phase, case)
         return self.model.generate(
-            prompt=prompts[phase],
+            prompt=prompt,
             system_prompt=system_prompt,
             max_new_tokens=512,
+            stop_when=self._stop_when(),
         )
 
+    def _stop_when(self):
+        """Early-stop predicate handed to the model, if enabled."""
+        return _has_json_block if self.stop_after_json else None
+
+    def _build_prompts(self, phase: str, case: Mapping) -> tuple:
+        """Build the (user prompt, system prompt) pair for a phase."""
+        prompt = case["initial_message"] if phase == "ASK" else PHASE_PROMPTS[phase]
+        return prompt, _system_prompt(phase, case.get("title", ""))
+
     def _update_state(self, state: Dict, json_data: Dict) -> None:
         """Update accumulated state from extracted JSON data."""
-        data_type = json_data.get("type", "")
-        data = json_data.get("data")
-        if not data:
+        updater = _STATE_UPDATERS.get(json_data.get("type", ""))
+        if updater is None:
             return
 
-        if data_type == "PICO_UPDATE" and isinstance(data, dict):
-            state["pico"].update(data)
-        elif data_type == "REFERENCE_UPDATE" and isinstance(data, list):
-            state["references"].extend(data)
-        elif data_type == "APPRAISAL_UPDATE" and isinstance(data, list):
-            state["appraisals"].extend(data)
-        elif data_type == "APPLY_UPDATE" and isinstance(data, list):
-            state["applyPoints"].extend(data)
-        elif data_type == "ASSESS_UPDATE" and isinstance(data, list):
-            state["assessPoints"].extend(data)
+        key, expected_type, apply_update = updater
+        data = json_data.get("data")
+        if data and isinstance(data, expected_type):
+            apply_update(state[key], data)
 
 
 # ============================================================================
@@ -540,45 +514,51 @@ Guide the user through the EBP cycle. Output structured JSON data blocks."""
 
 def print_report(report: EvalReport) -> None:
     """Print a human-readable evaluation report."""
-    print("\n" + "=" * 70)
-    print("  MEDGEMMA EBP COPILOT - EVALUATION REPORT")
-    print("=" * 70)
-    print(f"  Timestamp: {report.timestamp}")
-    print(f"  Mode:      {report.mode}")
+    # Collect lines and write once rather than locking/flushing stdout per line
+    lines = []
+    out = lines.append
+
+    out("\n" + "=" * 70)
+    out("  MEDGEMMA EBP COPILOT - EVALUATION REPORT")
+    out("=" * 70)
+    out(f"  Timestamp: {report.timestamp}")
+    out(f"  Mode:      {report.mode}")
     if report.model_id:
-        print(f"  Model:     {report.model_id}")
-    print(f"  Result:    {'PASS' if report.overall_passed else 'FAIL'}")
-    print(f"  Cases:     {report.passed_cases}/{report.total_cases} passed")
-    print("=" * 70)
+        out(f"  Model:     {report.model_id}")
+    out(f"  Result:    {'PASS' if report.overall_passed else 'FAIL'}")
+    out(f"  Cases:     {report.passed_cases}/{report.total_cases} passed")
+    out("=" * 70)
 
     for case in report.cases:
         status = "PASS" if case.passed else "FAIL"
-        print(f"\n{'─' * 60}")
-        print(f"  Case: {case.case_title}")
-        print(f"  ID:   {case.case_id}")
-        print(f"  Result: {status} ({case.duration_seconds}s)")
-        print(f"{'─' * 60}")
+        out(f"\n{'─' * 60}")
+        out(f"  Case: {case.case_title}")
+        out(f"  ID:   {case.case_id}")
+        out(f"  Result: {status} ({case.duration_seconds}s)")
+        out(f"{'─' * 60}")
 
         for pr in case.phase_results:
             json_icon = "+" if pr.json_extracted else "-"
             issues_str = f" [{len(pr.issues)} issues]" if pr.issues else ""
-            print(f"  [{pr.phase:8s}] JSON:{json_icon}{issues_str}")
+            out(f"  [{pr.phase:8s}] JSON:{json_icon}{issues_str}")
             for issue in pr.issues:
-                print(f"           ! {issue}")
+                out(f"           ! {issue}")
 
         if case.completeness_result:
             score = case.completeness_result.get("score", 0)
             c_passed = case.completeness_result.get("passed", False)
             c_status = "PASS" if c_passed else "FAIL"
-            print(f"  [COMPLETE] {c_status} ({score:.0%})")
+            out(f"  [COMPLETE] {c_status} ({score:.0%})")
             for fc in case.completeness_result.get("field_checks", []):
                 quality = fc.get("quality", "unknown")
                 name = fc.get("field_name", "?")
-                print(f"    {name:12s}: {quality}")
+                out(f"    {name:12s}: {quality}")
 
-    print("\n" + "=" * 70)
-    print(f"  OVERALL: {'PASS' if report.overall_passed else 'FAIL'}")
-    print("=" * 70 + "\n")
+    out("\n" + "=" * 70)
+    out(f"  OVERALL: {'PASS' if report.overall_passed else 'FAIL'}")
+    out("=" * 70 + "\n")
+
+    print("\n".join(lines))
 
 
 # ============================================================================
@@ -604,8 +584,8 @@ def main():
         use_mock = False
         # Import and load real model
         try:
-            from test_medgemma_local import MedGemmaModel
-            model = MedGemmaModel(args.model)
+            from test_medgemma_local import get_medgemma
+            model = get_medgemma(args.model)
         except Exception as e:
             print(f"Failed to load model: {e}")
             print("Falling back to mock mode.")
@@ -615,35 +595,35 @@ def main():
 
     if args.case:
         # Run single case
-        case = next((c for c in DEMO_CASES if c["id"] == args.case), None)
+        case = next((c for c in demo_cases() if c["id"] == args.case), None)
         if not case:
             print(f"Unknown case ID: {args.case}")
-            print(f"Available: {[c['id'] for c in DEMO_CASES]}")
+            print(f"Available: {[c['id'] for c in demo_cases()]}")
             sys.exit(1)
         result = runner.run_case(case)
+        # Wrap in a minimal report for printing and the exit code
+        report = EvalReport(
+            timestamp=time.strftime("%Y-%m-%d %H:%M:%S"),
+            mode="mock" if use_mock else "model",
+            model_id=args.model,
+            cases=[result],
+            overall_passed=result.passed,
+            total_cases=1,
+            passed_cases=1 if result.passed else 0,
+        )
         if args.json:
-            print(json.dumps(asdict(result), indent=2))
+            print(_json_dumps_pretty(result))
         else:
-            # Wrap in a minimal report for printing
-            report = EvalReport(
-                timestamp=time.strftime("%Y-%m-%d %H:%M:%S"),
-                mode="mock" if use_mock else "model",
-                model_id=args.model,
-                cases=[result],
-                overall_passed=result.passed,
-                total_cases=1,
-                passed_cases=1 if result.passed else 0,
-            )
             print_report(report)
     else:
         # Run all cases
         report = runner.run_all()
         if args.json:
-            print(json.dumps(asdict(report), indent=2))
+            print(_json_dumps_pretty(report))
         else:
             print_report(report)
 
-    sys.exit(0 if (runner.run_all() if not args.case else report).overall_passed else 1)
+    sys.exit(0 if report.overall_passed else 1)
 
 
 if __name__ == "__main__":
@@ -11,29 +11,60 @@ Gemma model.
 
 Usage:
     pip install fastapi uvicorn transformers accelerate pillow torch google-genai
+    pip install hf_transfer  # optional: multi-connection weight downloads
     GOOGLE_API_KEY=... python medgemma_backend.py
 
+Set HF_HOME (or HUGGINGFACE_HUB_CACHE) to a persistent volume so weights
+downloaded once are reused across restarts.
+
 The frontend app connects by setting:
     VITE_USE_LOCAL_BACKEND=true
     VITE_BACKEND_URL=http://localhost:8000
 """
 
 import os
+import asyncio
 import base64
+import copy
+import functools
+import hashlib
+import importlib.util
 import io
+import json
 import logging
-from typing import List, Optional
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
 from pathlib import Path
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, ValidationError
+
+try:
+    import pybase64 as b64  # SIMD base64 codec, same API as the stdlib module
+except ImportError:
+    b64 = base64
 
-from model_resolver import resolve_model_id
+from model_resolver import kaggle_model_dirs, resolve_model_id
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("medgemma-backend")
 
+# Allocator settings must be in place before torch initializes CUDA. Expandable
+# segments keep large KV allocations contiguous as request sizes vary.
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True,max_split_size_mb:128")
+
+# Use the Rust multi-connection downloader when it is installed. huggingface_hub
+# reads this at import time and fails if it is set without hf_transfer present.
+if importlib.util.find_spec("hf_transfer") is not None:
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+
 # Lazy imports for heavy libs
 transformers = None
 torch = None
@@ -83,13 +114,60 @@ def _get_device_info():
     elif device == "cuda":
         dtype = torch.float16
     else:
-        dtype = torch.float32
+        # MedGemma checkpoints ship in bf16; keep them there instead of
+        # upcasting to fp32, which doubles RAM and memory traffic per token
+        dtype = torch.bfloat16
     return device, dtype
 
 
 # Model cache for local HF models
 _loaded_models = {}
 _loaded_processors = {}
+# Requested model_id -> key in _loaded_models, so cache hits skip resolution
+_resolved_model_ids = {}
+
+# Aliases that point at the same weights; normalized so they share one copy
+CANONICAL_MODEL_IDS = {
+    "medgemma-4b-it": "google/medgemma-4b-it",
+    "google/medgemma-1.5-4b-it": "google/medgemma-4b-it",
+}
+
+# Model-ID keywords marking vision-capable and MedGemma-format checkpoints
+MULTIMODAL_KEYWORDS = ('4b', 'mm', 'vision', 'multimodal')
+MEDGEMMA_KEYWORDS = ('medgemma', '4b-it')
+
+
+@functools.lru_cache(maxsize=64)
+def _is_multimodal_model(model_id: str) -> bool:
+    model_id = model_id.lower()
+    return any(kw in model_id for kw in MULTIMODAL_KEYWORDS)
+
+
+@functools.lru_cache(maxsize=64)
+def _is_medgemma_model(model_id: str) -> bool:
+    """MedGemma chat templates take structured [{"type": "text", ...}] content."""
+    model_id = model_id.lower()
+    return any(kw in model_id for kw in MEDGEMMA_KEYWORDS)
+
+
+# Preferred multimodal model classes, newest transformers API first
+MULTIMODAL_MODEL_CLASS_NAMES = ('AutoModelForImageTextToText', 'AutoModelForVision2Seq', 'AutoModelForCausalLM')
+_multimodal_model_cls = None
+
+
+def _get_multimodal_model_class():
+    """Resolve the multimodal Auto* class available in this transformers install, once."""
+    global _multimodal_model_cls
+    if _multimodal_model_cls is None:
+        ensure_transformers()
+        _multimodal_model_cls = next(
+            (getattr(transformers, name) for name in MULTIMODAL_MODEL_CLASS_NAMES
+             if hasattr(transformers, name)),
+            None,
+        )
+        if _multimodal_model_cls is None:
+            raise RuntimeError("No suitable multimodal model class found")
+    return _multimodal_model_cls
 
 # Map frontend model IDs to Google AI API model names
 GOOGLE_AI_MODEL_MAP = {
@@ -128,17 +206,27 @@ CLOUD_ONLY_MODELS = {
 # Default cloud model when no specific mapping found
 DEFAULT_CLOUD_MODEL = os.getenv("GOOGLE_CLOUD_MODEL", "gemma-3-4b-it")
 
+# Seconds before a stuck Google AI call is abandoned
+GOOGLE_AI_TIMEOUT = float(os.getenv("GOOGLE_AI_TIMEOUT", "120"))
+
 
 # === Pydantic Models ===
+# Requests are read-only once validated; extra frontend UI fields are dropped
+# by pydantic's default extra="ignore"
+_REQUEST_CONFIG = ConfigDict(frozen=True)
+
 class ImageData(BaseModel):
+    model_config = _REQUEST_CONFIG
     mimeType: str
     data: str  # base64
 
 class HistoryMessage(BaseModel):
+    model_config = _REQUEST_CONFIG
     role: str
     content: str
 
 class GenerateRequest(BaseModel):
+    model_config = _REQUEST_CONFIG
     model_id: str
     history: List[HistoryMessage] = []
     message: str
@@ -150,6 +238,22 @@ class GenerateResponse(BaseModel):
     text: str
     model_used: str
 
+class HealthResponse(BaseModel):
+    status: str
+    device: str
+    gpu: Optional[str] = None
+    vram_gb: float
+    vram_allocated_gb: float
+    vram_reserved_gb: float
+    google_ai_available: bool
+    loaded_models: List[str]
+    local_medgemma_available: bool
+
+class ModelsResponse(BaseModel):
+    local_models: List[str]
+    cloud_models: List[str]
+    suggested: Dict[str, str]
+
 
 # === Local Model helpers ===
 def _is_local_model_available(model_id: str) -> bool:
@@ -171,21 +275,75 @@ def _is_local_model_available(model_id: str) -> bool:
     return False
 
 
+# Files needed to load a checkpoint; skips duplicate .bin / .gguf / .pt weights
+CHECKPOINT_ALLOW_PATTERNS = ["*.safetensors", "*.json", "tokenizer*", "*.model"]
+# Used instead for repos that only ship PyTorch pickle weights
+BIN_CHECKPOINT_ALLOW_PATTERNS = ["*.bin", "*.json", "tokenizer*", "*.model"]
+
+
+def _has_safetensors(checkpoint: str) -> bool:
+    return any(Path(checkpoint).glob("*.safetensors"))
+
+
+def _local_checkpoint(model_id: str) -> str:
+    """Return a local directory for model_id, fetching its weights into the HF cache if needed.
+
+    Safetensors are preferred; a repo without any falls back to its .bin weights.
+    """
+    if Path(model_id).exists():
+        return model_id
+    try:
+        from huggingface_hub import snapshot_download
+        checkpoint = snapshot_download(model_id, allow_patterns=CHECKPOINT_ALLOW_PATTERNS)
+        if not _has_safetensors(checkpoint):
+            logger.info(f"No safetensors in {model_id}; fetching .bin weights")
+            checkpoint = snapshot_download(model_id, allow_patterns=BIN_CHECKPOINT_ALLOW_PATTERNS)
+        return checkpoint
+    except Exception as e:
+        logger.warning(f"snapshot_download failed for {model_id}: {e}; loading by hub ID")
+        return model_id
+
+
+# Weight precision for local models: bf16 (default), int8, or nf4 (4-bit).
+# Pre-quantized checkpoints (AWQ, GPTQ) carry their own config and load as-is.
+QUANTIZATION = os.getenv("QUANTIZATION", "bf16").lower()
+
+
+def _quantization_config(device: str, dtype):
+    """Build a bitsandbytes config for QUANTIZATION, or None to load full weights."""
+    if QUANTIZATION in ("bf16", "none", ""):
+        return None
+    if device != "cuda":
+        logger.warning(f"QUANTIZATION={QUANTIZATION} needs CUDA; loading {dtype} weights")
+        return None
+    if QUANTIZATION == "int8":
+        return transformers.BitsAndBytesConfig(load_in_8bit=True)
+    if QUANTIZATION == "nf4":
+        return transformers.BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_compute_dtype=dtype,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_use_double_quant=True,
+        )
+    raise ValueError(f"Unsupported QUANTIZATION={QUANTIZATION!r}; use bf16, int8 or nf4")
+
+
 def get_model_and_processor(model_id: str):
     """Load and cache a local HuggingFace model/processor."""
+    cached_id = _resolved_model_ids.get(model_id)
+    if cached_id in _loaded_models:
+        return _loaded_models[cached_id], _loaded_processors[cached_id]
+
     ensure_transformers()
 
+    requested_id = model_id
     resolved_id = resolve_model_id(model_id)
     if resolved_id != model_id:
         logger.info(f"Resolved model_id '{model_id}' -> '{resolved_id}'")
 
     # Normalize medgemma aliases to the canonical HF ID
-    canonical = {
-        "medgemma-4b-it": "google/medgemma-4b-it",
-        "google/medgemma-1.5-4b-it": "google/medgemma-4b-it",
-    }
-    resolved_id = canonical.get(resolved_id, resolved_id)
-    model_id = resolved_id
+    model_id = CANONICAL_MODEL_IDS.get(resolved_id, resolved_id)
+    _resolved_model_ids[requested_id] = model_id
 
     if model_id in _loaded_models:
         return _loaded_models[model_id], _loaded_processors[model_id]
@@ -193,28 +351,40 @@ def get_model_and_processor(model_id: str):
     device, dtype = _get_device_info()
     logger.info(f"Loading local model: {model_id} (device={device}, dtype={dtype})")
 
-    is_multimodal = any(kw in model_id.lower() for kw in ['4b', 'mm', 'vision', 'multimodal'])
+    is_multimodal = _is_multimodal_model(model_id)
+    checkpoint = _local_checkpoint(model_id)
 
     if is_multimodal:
-        for cls_name in ['AutoModelForImageTextToText', 'AutoModelForVision2Seq', 'AutoModelForCausalLM']:
-            try:
-                ModelClass = getattr(transformers, cls_name)
-                break
-            except AttributeError:
-                continue
-        else:
-            raise RuntimeError("No suitable multimodal model class found")
-        processor = transformers.AutoProcessor.from_pretrained(model_id)
+        ModelClass = _get_multimodal_model_class()
+        processor = transformers.AutoProcessor.from_pretrained(checkpoint, use_fast=True)
     else:
         ModelClass = transformers.AutoModelForCausalLM
-        processor = transformers.AutoTokenizer.from_pretrained(model_id)
+        processor = transformers.AutoTokenizer.from_pretrained(checkpoint, use_fast=True)
 
+    # With a device_map, from_pretrained builds the module on the meta device
+    # (accelerate's init_empty_weights) and streams each shard straight to its
+    # target device, so host RAM never holds a full materialized copy.
+    quantization = _quantization_config(device, dtype)
     model = ModelClass.from_pretrained(
-        model_id,
-        device_map="auto" if device == "cuda" else None,
-        torch_dtype=dtype if device == "cuda" else None,
+        checkpoint,
+        device_map="auto" if device == "cuda" else device,
+        torch_dtype=dtype,
+        low_cpu_mem_usage=True,
+        # None lets transformers load .bin weights when there are no safetensors
+        use_safetensors=True if _has_safetensors(checkpoint) else None,
+        **({"quantization_config": quantization} if quantization is not None else {}),
     )
 
+    # Compile the forward pass so decode steps can be captured as CUDA graphs.
+    # Wrapping the module itself would leave .generate() on the eager forward.
+    # bitsandbytes kernels don't trace, so quantized models stay eager.
+    if device == "cuda" and quantization is None and os.getenv("TORCH_COMPILE", "1") == "1":
+        model.forward = torch.compile(model.forward, mode="reduce-overhead", dynamic=True)
+        # Pre-allocated KV cache: no per-step reallocation, so the decode step
+        # can be graph-captured. generate() keeps the cache on the model and
+        # reuses it for later calls whenever it is large enough.
+        model.generation_config.cache_implementation = "static"
+
     _loaded_models[model_id] = model
     _loaded_processors[model_id] = processor
     logger.info(f"Model loaded on {device} with dtype {dtype}")
@@ -224,11 +394,281 @@ def get_model_and_processor(model_id: str):
 def decode_base64_image(image_data: ImageData):
     """Decode base64 image to PIL Image."""
     ensure_transformers()
-    image_bytes = base64.b64decode(image_data.data)
+    image_bytes = b64.b64decode(image_data.data, validate=False)
     return Image.open(io.BytesIO(image_bytes)).convert("RGB")
 
 
+def decode_base64_images(images: List[ImageData]) -> list:
+    """Decode a request's images in one call, meant to run in a worker thread."""
+    return [decode_base64_image(img) for img in images]
+
+
+def _release_cuda_memory():
+    """Return transient generation buffers to the driver between requests."""
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+# === Local generation batching ===
+class GenerateBatcher:
+    """
+    Coalesce concurrent local generations into one padded model.generate call.
+
+    Requests that arrive within ``max_delay`` seconds of each other and share
+    a model and generation settings are left-padded into a single batch, so
+    the memory-bound decode loop serves N requests for roughly the cost of
+    one. Inputs carrying image tensors are generated on their own.
+    """
+
+    BATCHABLE_KEYS = {"input_ids", "attention_mask", "token_type_ids"}
+
+    def __init__(self, max_batch_size: int = 8, max_delay: float = 0.05):
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._pending = {}
+        # Batches run in worker threads; keep one on the device at a time
+        self.device_lock = threading.Lock()
+
+    async def submit(self, model, processor, inputs: dict, gen_kwargs: dict):
+        """Queue one tokenized request and return its newly generated token IDs."""
+        loop = asyncio.get_running_loop()
+        if self.max_batch_size <= 1 or not self._is_batchable(inputs):
+            results = await loop.run_in_executor(
+                None, self._run_batch, model, processor, [inputs], gen_kwargs
+            )
+            return results[0]
+
+        key = (id(model), tuple(sorted(gen_kwargs.items())))
+        future = loop.create_future()
+        if key not in self._pending:
+            timer = loop.call_later(self.max_delay, self._flush, key)
+            self._pending[key] = (model, processor, gen_kwargs, [], timer)
+        batch = self._pending[key][3]
+        batch.append((inputs, future))
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        return await future
+
+    def _is_batchable(self, inputs: dict) -> bool:
+        input_ids = inputs.get("input_ids")
+        return (
+            set(inputs) <= self.BATCHABLE_KEYS
+            and input_ids is not None
+            and input_ids.shape[0] == 1
+        )
+
+    def _flush(self, key):
+        entry = self._pending.pop(key, None)
+        if entry is None:
+            return
+        model, processor, gen_kwargs, batch, timer = entry
+        # A batch that filled up early must not leave its timer to flush the
+        # next batch opened under the same key before its own max_delay
+        timer.cancel()
+        asyncio.get_running_loop().create_task(
+            self._dispatch(model, processor, gen_kwargs, batch)
+        )
+
+    async def _dispatch(self, model, processor, gen_kwargs, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                None, self._run_batch, model, processor,
+                [inputs for inputs, _ in batch], gen_kwargs,
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), tokens in zip(batch, results):
+            if not future.done():
+                future.set_result(tokens)
+
+    def _run_batch(self, model, processor, batch_inputs: list, gen_kwargs: dict) -> list:
+        """Run model.generate over one or more requests; return new tokens per request."""
+        if len(batch_inputs) == 1:
+            inputs = batch_inputs[0]
+        else:
+            inputs = self._pad_left(processor, batch_inputs)
+        prompt_len = inputs["input_ids"].shape[-1]
+
+        with self.device_lock, torch.inference_mode():
+            try:
+                outputs = model.generate(**inputs, **gen_kwargs)
+            finally:
+                _release_cuda_memory()
+        return [outputs[i][prompt_len:] for i in range(len(batch_inputs))]
+
+    @staticmethod
+    def _pad_left(processor, batch_inputs: list) -> dict:
+        """Left-pad single-row inputs so every prompt ends at the same position."""
+        tokenizer = processor if not hasattr(processor, 'tokenizer') else processor.tokenizer
+        pad_id = getattr(tokenizer, "pad_token_id", None)
+        if pad_id is None:
+            pad_id = getattr(tokenizer, "eos_token_id", None) or 0
+
+        width = max(inputs["input_ids"].shape[-1] for inputs in batch_inputs)
+        first = batch_inputs[0]["input_ids"]
+        padded = {
+            "input_ids": torch.full(
+                (len(batch_inputs), width), pad_id, dtype=first.dtype, device=first.device
+            ),
+            "attention_mask": torch.zeros(
+                (len(batch_inputs), width), dtype=torch.long, device=first.device
+            ),
+        }
+        for row, inputs in enumerate(batch_inputs):
+            length = inputs["input_ids"].shape[-1]
+            padded["input_ids"][row, width - length:] = inputs["input_ids"][0]
+            padded["attention_mask"][row, width - length:] = 1
+            if "token_type_ids" in inputs:
+                token_types = padded.setdefault("token_type_ids", torch.zeros_like(padded["input_ids"]))
+                token_types[row, width - length:] = inputs["token_type_ids"][0]
+        return padded
+
+
+_generate_batcher = GenerateBatcher(
+    max_batch_size=int(os.getenv("LOCAL_BATCH_SIZE", "8")),
+    max_delay=float(os.getenv("LOCAL_BATCH_DELAY", "0.05")),
+)
+
+
+class PrefixKVCache:
+    """
+    LRU of KV caches from earlier generations, keyed by the tokens they hold.
+
+    A follow-up turn re-sends the whole conversation, which shares a long
+    token prefix with the previous prompt + reply. The closest stored cache
+    is cropped to that common prefix, so prefill only covers the new turn.
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # blake2b(token bytes) -> (token_ids, cache)
+        # store() runs after generate() has released the device lock
+        self._lock = threading.Lock()
+
+    def lookup(self, input_ids):
+        """Return (cache copy cropped to the longest shared prefix, prefix length) or (None, 0)."""
+        best_key, best_len = None, 0
+        with self._lock:
+            for key, (ids, _) in self._entries.items():
+                # Leave at least one prompt token for generate() to process
+                n = min(ids.shape[-1], input_ids.shape[-1] - 1)
+                mismatch = (ids[:n] != input_ids[:n]).nonzero()
+                common = int(mismatch[0]) if len(mismatch) else n
+                if common > best_len:
+                    best_key, best_len = key, common
+            if best_key is None:
+                return None, 0
+            self._entries.move_to_end(best_key)
+            cache = copy.deepcopy(self._entries[best_key][1])
+        cache.crop(best_len)
+        return cache, best_len
+
+    def store(self, token_ids, cache):
+        """Remember a cache holding KV for exactly token_ids."""
+        key = hashlib.blake2b(token_ids.numpy().tobytes(), digest_size=16).hexdigest()
+        with self._lock:
+            self._entries[key] = (token_ids, cache)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def generate(self, model, inputs: dict, gen_kwargs: dict):
+        """Generate for one request, reusing and then refreshing cached prefix KV."""
+        input_ids = inputs["input_ids"]
+        with _generate_batcher.device_lock, torch.inference_mode():
+            cache, reused = self.lookup(input_ids[0].cpu())
+            if reused:
+                logger.info(f"Prefix KV cache hit: reusing {reused}/{input_ids.shape[-1]} prompt tokens")
+            try:
+                outputs = model.generate(
+                    **inputs, **gen_kwargs,
+                    past_key_values=cache,
+                    return_dict_in_generate=True,
+                )
+            finally:
+                _release_cuda_memory()
+        sequence = outputs.sequences[0]
+        # The final sampled token has no KV entry yet
+        cached_len = outputs.past_key_values.get_seq_length()
+        self.store(sequence[:cached_len].cpu(), outputs.past_key_values)
+        return sequence[input_ids.shape[-1]:]
+
+
+# Opt-in: holds up to PREFIX_KV_CACHE_SIZE conversations' KV tensors on the device
+PREFIX_KV_CACHE = os.getenv("PREFIX_KV_CACHE", "0") == "1"
+_prefix_kv_cache = PrefixKVCache(max_entries=int(os.getenv("PREFIX_KV_CACHE_SIZE", "32")))
+
+
 # === Google AI API generation ===
+# Opt-in Gemini context caching of system prompt + history (Gemma models lack it)
+GEMINI_CACHE = os.getenv("GEMINI_CACHE", "0") == "1"
+GEMINI_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CACHE_TTL", "600"))
+_GEMINI_CACHE_SIZE = 64
+# History messages allowed after the longest cached prefix before a fresh
+# cache covering the whole history is created
+_GEMINI_CACHE_MAX_UNCACHED = 8
+# How long a failed cache creation suppresses retries for the same conversation
+_GEMINI_CACHE_RETRY_SECONDS = 120
+# blake2b(model, system prompt, history prefix) -> (cached content name, local expiry);
+# a None name records a failed creation
+_gemini_context_caches = OrderedDict()
+
+
+def _gemini_prefix_keys(cloud_model: str, system_text: str, history_contents: list) -> list:
+    """Cache keys for every history prefix; keys[k] covers history_contents[:k + 1]."""
+    digest = hashlib.blake2b(json.dumps([cloud_model, system_text]).encode(), digest_size=16)
+    keys = []
+    for message in history_contents:
+        digest.update(json.dumps(message).encode())
+        keys.append(digest.copy().hexdigest())
+    return keys
+
+
+async def _gemini_context_cache(cloud_model: str, system_text: str, history_contents: list) -> tuple:
+    """Return (cache name, history messages it covers) for this conversation.
+
+    The longest live cached prefix of the history is reused, so a follow-up
+    turn only sends the messages added since. A cache for the whole history
+    is created when nothing is cached yet or the uncached tail grows past
+    _GEMINI_CACHE_MAX_UNCACHED. Returns (None, 0) if no cache can be used,
+    including while a recent failed creation for this conversation stands.
+    """
+    keys = _gemini_prefix_keys(cloud_model, system_text, history_contents)
+    now = time.monotonic()
+    for covered in range(len(keys), 0, -1):
+        entry = _gemini_context_caches.get(keys[covered - 1])
+        if entry is not None and entry[1] > now:
+            if len(keys) - covered <= _GEMINI_CACHE_MAX_UNCACHED:
+                _gemini_context_caches.move_to_end(keys[covered - 1])
+                return (entry[0], covered) if entry[0] is not None else (None, 0)
+            break
+
+    cache_config = {"contents": history_contents, "ttl": f"{GEMINI_CACHE_TTL_SECONDS}s"}
+    if system_text:
+        cache_config["system_instruction"] = system_text
+    try:
+        cached = await asyncio.wait_for(
+            genai_client.aio.caches.create(model=cloud_model, config=cache_config),
+            timeout=GOOGLE_AI_TIMEOUT,
+        )
+    except Exception as e:
+        # e.g. prefix below the model's minimum cacheable token count
+        logger.info(f"Gemini context cache not created: {e}")
+        name, expiry = None, time.monotonic() + _GEMINI_CACHE_RETRY_SECONDS
+    else:
+        # Expire locally a little before the server does
+        name, expiry = cached.name, time.monotonic() + GEMINI_CACHE_TTL_SECONDS - 30
+
+    _gemini_context_caches[keys[-1]] = (name, expiry)
+    while len(_gemini_context_caches) > _GEMINI_CACHE_SIZE:
+        _gemini_context_caches.popitem(last=False)
+    return (name, len(keys)) if name is not None else (None, 0)
+
+
 async def generate_via_google_ai(request: GenerateRequest) -> GenerateResponse:
     """Generate using Google AI API (Gemma / Gemini models)."""
     if genai_client is None:
@@ -277,11 +717,28 @@ async def generate_via_google_ai(request: GenerateRequest) -> GenerateResponse:
     if not is_gemma and system_text:
         config["system_instruction"] = system_text
 
+    # Serve the system prompt + stable history prefix from a server-side
+    # context cache and send only the turns after it
+    history_len = len(request.history)
+    if GEMINI_CACHE and not is_gemma and history_len:
+        cache_name, cached_len = await _gemini_context_cache(
+            cloud_model, system_text, contents[:history_len]
+        )
+        if cache_name:
+            contents = contents[cached_len:]
+            config.pop("system_instruction", None)
+            config["cached_content"] = cache_name
+
     try:
-        response = genai_client.models.generate_content(
-            model=cloud_model,
-            contents=contents,
-            config=config,
+        # Async client: the event loop keeps serving other requests while the
+        # call is in flight, and the client's connection pool is reused
+        response = await asyncio.wait_for(
+            genai_client.aio.models.generate_content(
+                model=cloud_model,
+                contents=contents,
+                config=config,
+            ),
+            timeout=GOOGLE_AI_TIMEOUT,
         )
         text = response.text or "I apologize, but I couldn't generate a response."
     except Exception as e:
@@ -292,13 +749,66 @@ async def generate_via_google_ai(request: GenerateRequest) -> GenerateResponse:
 
 
 # === Local HF generation ===
-async def generate_via_local(request: GenerateRequest) -> GenerateResponse:
-    """Generate using local HuggingFace model."""
+@functools.cache
+def _copy_stream(device):
+    """One side stream per CUDA device for host-to-device input copies."""
+    return torch.cuda.Stream(device=device)
+
+
+def _to_device(inputs: dict, device) -> dict:
+    """
+    Move tensor inputs to the model device.
+
+    On CUDA every host tensor is staged in pinned memory and copied
+    asynchronously on a side stream, so the copies overlap instead of each
+    blocking the default stream in turn. Tensors already on a GPU are kept.
+    """
+    if not str(device).startswith("cuda"):
+        return {k: v.to(device) if hasattr(v, 'to') else v for k, v in inputs.items()}
+
+    device = torch.device(device)
+    if device.index is None:
+        device = torch.device("cuda", torch.cuda.current_device())
+    compute_stream = torch.cuda.current_stream(device)
+    copy_stream = _copy_stream(device)
+    moved = {}
+    with torch.cuda.stream(copy_stream):
+        for k, v in inputs.items():
+            if torch.is_tensor(v) and v.device.type == "cpu":
+                v = v.pin_memory().to(device, non_blocking=True)
+                # The copy stream allocated it; the compute stream will use it
+                v.record_stream(compute_stream)
+            moved[k] = v
+    compute_stream.wait_stream(copy_stream)
+    return moved
+
+
+# Per-processor LRU of rendered chat templates (CPU tensors), dropped with the processor
+_PROMPT_CACHE_SIZE = 256
+_prompt_cache = weakref.WeakKeyDictionary()
+
+
+def _cached_render(processor, key, render):
+    """Return render() memoized under key for this processor; key=None bypasses the cache."""
+    if key is None:
+        return render()
+    cache = _prompt_cache.setdefault(processor, OrderedDict())
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    value = cache[key] = render()
+    if len(cache) > _PROMPT_CACHE_SIZE:
+        cache.popitem(last=False)
+    return value
+
+
+async def _prepare_local_inputs(request: GenerateRequest):
+    """Build device-ready model inputs for a request; returns (model, processor, inputs, gen_kwargs)."""
     ensure_torch()
     model, processor = get_model_and_processor(request.model_id)
 
     has_images = request.images and len(request.images) > 0
-    is_medgemma = any(kw in request.model_id.lower() for kw in ['medgemma', '4b-it'])
+    is_medgemma = _is_medgemma_model(request.model_id)
 
     # Build chat messages - MedGemma needs structured content format
     messages = []
@@ -318,8 +828,9 @@ async def generate_via_local(request: GenerateRequest) -> GenerateResponse:
     if is_medgemma:
         user_content = []
         if has_images:
-            for img in request.images:
-                user_content.append({"type": "image", "image": decode_base64_image(img)})
+            # base64 + JPEG/PNG decode is CPU-bound; keep it off the event loop
+            for image in await asyncio.to_thread(decode_base64_images, request.images):
+                user_content.append({"type": "image", "image": image})
         user_content.append({"type": "text", "text": request.message})
         messages.append({"role": "user", "content": user_content})
     else:
@@ -329,29 +840,45 @@ async def generate_via_local(request: GenerateRequest) -> GenerateResponse:
     max_new_tokens = gen_config.get("max_new_tokens", 1024)
     temperature = gen_config.get("temperature", 0.7)
 
+    # Text-only conversations render to the same token IDs every time they
+    # recur (retries, repeated phase prompts), so memoize the template render
+    prompt_key = None if has_images else (
+        request.system_prompt,
+        tuple((msg.role, msg.content) for msg in request.history),
+        request.message,
+    )
+
     # Use apply_chat_template for tokenization
     if is_medgemma and hasattr(processor, 'apply_chat_template'):
-        inputs = processor.apply_chat_template(
+        render = functools.partial(
+            processor.apply_chat_template,
             messages, tokenize=True, return_tensors="pt",
             return_dict=True, add_generation_prompt=True
         )
-        inputs = {k: v.to(model.device) if hasattr(v, 'to') else v for k, v in inputs.items()}
+        inputs = _cached_render(processor, prompt_key, render)
+        inputs = _to_device(inputs, model.device)
     elif hasattr(processor, 'apply_chat_template'):
-        full_prompt = processor.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True
-        )
         if has_images and hasattr(processor, 'image_processor'):
-            images = [decode_base64_image(img) for img in request.images]
+            full_prompt = processor.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=True
+            )
+            images = await asyncio.to_thread(decode_base64_images, request.images)
             inputs = processor(
                 text=full_prompt,
                 images=images if len(images) > 1 else images[0],
                 return_tensors="pt",
             )
-            inputs = {k: v.to(model.device) if hasattr(v, 'to') else v for k, v in inputs.items()}
+            inputs = _to_device(inputs, model.device)
         else:
-            tokenizer = processor if not hasattr(processor, 'tokenizer') else processor.tokenizer
-            inputs = tokenizer(full_prompt, return_tensors="pt")
-            inputs = {k: v.to(model.device) for k, v in inputs.items()}
+            def render():
+                full_prompt = processor.apply_chat_template(
+                    messages, tokenize=False, add_generation_prompt=True
+                )
+                tokenizer = processor if not hasattr(processor, 'tokenizer') else processor.tokenizer
+                return tokenizer(full_prompt, return_tensors="pt")
+
+            inputs = _cached_render(processor, prompt_key, render)
+            inputs = _to_device(inputs, model.device)
     else:
         # Fallback raw prompt
         full_prompt = ""
@@ -363,34 +890,96 @@ async def generate_via_local(request: GenerateRequest) -> GenerateResponse:
         full_prompt += f"User: {request.message}\nAssistant:"
         tokenizer = processor if not hasattr(processor, 'tokenizer') else processor.tokenizer
         inputs = tokenizer(full_prompt, return_tensors="pt")
-        inputs = {k: v.to(model.device) for k, v in inputs.items()}
-
-    with torch.inference_mode():
-        input_len = inputs["input_ids"].shape[-1]
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=max_new_tokens,
-            do_sample=temperature > 0,
-            temperature=temperature if temperature > 0 else None,
-        )
+        inputs = _to_device(inputs, model.device)
 
-        # Decode only newly generated tokens
-        new_tokens = outputs[0][input_len:]
-        tokenizer = processor if not hasattr(processor, 'tokenizer') else processor.tokenizer
-        if hasattr(tokenizer, 'decode'):
-            text = tokenizer.decode(new_tokens, skip_special_tokens=True)
-        elif hasattr(processor, 'batch_decode'):
-            text = processor.batch_decode(outputs[:, input_len:], skip_special_tokens=True)[0]
-        else:
-            text = processor.decode(outputs[0], skip_special_tokens=True)
+    gen_kwargs = {
+        "max_new_tokens": max_new_tokens,
+        "do_sample": temperature > 0,
+        "temperature": temperature if temperature > 0 else None,
+    }
+    return model, processor, inputs, gen_kwargs
+
+
+async def generate_via_local(request: GenerateRequest) -> GenerateResponse:
+    """Generate using local HuggingFace model."""
+    model, processor, inputs, gen_kwargs = await _prepare_local_inputs(request)
+    # With the prefix cache on, text-only turns reuse the KV of earlier turns
+    # instead of being batched; static caches (compiled models) can't be cropped.
+    use_prefix_cache = (
+        PREFIX_KV_CACHE
+        and not request.images
+        and getattr(model.generation_config, "cache_implementation", None) != "static"
+    )
+    if use_prefix_cache:
+        new_tokens = await asyncio.to_thread(_prefix_kv_cache.generate, model, inputs, gen_kwargs)
+    else:
+        new_tokens = await _generate_batcher.submit(model, processor, inputs, gen_kwargs)
+
+    # Decode only newly generated tokens
+    tokenizer = processor if not hasattr(processor, 'tokenizer') else processor.tokenizer
+    if hasattr(tokenizer, 'decode'):
+        text = tokenizer.decode(new_tokens, skip_special_tokens=True)
+    elif hasattr(processor, 'batch_decode'):
+        text = processor.batch_decode([new_tokens], skip_special_tokens=True)[0]
+    else:
+        text = processor.decode(new_tokens, skip_special_tokens=True)
 
     return GenerateResponse(text=text.strip(), model_used=f"local:{request.model_id}")
 
 
+def _sse_event(payload: dict) -> str:
+    """Format one server-sent event."""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+async def stream_via_local(request: GenerateRequest):
+    """Start a local generation and return an iterator of SSE events as tokens arrive."""
+    model, processor, inputs, gen_kwargs = await _prepare_local_inputs(request)
+    tokenizer = processor if not hasattr(processor, 'tokenizer') else processor.tokenizer
+    streamer = transformers.TextIteratorStreamer(
+        tokenizer, skip_prompt=True, skip_special_tokens=True
+    )
+    errors = []
+
+    def run():
+        try:
+            with _generate_batcher.device_lock, torch.inference_mode():
+                model.generate(**inputs, **gen_kwargs, streamer=streamer)
+        except Exception as e:
+            logger.error(f"Local streaming generation failed: {e}")
+            errors.append(e)
+            streamer.end()
+        finally:
+            _release_cuda_memory()
+
+    threading.Thread(target=run, daemon=True).start()
+
+    # Sync generator: StreamingResponse iterates it in a worker thread, so the
+    # blocking streamer queue never stalls the event loop
+    def events():
+        for text in streamer:
+            if text:
+                yield _sse_event({"text": text})
+        if errors:
+            yield _sse_event({"error": str(errors[0])})
+        else:
+            yield _sse_event({"done": True, "model_used": f"local:{request.model_id}"})
+
+    return events()
+
+
 # === FastAPI App ===
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Walk /kaggle/input in the background so the first request doesn't pay for it
+    asyncio.get_running_loop().run_in_executor(None, kaggle_model_dirs)
+    yield
+
+
 app = FastAPI(
     title="MedGemma Backend",
-    description="Backend service for MedGemma model inference (local + cloud)"
+    description="Backend service for MedGemma model inference (local + cloud)",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -402,48 +991,88 @@ app.add_middleware(
 )
 
 
-@app.get("/health")
+# JSON routes declare a response model: FastAPI then serializes the result
+# straight to JSON bytes with pydantic-core, skipping jsonable_encoder and json.dumps
+@app.get("/health", response_model=HealthResponse)
 async def health():
     ensure_torch()
     device = "cuda" if torch.cuda.is_available() else "cpu"
     gpu_name = torch.cuda.get_device_name(0) if device == "cuda" else None
     vram_gb = round(torch.cuda.get_device_properties(0).total_memory / (1024**3), 1) if device == "cuda" else 0
-    return {
-        "status": "ok",
-        "device": device,
-        "gpu": gpu_name,
-        "vram_gb": vram_gb,
-        "google_ai_available": genai_client is not None,
-        "loaded_models": list(_loaded_models.keys()),
-        "local_medgemma_available": _is_local_model_available("google/medgemma-4b-it"),
-    }
+    # reserved - allocated is memory held by the caching allocator (fragmentation)
+    vram_allocated_gb = round(torch.cuda.memory_allocated(0) / (1024**3), 2) if device == "cuda" else 0
+    vram_reserved_gb = round(torch.cuda.memory_reserved(0) / (1024**3), 2) if device == "cuda" else 0
+    return HealthResponse(
+        status="ok",
+        device=device,
+        gpu=gpu_name,
+        vram_gb=vram_gb,
+        vram_allocated_gb=vram_allocated_gb,
+        vram_reserved_gb=vram_reserved_gb,
+        google_ai_available=genai_client is not None,
+        loaded_models=list(_loaded_models.keys()),
+        local_medgemma_available=_is_local_model_available("google/medgemma-4b-it"),
+    )
 
 
-@app.get("/models")
+@app.get("/models", response_model=ModelsResponse)
 async def list_models():
     """List available models."""
-    local_models = []
-    kaggle_input = Path("/kaggle/input")
-    if kaggle_input.exists():
-        for config_file in kaggle_input.rglob("config.json"):
-            local_models.append(str(config_file.parent))
+    local_models = [str(p) for p in await asyncio.to_thread(kaggle_model_dirs)]
 
     cloud_models = list(set(GOOGLE_AI_MODEL_MAP.values())) if genai_client else []
 
-    return {
-        "local_models": local_models[:20],
-        "cloud_models": cloud_models,
-        "suggested": {
+    return ModelsResponse(
+        local_models=local_models[:20],
+        cloud_models=cloud_models,
+        suggested={
             "medgemma-4b": "google/medgemma-1.5-4b-it",
             "medgemma-27b-text": "google/medgemma-27b-it",
             "medgemma-27b-mm": "google/medgemma-27b-mm-it",
         },
+    )
+
+
+async def _parse_generate_request(request: Request) -> GenerateRequest:
+    """Parse and validate the raw JSON body in a single pydantic-core pass.
+
+    FastAPI's body handling decodes to a dict with ``json.loads`` before
+    validating it; ``model_validate_json`` goes straight from bytes.
+    """
+    try:
+        return GenerateRequest.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+        )
+
+
+# The body is read by _parse_generate_request, so document it explicitly
+_GENERATE_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": GenerateRequest.model_json_schema()}},
     }
+}
+
+
+def _json_response(result: BaseModel) -> Response:
+    """Serialize a response model to JSON bytes in one pydantic-core call.
+
+    Returning a ``Response`` skips FastAPI's re-validation of the result
+    against ``response_model``, which stays on the route for the OpenAPI schema.
+    """
+    return Response(content=result.model_dump_json(), media_type="application/json")
+
+
+@app.post("/generate", response_model=GenerateResponse, openapi_extra=_GENERATE_REQUEST_BODY)
+async def generate(request: GenerateRequest = Depends(_parse_generate_request)):
+    """Generate text – auto-routes to local model or Google AI API."""
+    return _json_response(await _generate(request))
 
 
-@app.post("/generate", response_model=GenerateResponse)
-async def generate(request: GenerateRequest):
-    """Generate text – auto-routes to local model or Google AI API.
+async def _generate(request: GenerateRequest) -> GenerateResponse:
+    """Route a generation request and return the model's reply.
     
     Routing logic:
     - MedGemma 4B: use local GPU (RTX A4500, 20GB)
@@ -486,27 +1115,56 @@ async def generate(request: GenerateRequest):
     )
 
 
-@app.post("/analyze-image")
+@app.post("/generate/stream", openapi_extra=_GENERATE_REQUEST_BODY)
+async def generate_stream(request: GenerateRequest = Depends(_parse_generate_request)):
+    """Stream generated text as server-sent events.
+
+    Local models emit one ``{"text": ...}`` event per decoded chunk; cloud
+    routes arrive as a single text event. The stream ends with
+    ``{"done": true, "model_used": ...}`` or an ``{"error": ...}`` event.
+    """
+    if request.model_id not in CLOUD_ONLY_MODELS and _is_local_model_available(request.model_id):
+        try:
+            events = await stream_via_local(request)
+            return StreamingResponse(events, media_type="text/event-stream")
+        except Exception as e:
+            logger.warning(f"Local streaming failed: {e}; falling back to /generate routing")
+
+    response = await _generate(request)
+    events = [
+        _sse_event({"text": response.text}),
+        _sse_event({"done": True, "model_used": response.model_used}),
+    ]
+    return StreamingResponse(iter(events), media_type="text/event-stream")
+
+
+# Fixed analysis instructions per image type; clinical context is appended per request
+IMAGE_ANALYSIS_PROMPTS = {
+    "xray": "Analyze this chest X-ray image. Identify any abnormalities, key findings, and provide a structured radiological assessment.",
+    "dermatology": "Analyze this dermatological image. Describe the lesion characteristics (ABCDE criteria if applicable), potential differential diagnoses, and recommended next steps.",
+    "pathology": "Analyze this histopathology image. Describe the tissue architecture, cellular features, and any pathological findings.",
+    "general": "Analyze this medical image. Describe what you observe and any clinically relevant findings.",
+}
+
+
+@app.post("/analyze-image", response_model=GenerateResponse)
 async def analyze_image(
     image: ImageData,
     image_type: str = "general",
     context: Optional[str] = None,
 ):
     """Specialized endpoint for image analysis."""
-    prompts = {
-        "xray": f"Analyze this chest X-ray image. Identify any abnormalities, key findings, and provide a structured radiological assessment. {f'Clinical context: {context}' if context else ''}",
-        "dermatology": f"Analyze this dermatological image. Describe the lesion characteristics (ABCDE criteria if applicable), potential differential diagnoses, and recommended next steps. {f'Clinical context: {context}' if context else ''}",
-        "pathology": f"Analyze this histopathology image. Describe the tissue architecture, cellular features, and any pathological findings. {f'Clinical context: {context}' if context else ''}",
-        "general": f"Analyze this medical image. Describe what you observe and any clinically relevant findings. {f'Clinical context: {context}' if context else ''}",
-    }
+    prompt = IMAGE_ANALYSIS_PROMPTS.get(image_type, IMAGE_ANALYSIS_PROMPTS["general"])
+    if context:
+        prompt = f"{prompt} Clinical context: {context}"
 
     request = GenerateRequest(
         model_id=os.getenv("MEDGEMMA_MM_MODEL_ID", "google/medgemma-1.5-4b-it"),
-        message=prompts.get(image_type, prompts["general"]),
+        message=prompt,
         images=[image],
         config={"max_new_tokens": 512, "temperature": 0.3},
     )
-    return await generate(request)
+    return _json_response(await _generate(request))
 
 
 if __name__ == "__main__":
@@ -516,6 +1174,14 @@ if __name__ == "__main__":
     if preload_model:
         logger.info(f"Preloading model: {preload_model}")
         get_model_and_processor(preload_model)
+        # One short generation triggers compilation and kernel autotuning now
+        # instead of on the first user request
+        asyncio.run(generate_via_local(GenerateRequest(
+            model_id=preload_model,
+            message="Warm-up",
+            config={"max_new_tokens": 8, "temperature": 0},
+        )))
+        logger.info("Model warm-up complete")
 
     port = int(os.getenv("PORT", 8000))
     logger.info(f"Starting MedGemma backend on port {port}")
@@ -0,0 +1,536 @@
+"""
+Real MedGemma model wrapper for the local test script.
+
+Kept apart from test_medgemma_local.py so that importing the script (and
+running it with --mock) never pulls in torch or transformers; this module is
+only imported once a real model is requested.
+"""
+
+import sys
+import copy
+import functools
+import gc
+import importlib.util
+import threading
+from typing import Optional, List, Dict, Any, Callable, Iterator
+
+# Optional heavy dependencies; MedGemmaModel reports them missing at load time
+try:
+    import torch
+except ImportError:
+    torch = None
+try:
+    import transformers
+except ImportError:
+    transformers = None
+
+
+class CodeFenceStoppingCriteria:
+    """Stops generation once a row's decoded continuation satisfies `stop_when`.
+
+    The predicate is only evaluated when the newest token contains a backtick
+    (a possible closing code fence), so ordinary tokens cost a single decode.
+    """
+    
+    def __init__(self, tokenizer, prompt_len: int, stop_when: Callable[[str], bool]):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.stop_when = stop_when
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        done = []
+        for row in input_ids:
+            last_token = self.tokenizer.decode(row[-1:], skip_special_tokens=True)
+            done.append("`" in last_token and self.stop_when(
+                self.tokenizer.decode(row[self.prompt_len:], skip_special_tokens=True)
+            ))
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+def _has_chat_template(tokenizer) -> bool:
+    return isinstance(getattr(tokenizer, "chat_template", None), str)
+
+
+class CancelStoppingCriteria:
+    """Stops every row once `event` is set, e.g. when a streaming reader goes away."""
+    
+    def __init__(self, event: threading.Event):
+        self.event = event
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+@functools.lru_cache(maxsize=25)
+def _prefill_system_prefix(model: "MedGemmaModel", prefix: str):
+    """Tokenize and run the model over a rendered static prefix once.
+    
+    Returns ``(token_ids, past_key_values)``. Keyed by model instance and
+    prefix text, i.e. one entry per (role, phase), so neither the prefix's
+    tokenization nor its prefill is repeated.
+    """
+    tokenizer = model.tokenizer or getattr(model.processor, 'tokenizer', model.processor)
+    prefix_ids = tokenizer(
+        prefix, add_special_tokens=not _has_chat_template(tokenizer), return_tensors="pt"
+    )["input_ids"].to(model.model.device)
+    with torch.inference_mode():
+        outputs = model.model(input_ids=prefix_ids, use_cache=True)
+    return prefix_ids, outputs.past_key_values
+
+
+@functools.lru_cache(maxsize=8)
+def _load_tokenizer(model_id: str):
+    """Load a fast tokenizer once per model id; reloading the model reuses it."""
+    return transformers.AutoTokenizer.from_pretrained(model_id, use_fast=True)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_processor(model_id: str):
+    """Load a processor once per model id; failures are not cached."""
+    return transformers.AutoProcessor.from_pretrained(model_id, use_fast=True)
+
+
+# Preferred multimodal model classes, newest transformers API first
+MULTIMODAL_MODEL_CLASS_NAMES = ('AutoModelForImageTextToText', 'AutoModelForVision2Seq')
+
+# FlashAttention-2 kernels are only used when the flash_attn package is installed
+HAS_FLASH_ATTN = importlib.util.find_spec("flash_attn") is not None
+
+
+def _attn_implementation(device: str) -> str:
+    """FlashAttention-2 on CUDA when available, otherwise PyTorch SDPA."""
+    return "flash_attention_2" if device == "cuda" and HAS_FLASH_ATTN else "sdpa"
+
+
+class MedGemmaModel:
+    """Wrapper for MedGemma model inference."""
+    
+    def __init__(self, model_id: str, device: str = "auto", compile: bool = True, quant: str = "none"):
+        self.model_id = model_id
+        self.device = device
+        self.compile = compile
+        self.quant = quant
+        self.model = None
+        self.processor = None
+        self.tokenizer = None
+        self.pad_token_id = None
+        self.stop_token_ids = set()
+        self.copy_stream = None
+        self._load_model()
+    
+    def _load_model(self):
+        """Load model and processor/tokenizer."""
+        print(f"🔄 Loading model: {self.model_id}")
+        _prefill_system_prefix.cache_clear()
+        print(f"   This may take a few minutes for large models...")
+        
+        if torch is None or transformers is None:
+            print("❌ Missing dependencies. Install with:")
+            print("   pip install torch transformers accelerate")
+            sys.exit(1)
+        
+        # Determine device and dtype
+        if self.device == "auto":
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        
+        if self.device == "cuda":
+            if torch.cuda.is_bf16_supported():
+                self.dtype = torch.bfloat16
+            else:
+                self.dtype = torch.float16
+        else:
+            # Load bf16 checkpoints as-is rather than upcasting to fp32
+            self.dtype = torch.bfloat16
+        
+        print(f"   Device: {self.device}, dtype: {self.dtype}, attention: {_attn_implementation(self.device)}")
+        
+        # Check if multimodal
+        is_multimodal = any(kw in self.model_id.lower() for kw in ['4b', 'mm', 'vision', 'multimodal'])
+        
+        # Load model
+        if is_multimodal:
+            # Newest multimodal model class this transformers install provides
+            ModelClass = next(
+                (getattr(transformers, name) for name in MULTIMODAL_MODEL_CLASS_NAMES
+                 if hasattr(transformers, name)),
+                transformers.AutoModelForCausalLM,
+            )
+            
+            try:
+                self.processor = _load_processor(self.model_id)
+            except Exception:
+                self.tokenizer = _load_tokenizer(self.model_id)
+        else:
+            ModelClass = transformers.AutoModelForCausalLM
+            self.tokenizer = _load_tokenizer(self.model_id)
+        
+        quantization_config = self._quantization_config()
+        if quantization_config is not None:
+            print(f"   Quantization: {self.quant} (reduced precision; check outputs before clinical use)")
+        
+        self.model = ModelClass.from_pretrained(
+            self.model_id,
+            device_map="auto" if self.device == "cuda" else None,
+            torch_dtype=self.dtype,
+            low_cpu_mem_usage=True,
+            attn_implementation=_attn_implementation(self.device),
+            **({"quantization_config": quantization_config} if quantization_config else {}),
+        )
+        # Inference only: no dropout, and no autograd bookkeeping on the weights
+        self.model.eval()
+        self.model.requires_grad_(False)
+        
+        # Resolved once here rather than on every generate call
+        if self.tokenizer:
+            self.pad_token_id = self.tokenizer.eos_token_id
+        tokenizer = self.tokenizer or getattr(self.processor, 'tokenizer', self.processor)
+        eos = self.model.generation_config.eos_token_id
+        self.stop_token_ids = set(eos if isinstance(eos, (list, tuple)) else [eos])
+        self.stop_token_ids.add(tokenizer.eos_token_id)
+        self.stop_token_ids.discard(None)
+        
+        # Compile the forward pass so decode steps can be captured as CUDA graphs.
+        # The conversation KV caches are dynamic, so no static cache is forced here.
+        # bitsandbytes kernels don't trace, so quantized models stay eager.
+        if self.compile and self.device == "cuda" and quantization_config is None:
+            print(f"   Compiling model (torch.compile, reduce-overhead)...")
+            self.model.forward = torch.compile(self.model.forward, mode="reduce-overhead", dynamic=True)
+            # Trigger compilation now so the first real turn isn't the slow one
+            self.generate("warmup", max_new_tokens=4, gen_kwargs={"do_sample": False})
+        
+        print(f"✅ Model loaded successfully!")
+    
+    def _quantization_config(self):
+        """bitsandbytes config for `quant`, or None to load full-precision weights."""
+        if self.quant == "none":
+            return None
+        if self.device != "cuda":
+            print(f"⚠️  --quant {self.quant} needs CUDA; loading {self.dtype} weights")
+            return None
+        if self.quant == "int8":
+            return transformers.BitsAndBytesConfig(load_in_8bit=True)
+        if self.quant == "nf4":
+            return transformers.BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_compute_dtype=self.dtype,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_use_double_quant=True,
+            )
+        raise ValueError(f"Unsupported quantization {self.quant!r}; use none, int8 or nf4")
+    
+    def _to_device(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """Move tensor inputs to the model device.
+        
+        On CUDA, host tensors are staged in pinned memory and copied
+        asynchronously on a side stream that the compute stream then waits on,
+        instead of each copy blocking the default stream.
+        """
+        device = self.model.device
+        if getattr(device, "type", device) != "cuda":
+            return {k: v.to(device) if hasattr(v, 'to') else v for k, v in inputs.items()}
+        
+        if self.copy_stream is None:
+            self.copy_stream = torch.cuda.Stream(device=device)
+        compute_stream = torch.cuda.current_stream(device)
+        moved = {}
+        with torch.cuda.stream(self.copy_stream):
+            for k, v in inputs.items():
+                if torch.is_tensor(v) and v.device.type == "cpu":
+                    v = v.pin_memory().to(device, non_blocking=True)
+                    # The copy stream allocated it; the compute stream will use it
+                    v.record_stream(compute_stream)
+                moved[k] = v
+        compute_stream.wait_stream(self.copy_stream)
+        return moved
+    
+    def _stopping_criteria(
+        self,
+        prompt_len: int,
+        stop_when: Optional[Callable[[str], bool]],
+        cancel: Optional[threading.Event] = None,
+    ):
+        """Build stopping criteria that end decoding early once `stop_when` holds or `cancel` is set."""
+        if stop_when is None and cancel is None:
+            return None
+        criteria = transformers.StoppingCriteriaList()
+        if stop_when is not None:
+            tokenizer = self.tokenizer or getattr(self.processor, 'tokenizer', self.processor)
+            criteria.append(CodeFenceStoppingCriteria(tokenizer, prompt_len, stop_when))
+        if cancel is not None:
+            criteria.append(CancelStoppingCriteria(cancel))
+        return criteria
+    
+    @staticmethod
+    def _generation_kwargs(max_new_tokens: int, gen_kwargs: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Default sampling settings, overridden by `gen_kwargs` (e.g. a phase's entry in PHASE_GEN_KWARGS)."""
+        kwargs = dict(max_new_tokens=max_new_tokens, do_sample=True, temperature=0.7)
+        if gen_kwargs:
+            kwargs.update(gen_kwargs)
+        if not kwargs["do_sample"]:
+            kwargs.pop("temperature", None)
+        return kwargs
+    
+    def generate(
+        self,
+        prompt: str,
+        system_prompt: str = "",
+        max_new_tokens: int = 512,
+        stop_when: Optional[Callable[[str], bool]] = None,
+        gen_kwargs: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """Generate text response.
+        
+        If `stop_when` is given, decoding stops as soon as it returns True for
+        the text generated so far (e.g. once a JSON block has closed).
+        `gen_kwargs` overrides the default sampling settings.
+        """
+        full_prompt = f"{system_prompt}\n\nUser: {prompt}\nAssistant:"
+        
+        # Use processor or tokenizer
+        if self.processor:
+            inputs = self.processor(text=full_prompt, return_tensors="pt")
+        else:
+            inputs = self.tokenizer(full_prompt, return_tensors="pt")
+        
+        inputs = self._to_device(inputs)
+        input_len = inputs["input_ids"].shape[-1]
+        
+        with torch.inference_mode():
+            outputs = self.model.generate(
+                **inputs,
+                **self._generation_kwargs(max_new_tokens, gen_kwargs),
+                use_cache=True,
+                pad_token_id=self.pad_token_id,
+                stopping_criteria=self._stopping_criteria(input_len, stop_when),
+            )
+        
+        # Decode only the generated tokens, not the prompt
+        if self.processor and hasattr(self.processor, 'batch_decode'):
+            text = self.processor.batch_decode(outputs[:, input_len:], skip_special_tokens=True)[0]
+        else:
+            text = self.tokenizer.decode(outputs[0, input_len:], skip_special_tokens=True)
+        
+        return text.strip()
+    
+    def _render_turn(self, tokenizer, system_prompt: str, prompt: str) -> str:
+        """Render a first turn with the model's chat template, or the plain User/Assistant format."""
+        if not _has_chat_template(tokenizer):
+            return f"{system_prompt}\n\nUser: {prompt}\nAssistant:"
+        return tokenizer.apply_chat_template(
+            [{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}],
+            tokenize=False, add_generation_prompt=True,
+        )
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _followup_template(tokenizer) -> Optional[str]:
+        """The chat-template text between an assistant reply and the next generation prompt.
+        
+        Rendered once per tokenizer with placeholders, so a follow-up turn is a
+        plain string substitution.
+        """
+        if not _has_chat_template(tokenizer):
+            return None
+        rendered = tokenizer.apply_chat_template(
+            [
+                {"role": "user", "content": "\x00"},
+                {"role": "assistant", "content": "\x01"},
+                {"role": "user", "content": "\x02"},
+            ],
+            tokenize=False, add_generation_prompt=True,
+        )
+        return rendered.split("\x01", 1)[1]
+    
+    def _render_followup(self, tokenizer, prompt: str) -> str:
+        """Render the text that closes the previous reply and opens a new turn."""
+        template = self._followup_template(tokenizer)
+        if template is None:
+            return f"\n\nUser: {prompt}\nAssistant:"
+        return template.replace("\x02", prompt)
+    
+    def generate_turn(
+        self,
+        prompt: str,
+        system_prompt: str = "",
+        past_key_values=None,
+        cached_token_ids=None,
+        max_new_tokens: int = 512,
+        stop_when: Optional[Callable[[str], bool]] = None,
+        system_prefix: Optional[str] = None,
+        gen_kwargs: Optional[Dict[str, Any]] = None,
+        streamer=None,
+        cancel: Optional[threading.Event] = None,
+        phase=None,
+    ):
+        """Generate one conversation turn, continuing from the previous turn's KV cache.
+        
+        `past_key_values` and `cached_token_ids` are what the previous call
+        returned; when given, only the new user turn is prefilled instead of the
+        whole conversation. Otherwise, if `system_prompt` starts with
+        `system_prefix`, the turn starts from that prefix's precomputed KV state.
+        `phase` is the conversation's EBP phase; the real model decodes from
+        `gen_kwargs` and the prompt alone, so it is not used here.
+        Returns ``(text, past_key_values, token_ids)``.
+        """
+        tokenizer = self.tokenizer or getattr(self.processor, 'tokenizer', self.processor)
+        
+        if past_key_values is None:
+            rendered = self._render_turn(tokenizer, system_prompt, prompt)
+            anchor = (system_prefix or "").strip()
+            split = rendered.find(anchor) + len(anchor) if anchor and anchor in rendered else 0
+            if split:
+                # Everything up to the end of the static system text comes from the cache
+                prefix_ids, prefix_cache = _prefill_system_prefix(self, rendered[:split])
+                # generate() extends the cache in place, so work on a copy
+                past_key_values = copy.deepcopy(prefix_cache)
+                rest_ids = tokenizer(
+                    rendered[split:], add_special_tokens=False, return_tensors="pt"
+                )["input_ids"].to(prefix_ids.device)
+                input_ids = torch.cat([prefix_ids, rest_ids], dim=-1)
+            else:
+                input_ids = tokenizer(
+                    rendered, add_special_tokens=not _has_chat_template(tokenizer), return_tensors="pt"
+                )["input_ids"]
+        else:
+            # The cache already holds the system prompt and earlier turns
+            delta_ids = tokenizer(
+                self._render_followup(tokenizer, prompt), add_special_tokens=False, return_tensors="pt"
+            )["input_ids"]
+            input_ids = torch.cat([cached_token_ids, delta_ids.to(cached_token_ids.device)], dim=-1)
+        inputs = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+        
+        inputs = self._to_device(inputs)
+        prompt_len = inputs["input_ids"].shape[-1]
+        
+        with torch.inference_mode():
+            outputs = self.model.generate(
+                **inputs,
+                past_key_values=past_key_values,
+                use_cache=True,
+                return_dict_in_generate=True,
+                **self._generation_kwargs(max_new_tokens, gen_kwargs),
+                pad_token_id=self.pad_token_id,
+                stopping_criteria=self._stopping_criteria(prompt_len, stop_when, cancel),
+                streamer=streamer,
+            )
+        
+        sequences = outputs.sequences
+        text = tokenizer.decode(sequences[0, prompt_len:], skip_special_tokens=True).strip()
+        
+        # The final token is never fed back through the model, so a trailing stop
+        # token can be dropped without leaving the cache ahead of the token ids;
+        # the follow-up template closes the turn itself
+        if sequences[0, -1].item() in self.stop_token_ids:
+            sequences = sequences[:, :-1]
+        
+        return text, outputs.past_key_values, sequences
+    
+    def generate_stream(self, prompt: str, system_prompt: str = "", **turn_kwargs) -> Iterator[str]:
+        """Like `generate_turn`, but yields text as it is decoded.
+        
+        Generation runs in a background thread; the generator's return value is
+        `generate_turn`'s ``(text, past_key_values, token_ids)``. Closing the
+        generator early stops decoding at the next token.
+        """
+        tokenizer = self.tokenizer or getattr(self.processor, 'tokenizer', self.processor)
+        streamer = transformers.TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        cancel = threading.Event()
+        result = {}
+        
+        def run():
+            try:
+                result["turn"] = self.generate_turn(
+                    prompt, system_prompt, streamer=streamer, cancel=cancel, **turn_kwargs
+                )
+            except BaseException as e:
+                result["error"] = e
+                streamer.end()
+        
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            yield from streamer
+        finally:
+            cancel.set()
+            thread.join()
+        
+        if "error" in result:
+            raise result["error"]
+        return result["turn"]
+    
+    @functools.cached_property
+    def _batch_tokenizer(self):
+        """Private left-padding copy of the tokenizer for `generate_batch`.
+        
+        The loaded tokenizer is shared through `_load_tokenizer`'s cache, and
+        older transformers releases ignore a per-call `padding_side`, so the
+        padding settings go on a copy instead.
+        """
+        tokenizer = copy.deepcopy(self.tokenizer or getattr(self.processor, 'tokenizer', self.processor))
+        # Decoder-only models must be left-padded so every row continues from real tokens
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            # Padding needs a pad token; rows are masked, so EOS serves
+            tokenizer.pad_token = tokenizer.eos_token
+        return tokenizer
+    
+    def generate_batch(
+        self,
+        prompts: List[str],
+        system_prompts: List[str],
+        max_new_tokens: int = 512,
+        stop_when: Optional[Callable[[str], bool]] = None,
+        gen_kwargs: Optional[List[Optional[Dict[str, Any]]]] = None,
+        phases=None,
+    ) -> List[str]:
+        """Generate responses for several first turns in padded batches.
+        
+        Prompts are rendered like `generate_turn`'s first turn. `gen_kwargs`
+        holds one override per prompt (e.g. each phase's PHASE_GEN_KWARGS
+        entry); prompts with the same resulting settings share one batch.
+        `phases` lists each prompt's EBP phase and, as in `generate_turn`,
+        is not used by the real model.
+        """
+        tokenizer = self.tokenizer or getattr(self.processor, 'tokenizer', self.processor)
+        batch_tokenizer = self._batch_tokenizer
+        
+        groups: Dict[tuple, List[int]] = {}
+        for i, overrides in enumerate(gen_kwargs or [None] * len(prompts)):
+            settings = self._generation_kwargs(max_new_tokens, overrides)
+            groups.setdefault(tuple(sorted(settings.items())), []).append(i)
+        
+        texts: List[str] = [""] * len(prompts)
+        for settings, indices in groups.items():
+            rendered = [self._render_turn(tokenizer, system_prompts[i], prompts[i]) for i in indices]
+            inputs = batch_tokenizer(
+                rendered,
+                add_special_tokens=not _has_chat_template(tokenizer),
+                padding=True,
+                return_tensors="pt",
+            )
+            inputs = self._to_device(inputs)
+            input_len = inputs["input_ids"].shape[-1]
+            
+            with torch.inference_mode():
+                outputs = self.model.generate(
+                    **inputs,
+                    **dict(settings),
+                    use_cache=True,
+                    pad_token_id=batch_tokenizer.pad_token_id,
+                    stopping_criteria=self._stopping_criteria(input_len, stop_when),
+                )
+            
+            # Left padding puts every prompt before input_len
+            decoded = tokenizer.batch_decode(outputs[:, input_len:], skip_special_tokens=True)
+            for i, text in zip(indices, decoded):
+                texts[i] = text.strip()
+        
+        return texts
+
+
+def release_model_memory():
+    """Free an evicted model's weights, including any cached system-prefix KV."""
+    _prefill_system_prefix.cache_clear()
+    gc.collect()
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
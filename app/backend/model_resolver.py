@@ -10,9 +10,11 @@ Supports:
 
 from __future__ import annotations
 
+import functools
 import os
+import time
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 
 
 ALIAS_TO_HF = {
@@ -52,16 +54,12 @@ ALIAS_TO_ENV_OVERRIDES = {
 }
 
 
+# model_id -> override path, snapshotted from the environment by refresh_model_resolution()
+_env_overrides = {}
+
+
 def _env_override_for(model_id: str) -> Optional[str]:
-    for env_key in HF_TO_ENV_OVERRIDES.get(model_id, []):
-        value = os.getenv(env_key)
-        if value:
-            return value
-    for env_key in ALIAS_TO_ENV_OVERRIDES.get(model_id, []):
-        value = os.getenv(env_key)
-        if value:
-            return value
-    return None
+    return _env_overrides.get(model_id)
 
 
 def _find_hf_dir(root: Path) -> Optional[str]:
@@ -76,6 +74,7 @@ def _find_hf_dir(root: Path) -> Optional[str]:
     return None
 
 
+@functools.lru_cache(maxsize=None)
 def _download_kagglehub(handle: str) -> str:
     try:
         import kagglehub  # type: ignore
@@ -94,12 +93,58 @@ def _download_kagglehub(handle: str) -> str:
     return hf_dir
 
 
-def _scan_kaggle_input(model_id: str) -> Optional[str]:
-    kaggle_input = Path("/kaggle/input")
-    if not kaggle_input.exists():
-        return None
+KAGGLE_INPUT = Path("/kaggle/input")
+
+# Seconds before the /kaggle/input manifest is walked again
+KAGGLE_MANIFEST_TTL = float(os.getenv("KAGGLE_MANIFEST_TTL", "300"))
+
+_kaggle_manifest: Optional[List[Path]] = None
+_kaggle_manifest_time = 0.0
+
+
+def _walk_model_dirs(root: Path) -> List[Path]:
+    """Return every directory under root that contains a config.json file."""
+    found = []
+    stack = [str(root)]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            stack.append(entry.path)
+                        elif entry.name == "config.json" and entry.is_file():
+                            found.append(Path(current))
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return sorted(found)
+
 
-    candidates = [cfg.parent for cfg in kaggle_input.rglob("config.json")]
+def kaggle_model_dirs(refresh: bool = False) -> List[Path]:
+    """
+    List HF-style model directories under /kaggle/input.
+
+    The tree is walked once and cached for KAGGLE_MANIFEST_TTL seconds, since
+    /kaggle/input is read-only for the life of a session and can hold tens
+    of thousands of files.
+    """
+    global _kaggle_manifest, _kaggle_manifest_time
+    now = time.monotonic()
+    if (
+        refresh
+        or _kaggle_manifest is None
+        or now - _kaggle_manifest_time > KAGGLE_MANIFEST_TTL
+    ):
+        _kaggle_manifest = _walk_model_dirs(KAGGLE_INPUT) if KAGGLE_INPUT.exists() else []
+        _kaggle_manifest_time = now
+    return _kaggle_manifest
+
+
+def _scan_kaggle_input(model_id: str) -> Optional[str]:
+    candidates = kaggle_model_dirs()
     if not candidates:
         return None
 
@@ -127,13 +172,23 @@ def _scan_kaggle_input(model_id: str) -> Optional[str]:
     return None
 
 
-def resolve_model_id(model_id: str) -> str:
-    """Resolve model_id to a concrete HF ID or local path."""
-    # Alias mapping
+@functools.lru_cache(maxsize=32)
+def _configured_model_id(model_id: str) -> tuple:
+    """Map an alias to its HF ID and look up its env override: (model_id, override or None)."""
     model_id = ALIAS_TO_HF.get(model_id, model_id)
+    return model_id, _env_override_for(model_id)
+
 
-    # Environment overrides (local/Kaggle paths)
-    override = _env_override_for(model_id)
+def resolve_model_id(model_id: str) -> str:
+    """
+    Resolve model_id to a concrete HF ID or local path.
+
+    Only the alias and env-override step is memoized; local paths and the
+    /kaggle/input manifest are checked on every call (the manifest itself is
+    cached for KAGGLE_MANIFEST_TTL), so models mounted later are found.
+    """
+    # Alias mapping and environment overrides (local/Kaggle paths)
+    model_id, override = _configured_model_id(model_id)
     if override:
         return override
 
@@ -152,3 +207,23 @@ def resolve_model_id(model_id: str) -> str:
         return local_match
 
     return model_id
+
+
+def refresh_model_resolution() -> None:
+    """
+    Re-read MEDGEMMA_*_MODEL_ID overrides and forget memoized lookups.
+
+    Resolution runs on every /generate and /health call, so env lookups are
+    snapshotted at import and cached; call this after changing the
+    environment at runtime.
+    """
+    global _env_overrides
+    _env_overrides = {
+        model_id: next((os.environ[key] for key in env_keys if os.environ.get(key)), None)
+        for table in (HF_TO_ENV_OVERRIDES, ALIAS_TO_ENV_OVERRIDES)
+        for model_id, env_keys in table.items()
+    }
+    _configured_model_id.cache_clear()
+
+
+refresh_model_resolution()
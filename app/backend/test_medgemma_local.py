@@ -17,9 +17,12 @@ Usage:
 
 import os
 import sys
+import re
 import argparse
+import functools
+from collections import OrderedDict, deque
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, Iterator, Deque
 from dataclasses import dataclass, field
 from enum import Enum
 
@@ -43,6 +46,11 @@ class Role(Enum):
     NURSE = "Nurse"
     PHARMACIST = "Pharmacist"
 
+# Most recent user/assistant turns kept in the transcript; the model itself
+# continues from its KV cache, not from this history
+HISTORY_TURNS = 20
+
+
 @dataclass
 class ConversationState:
     """Tracks conversation state across the EBP workflow."""
@@ -55,19 +63,34 @@ class ConversationState:
         "comparison": "",
         "outcome": ""
     })
-    history: List[Dict[str, str]] = field(default_factory=list)
+    history: Deque[Dict[str, str]] = field(default_factory=lambda: deque(maxlen=2 * HISTORY_TURNS))
+
+
+# Decoding settings per phase. The structured phases (references, appraisal
+# tables, outcome measures) decode greedily with a tighter token budget.
+PHASE_GEN_KWARGS: Dict[Phase, Dict[str, Any]] = {
+    Phase.ASK: dict(max_new_tokens=256, do_sample=True, temperature=0.7),
+    Phase.ACQUIRE: dict(max_new_tokens=384, do_sample=False),
+    Phase.APPRAISE: dict(max_new_tokens=320, do_sample=False),
+    Phase.APPLY: dict(max_new_tokens=384, do_sample=True, temperature=0.7),
+    Phase.ASSESS: dict(max_new_tokens=384, do_sample=False, num_beams=1),
+}
 
 
 # ============================================================================
 # System Prompts (same as frontend)
 # ============================================================================
 
-def get_system_prompt(role: Role, phase: Phase, patient_context: str) -> str:
+@functools.lru_cache(maxsize=None)
+def _static_system_prompt(role: Role, phase: Phase) -> str:
+    """The part of the system prompt that depends only on role and phase.
+    
+    Kept as a stable prefix so its KV state can be precomputed and reused.
+    """
     return f"""
 You are MedGemma, an expert EBP Copilot.
 Current User Role: {role.value}
 Current Phase: {phase.value}
-Patient Context: {patient_context or "None provided yet"}
 
 CORE OBJECTIVE:
 Guide the user through the Evidence-Based Practice (EBP) cycle. Be concise, clinical, and helpful.
@@ -90,149 +113,49 @@ Keep responses focused and clinically relevant.
 """
 
 
+def get_system_prompt(role: Role, phase: Phase, patient_context: str) -> str:
+    return (
+        f"{_static_system_prompt(role, phase)}"
+        f"Patient Context: {patient_context or 'None provided yet'}\n"
+    )
+
+
 # ============================================================================
 # Model Loading
 # ============================================================================
 
-class MedGemmaModel:
-    """Wrapper for MedGemma model inference."""
+# Loaded models are kept for the life of the process; a handful at most
+_MEDGEMMA_CACHE_SIZE = 4
+_medgemma_models: "OrderedDict[tuple, Any]" = OrderedDict()
+
+
+def get_medgemma(
+    model_id: str, device: str = "auto", compile: bool = True, quant: str = "none"
+) -> "MedGemmaModel":
+    """Return the shared MedGemmaModel for these load settings, loading it only once.
     
-    def __init__(self, model_id: str, device: str = "auto"):
-        self.model_id = model_id
-        self.device = device
-        self.model = None
-        self.processor = None
-        self.tokenizer = None
-        self._load_model()
-    
-    def _load_model(self):
-        """Load model and processor/tokenizer."""
-        print(f"🔄 Loading model: {self.model_id}")
-        print(f"   This may take a few minutes for large models...")
-        
-        try:
-            import torch
-            from transformers import AutoTokenizer, AutoProcessor
-        except ImportError:
-            print("❌ Missing dependencies. Install with:")
-            print("   pip install torch transformers accelerate")
-            sys.exit(1)
-        
-        # Determine device and dtype
-        if self.device == "auto":
-            self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        
-        if self.device == "cuda":
-            if torch.cuda.is_bf16_supported():
-                self.dtype = torch.bfloat16
-            else:
-                self.dtype = torch.float16
-        else:
-            self.dtype = torch.float32
-        
-        print(f"   Device: {self.device}, dtype: {self.dtype}")
-        
-        # Check if multimodal
-        is_multimodal = any(kw in self.model_id.lower() for kw in ['4b', 'mm', 'vision', 'multimodal'])
-        
-        # Load model
-        if is_multimodal:
-            # Try multimodal model classes
-            for cls_name in ['AutoModelForImageTextToText', 'AutoModelForVision2Seq', 'AutoModelForCausalLM']:
-                try:
-                    from transformers import AutoModelForCausalLM
-                    ModelClass = getattr(__import__('transformers', fromlist=[cls_name]), cls_name)
-                    break
-                except (AttributeError, ImportError):
-                    continue
-            else:
-                from transformers import AutoModelForCausalLM
-                ModelClass = AutoModelForCausalLM
-            
-            try:
-                self.processor = AutoProcessor.from_pretrained(self.model_id)
-            except Exception:
-                self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
-        else:
-            from transformers import AutoModelForCausalLM
-            ModelClass = AutoModelForCausalLM
-            self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
-        
-        self.model = ModelClass.from_pretrained(
-            self.model_id,
-            device_map="auto" if self.device == "cuda" else None,
-            torch_dtype=self.dtype if self.device == "cuda" else None,
-        )
-        
-        print(f"✅ Model loaded successfully!")
+    torch and transformers are only imported here, so --mock runs without them.
+    """
+    from medgemma_real import MedGemmaModel, release_model_memory
     
-    def generate(self, prompt: str, system_prompt: str = "", max_new_tokens: int = 512) -> str:
-        """Generate text response."""
-        import torch
-        
-        full_prompt = f"{system_prompt}\n\nUser: {prompt}\nAssistant:"
-        
-        # Use processor or tokenizer
-        if self.processor:
-            inputs = self.processor(text=full_prompt, return_tensors="pt")
-        else:
-            inputs = self.tokenizer(full_prompt, return_tensors="pt")
-        
-        # Move to device
-        inputs = {k: v.to(self.model.device) if hasattr(v, 'to') else v for k, v in inputs.items()}
-        
-        with torch.inference_mode():
-            outputs = self.model.generate(
-                **inputs,
-                max_new_tokens=max_new_tokens,
-                do_sample=True,
-                temperature=0.7,
-                pad_token_id=self.tokenizer.eos_token_id if self.tokenizer else None
-            )
-        
-        # Decode
-        if self.processor and hasattr(self.processor, 'batch_decode'):
-            text = self.processor.batch_decode(outputs, skip_special_tokens=True)[0]
-        else:
-            text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-        
-        # Extract assistant response
-        if "Assistant:" in text:
-            text = text.split("Assistant:")[-1].strip()
-        
-        return text
+    key = (model_id, device, compile, quant)
+    model = _medgemma_models.get(key)
+    if model is not None:
+        _medgemma_models.move_to_end(key)
+        return model
+    
+    model = _medgemma_models[key] = MedGemmaModel(model_id, device=device, compile=compile, quant=quant)
+    if len(_medgemma_models) > _MEDGEMMA_CACHE_SIZE:
+        _medgemma_models.popitem(last=False)
+        release_model_memory()
+    return model
 
 
 # ============================================================================
 # Mock Model (for testing without GPU)
 # ============================================================================
 
-class MockMedGemmaModel:
-    """Mock model for testing the workflow without actual model inference."""
-    
-    def __init__(self, model_id: str = "mock"):
-        self.model_id = model_id
-        print(f"🧪 Using MOCK model (no actual inference)")
-        print(f"   This simulates responses for workflow testing.")
-    
-    def generate(self, prompt: str, system_prompt: str = "", max_new_tokens: int = 512) -> str:
-        """Generate simulated response based on phase."""
-        prompt_lower = prompt.lower()
-        
-        # Detect phase from system prompt - look for "Current Phase: X"
-        if "Current Phase: ASSESS" in system_prompt:
-            return self._assess_phase_response(prompt)
-        elif "Current Phase: APPLY" in system_prompt:
-            return self._apply_phase_response(prompt)
-        elif "Current Phase: APPRAISE" in system_prompt:
-            return self._appraise_phase_response(prompt)
-        elif "Current Phase: ACQUIRE" in system_prompt:
-            return self._acquire_phase_response(prompt)
-        else:
-            return self._ask_phase_response(prompt)
-    
-    def _ask_phase_response(self, prompt: str) -> str:
-        return """Based on your case, I'm formulating a PICO question:
+MOCK_ASK_RESPONSE = """Based on your case, I'm formulating a PICO question:
 
 **P (Patient):** Adult patient with the described condition
 **I (Intervention):** The treatment approach you're considering  
@@ -244,8 +167,7 @@ Could you provide more details about:
 2. What intervention you're considering?
 3. What outcome measures matter most?"""
 
-    def _acquire_phase_response(self, prompt: str) -> str:
-        return """I found the following relevant evidence:
+MOCK_ACQUIRE_RESPONSE = """I found the following relevant evidence:
 
 **1. Smith et al. (2024)** - NEJM
    - RCT, n=450, High relevance
@@ -261,8 +183,7 @@ Could you provide more details about:
 
 Would you like me to appraise these studies for methodological quality?"""
 
-    def _appraise_phase_response(self, prompt: str) -> str:
-        return """Critical appraisal of the evidence:
+MOCK_APPRAISE_RESPONSE = """Critical appraisal of the evidence:
 
 **Strengths:**
 ✅ Adequate sample sizes across studies
@@ -278,8 +199,7 @@ Would you like me to appraise these studies for methodological quality?"""
 
 **Overall:** Evidence supports intervention with moderate confidence."""
 
-    def _apply_phase_response(self, prompt: str) -> str:
-        return """Based on the evidence, here are clinical recommendations:
+MOCK_APPLY_RESPONSE = """Based on the evidence, here are clinical recommendations:
 
 **Actions:**
 1. **Initiate treatment** - Evidence supports starting intervention
@@ -294,8 +214,7 @@ Would you like me to appraise these studies for methodological quality?"""
 
 Ready to establish outcome measures?"""
 
-    def _assess_phase_response(self, prompt: str) -> str:
-        return """Outcome assessment plan:
+MOCK_ASSESS_RESPONSE = """Outcome assessment plan:
 
 **Primary Outcomes:**
 | Metric | Target | Frequency |
@@ -316,6 +235,86 @@ Ready to establish outcome measures?"""
 
 This completes the EBP cycle. Would you like to start a new case?"""
 
+MOCK_PHASE_RESPONSES: Dict[Phase, str] = {
+    Phase.ASK: MOCK_ASK_RESPONSE,
+    Phase.ACQUIRE: MOCK_ACQUIRE_RESPONSE,
+    Phase.APPRAISE: MOCK_APPRAISE_RESPONSE,
+    Phase.APPLY: MOCK_APPLY_RESPONSE,
+    Phase.ASSESS: MOCK_ASSESS_RESPONSE,
+}
+
+_PHASE_LINE = re.compile(r"Current Phase: (\w+)")
+
+
+def _phase_from_system_prompt(system_prompt: str) -> Phase:
+    """Read the phase from a system prompt's "Current Phase: X" line, defaulting to ASK."""
+    match = _PHASE_LINE.search(system_prompt)
+    try:
+        return Phase(match.group(1)) if match else Phase.ASK
+    except ValueError:
+        return Phase.ASK
+
+
+class MockMedGemmaModel:
+    """Mock model for testing the workflow without actual model inference."""
+    
+    def __init__(self, model_id: str = "mock"):
+        self.model_id = model_id
+        print(f"🧪 Using MOCK model (no actual inference)")
+        print(f"   This simulates responses for workflow testing.")
+    
+    def generate(
+        self,
+        prompt: str,
+        system_prompt: str = "",
+        max_new_tokens: int = 512,
+        stop_when: Optional[Callable[[str], bool]] = None,
+        gen_kwargs: Optional[Dict[str, Any]] = None,
+        phase: Optional[Phase] = None,
+    ) -> str:
+        """Return the canned response for `phase`, read from the system prompt if not given."""
+        if phase is None:
+            phase = _phase_from_system_prompt(system_prompt)
+        return MOCK_PHASE_RESPONSES[phase]
+    
+    def generate_batch(
+        self,
+        prompts: List[str],
+        system_prompts: List[str],
+        max_new_tokens: int = 512,
+        stop_when: Optional[Callable[[str], bool]] = None,
+        gen_kwargs: Optional[List[Optional[Dict[str, Any]]]] = None,
+        phases: Optional[List[Optional[Phase]]] = None,
+    ) -> List[str]:
+        """Generate simulated responses for several prompts, one phase per prompt."""
+        return [
+            self.generate(prompt, system_prompt, max_new_tokens, phase=phase)
+            for prompt, system_prompt, phase in zip(
+                prompts, system_prompts, phases or [None] * len(prompts)
+            )
+        ]
+    
+    def generate_turn(
+        self,
+        prompt: str,
+        system_prompt: str = "",
+        past_key_values=None,
+        cached_token_ids=None,
+        max_new_tokens: int = 512,
+        stop_when: Optional[Callable[[str], bool]] = None,
+        system_prefix: Optional[str] = None,
+        gen_kwargs: Optional[Dict[str, Any]] = None,
+        phase: Optional[Phase] = None,
+    ):
+        """Generate a simulated turn; there is no KV cache to carry over."""
+        return self.generate(prompt, system_prompt, max_new_tokens, stop_when, phase=phase), None, None
+    
+    def generate_stream(self, prompt: str, system_prompt: str = "", **turn_kwargs) -> Iterator[str]:
+        """Yield a simulated turn in one piece."""
+        turn = self.generate_turn(prompt, system_prompt, **turn_kwargs)
+        yield turn[0]
+        return turn
+
 
 # ============================================================================
 # Conversation Runner
@@ -327,28 +326,68 @@ class EBPConversation:
     def __init__(self, model, state: Optional[ConversationState] = None):
         self.model = model
         self.state = state or ConversationState()
+        # KV cache and token ids (prompts plus generated replies) of the
+        # conversation so far, valid for `cache_system_prompt`. Earlier turns
+        # are never re-tokenized; each turn only encodes its new user text.
+        self.past_key_values = None
+        self.cached_token_ids = None
+        self.cache_system_prompt = None
     
     def send_message(self, user_message: str) -> str:
         """Send a message and get response."""
-        # Get system prompt
+        turn_kwargs = self._turn_kwargs(user_message)
+        return self._finish_turn(turn_kwargs, self.model.generate_turn(**turn_kwargs))
+    
+    def stream_message(self, user_message: str) -> Iterator[str]:
+        """Send a message, yielding the response text as it is generated."""
+        turn_kwargs = self._turn_kwargs(user_message)
+        finished = False
+        try:
+            turn = yield from self.model.generate_stream(**turn_kwargs)
+            self._finish_turn(turn_kwargs, turn)
+            finished = True
+        finally:
+            if not finished:
+                # An interrupted turn has already extended the cache in place
+                self.past_key_values = None
+                self.cached_token_ids = None
+    
+    def _turn_kwargs(self, user_message: str) -> Dict[str, Any]:
+        """Arguments for the model's next turn, starting from the cached conversation if still valid."""
         system_prompt = get_system_prompt(
             self.state.role,
             self.state.phase,
             self.state.patient_context
         )
         
-        # Generate response
-        response = self.model.generate(
+        # A new phase, role or patient context invalidates the cached prefix
+        if system_prompt != self.cache_system_prompt:
+            self.past_key_values = None
+            self.cached_token_ids = None
+        
+        # Only the new turn is prefilled when the cache is warm
+        return dict(
             prompt=user_message,
             system_prompt=system_prompt,
-            max_new_tokens=512
+            past_key_values=self.past_key_values,
+            cached_token_ids=self.cached_token_ids,
+            max_new_tokens=512,
+            system_prefix=_static_system_prompt(self.state.role, self.state.phase),
+            gen_kwargs=PHASE_GEN_KWARGS.get(self.state.phase),
+            phase=self.state.phase,
         )
-        
-        # Update history
+    
+    def _finish_turn(self, turn_kwargs: Dict[str, Any], turn) -> str:
+        """Keep the turn's KV cache for the next message and record the exchange."""
+        response, self.past_key_values, self.cached_token_ids = turn
+        self.cache_system_prompt = turn_kwargs["system_prompt"]
+        self.record_exchange(turn_kwargs["prompt"], response)
+        return response
+    
+    def record_exchange(self, user_message: str, response: str):
+        """Append a user message and the model's reply to the history."""
         self.state.history.append({"role": "user", "content": user_message})
         self.state.history.append({"role": "assistant", "content": response})
-        
-        return response
     
     def advance_phase(self):
         """Move to next EBP phase."""
@@ -400,13 +439,28 @@ def run_automated_test(model):
         ("What outcomes should I track to measure treatment success?"),
     ]
     
-    for i, message in enumerate(test_cases):
+    # Each phase's message is answered independently of the earlier replies,
+    # so all five are generated in one call, batched by phase decoding settings
+    phases = list(Phase)[:len(test_cases)]
+    system_prompts = [
+        get_system_prompt(conv.state.role, phase, conv.state.patient_context)
+        for phase in phases
+    ]
+    responses = model.generate_batch(
+        test_cases,
+        system_prompts,
+        max_new_tokens=512,
+        gen_kwargs=[PHASE_GEN_KWARGS.get(phase) for phase in phases],
+        phases=phases,
+    )
+    
+    for i, (message, response) in enumerate(zip(test_cases, responses)):
         print(f"\n{'─'*50}")
         print(f"📍 Phase: {conv.state.phase.value}")
         print(f"{'─'*50}")
         print(f"\n👤 USER: {message[:100]}..." if len(message) > 100 else f"\n👤 USER: {message}")
         
-        response = conv.send_message(message)
+        conv.record_exchange(message, response)
         print(f"\n🤖 MEDGEMMA:\n{response}")
         
         # Advance phase (except for last message)
@@ -474,9 +528,17 @@ def run_interactive_mode(model):
                 print(f"Unknown command: {cmd[0]}")
             continue
         
-        # Send message
-        response = conv.send_message(user_input)
-        print(f"\n🤖 MedGemma: {response}")
+        # Stream the reply as it is generated; Ctrl-C stops generation early
+        print(f"\n🤖 MedGemma: ", end="", flush=True)
+        stream = conv.stream_message(user_input)
+        try:
+            for chunk in stream:
+                print(chunk, end="", flush=True)
+        except KeyboardInterrupt:
+            stream.close()
+            print("\n⏹️  Generation stopped.")
+        else:
+            print()
 
 
 # ============================================================================
@@ -493,6 +555,10 @@ def main():
                         help="Run in interactive mode instead of automated test")
     parser.add_argument("--device", type=str, default="auto",
                         help="Device: auto, cuda, cpu")
+    parser.add_argument("--compile", action=argparse.BooleanOptionalAction, default=True,
+                        help="torch.compile the model on CUDA (default: on)")
+    parser.add_argument("--quant", choices=["none", "int8", "nf4"], default="none",
+                        help="Load weights quantized with bitsandbytes on CUDA (trades accuracy for speed)")
     
     args = parser.parse_args()
     
@@ -504,6 +570,12 @@ def main():
     if args.mock:
         model = MockMedGemmaModel()
     else:
+        # Nothing in this script trains; keep autograd off outside inference_mode blocks too
+        try:
+            import torch
+            torch.set_grad_enabled(False)
+        except ImportError:
+            pass
         model_id = args.model or os.getenv("MEDGEMMA_MODEL_ID", "google/medgemma-1.5-4b-it")
         resolved_id = resolve_model_id(model_id)
         if resolved_id != model_id:
@@ -516,7 +588,7 @@ def main():
             print("   export HF_TOKEN=your_huggingface_token")
         
         try:
-            model = MedGemmaModel(model_id, device=args.device)
+            model = get_medgemma(model_id, device=args.device, compile=args.compile, quant=args.quant)
         except Exception as e:
             print(f"\n❌ Failed to load model: {e}")
             print("\n💡 Try running with --mock to test the workflow without a model:")
@@ -0,0 +1,87 @@
+"""Shared fixtures for the backend test suite."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from validators.completeness_checker import CompletenessChecker
+from validators.safety_checker import SafetyChecker
+
+# torch and the backend app are imported inside the fixtures that need them,
+# so validator- and eval-only test modules run without torch installed
+
+
+@pytest.fixture(scope="session")
+def client():
+    """One test client for the whole session, running app startup once."""
+    from fastapi.testclient import TestClient
+    from medgemma_backend import app
+
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture(scope="session")
+def completeness_checker():
+    """One CompletenessChecker for the session; it keeps no per-call state."""
+    return CompletenessChecker()
+
+
+@pytest.fixture(scope="session")
+def safety_checker():
+    """One SafetyChecker for the session; it keeps no per-call state."""
+    return SafetyChecker()
+
+
+@pytest.fixture(scope="session")
+def _local_model_and_processor():
+    """Build the mocked local MedGemma once; MagicMock trees are slow to create."""
+    import torch
+
+    mock_model = MagicMock()
+    mock_model.device = "cpu"
+    # MedGemma tokenizes through apply_chat_template(tokenize=True, return_dict=True);
+    # other models render a string with it and tokenize by calling the processor
+    mock_processor = MagicMock(spec=["apply_chat_template", "__call__", "decode"])
+    mock_processor.apply_chat_template = MagicMock()
+    mock_processor.decode = MagicMock()
+    # Prompt/output token ids returned on every call
+    mock_ids = torch.tensor([[1, 2, 3]]), torch.tensor([[1, 2, 3, 4, 5]])
+    return mock_model, mock_processor, mock_ids
+
+
+@pytest.fixture
+def local_model_and_processor(_local_model_and_processor):
+    """Mocked local MedGemma model and processor, reset for each test."""
+    import medgemma_backend
+
+    mock_model, mock_processor, (input_ids, output_ids) = _local_model_and_processor
+    mock_model.reset_mock(return_value=True, side_effect=True)
+    mock_processor.reset_mock(return_value=True, side_effect=True)
+    mock_model.generate.return_value = [output_ids]
+    mock_processor.apply_chat_template.return_value = {"input_ids": input_ids}
+    mock_processor.return_value = {"input_ids": input_ids}
+    mock_processor.decode.return_value = "Local model response."
+    # Rendered prompts are cached per processor, which would skip apply_chat_template
+    medgemma_backend._prompt_cache.pop(mock_processor, None)
+    return mock_model, mock_processor
+
+
+@pytest.fixture
+def truthy_genai_client():
+    """Patch in a configured Google AI client whose replies read "OK".
+
+    Tests override ``aio.models.generate_content.return_value.text`` when
+    they check the reply.
+    """
+    mock_gc = MagicMock()
+    mock_gc.__bool__ = lambda self: True
+    mock_response = MagicMock()
+    mock_response.text = "OK"
+    mock_gc.aio.models.generate_content = AsyncMock(return_value=mock_response)
+    with patch("medgemma_backend.genai_client", mock_gc):
+        yield mock_gc
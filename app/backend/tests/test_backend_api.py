@@ -17,17 +17,17 @@ from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+import asyncio
+import json
+import threading
+
 import pytest
-from fastapi.testclient import TestClient
+import torch
+from pydantic import ValidationError
 from unittest.mock import patch, MagicMock
 
-from medgemma_backend import app, GenerateRequest, HistoryMessage
-
-
-@pytest.fixture
-def client():
-    """Create a test client for the FastAPI app."""
-    return TestClient(app)
+import medgemma_backend
+from medgemma_backend import GenerateBatcher, GenerateRequest, HistoryMessage, PrefixKVCache
 
 
 # ============================================================================
@@ -113,6 +113,29 @@ class TestGenerateEndpoint:
         """Missing required fields should return 422."""
         response = client.post("/generate", json={})
         assert response.status_code == 422
+        assert response.json()["detail"][0]["loc"] == ["body", "model_id"]
+
+    def test_generate_rejects_malformed_json(self, client):
+        response = client.post("/generate", content=b"{bad", headers=_JSON_HEADERS)
+        assert response.status_code == 422
+        assert response.json()["detail"][0]["type"] == "json_invalid"
+
+    def test_generate_ignores_unknown_fields(self):
+        request = GenerateRequest.model_validate({
+            "model_id": "test-model",
+            "message": "test",
+            "history": [{"role": "user", "content": "hi", "timestamp": 1}],
+            "sessionId": "abc",
+        })
+        assert not hasattr(request, "sessionId")
+        assert request.history[0].model_dump() == {"role": "user", "content": "hi"}
+
+    def test_generate_request_is_frozen(self):
+        request = GenerateRequest(model_id="test-model", message="test")
+        with pytest.raises(ValidationError):
+            request.message = "changed"
+        with pytest.raises(ValidationError):
+            request.history = [HistoryMessage(role="user", content="hi")]
 
     def test_generate_accepts_history(self, client):
         """Request with history should not crash on schema validation."""
@@ -163,64 +186,49 @@ class TestGenerateEndpoint:
 # Generate with Mock Model Tests
 # ============================================================================
 
-class TestGenerateWithMockModel:
-    """Tests for /generate with a mocked model to verify response flow."""
+# Request body posted by several tests, JSON-encoded once
+_JSON_HEADERS = {"content-type": "application/json"}
+_TEST_MODEL_BODY = json.dumps({"model_id": "test-model", "message": "test", "history": []}).encode()
 
-    def _mock_model_and_processor(self):
-        """Create mock model and processor that return a test response."""
-        import torch
-
-        mock_model = MagicMock()
-        mock_model.device = "cpu"
 
-        # Use spec to control which attributes exist
-        mock_processor = MagicMock(spec=["apply_chat_template", "__call__", "decode"])
-        mock_processor.apply_chat_template = MagicMock(return_value="formatted prompt")
-
-        mock_input_ids = torch.tensor([[1, 2, 3, 4, 5]])
-        mock_processor.return_value = {"input_ids": mock_input_ids}
-
-        mock_output = torch.tensor([[1, 2, 3, 4, 5, 6, 7, 8]])
-        mock_model.generate = MagicMock(return_value=[mock_output])
-        mock_processor.decode = MagicMock(return_value="This is a test response.")
-
-        return mock_model, mock_processor
+class TestGenerateWithMockModel:
+    """Tests for /generate with a mocked model to verify response flow."""
 
     @patch("medgemma_backend._is_local_model_available", return_value=True)
     @patch("medgemma_backend.get_model_and_processor")
-    def test_generate_returns_text(self, mock_get_model, mock_local, client):
-        mock_model, mock_processor = self._mock_model_and_processor()
+    def test_generate_returns_text(self, mock_get_model, mock_local, client, local_model_and_processor):
+        mock_model, mock_processor = local_model_and_processor
         mock_get_model.return_value = (mock_model, mock_processor)
 
-        response = client.post("/generate", json={
-            "model_id": "test-model",
-            "message": "test",
-            "history": [],
-        })
+        response = client.post("/generate", content=_TEST_MODEL_BODY, headers=_JSON_HEADERS)
         assert response.status_code == 200
         data = response.json()
         assert "text" in data
         assert "model_used" in data
         assert data["model_used"] == "local:test-model"
+        assert response.headers["content-type"] == "application/json"
+
+    def test_generate_schema_still_documented(self, client):
+        schema = client.get("/openapi.json").json()
+        ok = schema["paths"]["/generate"]["post"]["responses"]["200"]
+        assert ok["content"]["application/json"]["schema"]["$ref"].endswith("/GenerateResponse")
+        body = schema["paths"]["/generate"]["post"]["requestBody"]
+        assert body["content"]["application/json"]["schema"]["title"] == "GenerateRequest"
 
     @patch("medgemma_backend._is_local_model_available", return_value=True)
     @patch("medgemma_backend.get_model_and_processor")
-    def test_generate_strips_assistant_prefix(self, mock_get_model, mock_local, client):
-        mock_model, mock_processor = self._mock_model_and_processor()
+    def test_generate_strips_assistant_prefix(self, mock_get_model, mock_local, client, local_model_and_processor):
+        mock_model, mock_processor = local_model_and_processor
         mock_get_model.return_value = (mock_model, mock_processor)
 
-        response = client.post("/generate", json={
-            "model_id": "test-model",
-            "message": "test",
-            "history": [],
-        })
+        response = client.post("/generate", content=_TEST_MODEL_BODY, headers=_JSON_HEADERS)
         data = response.json()
-        assert data["text"] == "This is a test response."
+        assert data["text"] == "Local model response."
 
     @patch("medgemma_backend._is_local_model_available", return_value=True)
     @patch("medgemma_backend.get_model_and_processor")
-    def test_generate_with_system_prompt_includes_it(self, mock_get_model, mock_local, client):
-        mock_model, mock_processor = self._mock_model_and_processor()
+    def test_generate_with_system_prompt_includes_it(self, mock_get_model, mock_local, client, local_model_and_processor):
+        mock_model, mock_processor = local_model_and_processor
         mock_get_model.return_value = (mock_model, mock_processor)
 
         response = client.post("/generate", json={
@@ -234,21 +242,187 @@ class TestGenerateWithMockModel:
 
     @patch("medgemma_backend._is_local_model_available", return_value=True)
     @patch("medgemma_backend.get_model_and_processor")
-    def test_generate_handles_generation_error(self, mock_get_model, mock_local, client):
-        mock_model, mock_processor = self._mock_model_and_processor()
+    def test_generate_handles_generation_error(self, mock_get_model, mock_local, client, local_model_and_processor):
+        mock_model, mock_processor = local_model_and_processor
         mock_model.generate.side_effect = RuntimeError("CUDA out of memory")
         mock_get_model.return_value = (mock_model, mock_processor)
 
-        response = client.post("/generate", json={
-            "model_id": "test-model",
-            "message": "test",
-            "history": [],
-        })
+        response = client.post("/generate", content=_TEST_MODEL_BODY, headers=_JSON_HEADERS)
         assert response.status_code == 500
         detail = response.json()["detail"]
         assert "Generation failed" in detail or "not available" in detail
 
 
+# ============================================================================
+# Local Generation Batching Tests
+# ============================================================================
+
+class TestGenerateBatcher:
+    """Tests for coalescing concurrent local generations."""
+
+    def setup_method(self):
+        # torch is imported lazily, normally by app startup
+        medgemma_backend.ensure_torch()
+
+    def _recording_model(self):
+        mock_model = MagicMock()
+        mock_model.generate = MagicMock(
+            side_effect=lambda input_ids, **kw: torch.cat(
+                [input_ids, torch.full((input_ids.shape[0], 2), 9)], dim=-1
+            )
+        )
+        mock_processor = MagicMock(spec=["pad_token_id"])
+        mock_processor.pad_token_id = 0
+        return mock_model, mock_processor
+
+    def _submit_all(self, batcher, model, processor, prompts):
+        async def run():
+            return await asyncio.gather(*[
+                batcher.submit(model, processor, {"input_ids": torch.tensor([p])}, {"max_new_tokens": 2})
+                for p in prompts
+            ])
+        return asyncio.run(run())
+
+    def test_concurrent_requests_share_one_generate_call(self):
+        model, processor = self._recording_model()
+        batcher = GenerateBatcher(max_batch_size=8, max_delay=0.01)
+        results = self._submit_all(batcher, model, processor, [[1, 2, 3], [4, 5]])
+
+        assert model.generate.call_count == 1
+        call_kwargs = model.generate.call_args[1]
+        assert call_kwargs["input_ids"].tolist() == [[1, 2, 3], [0, 4, 5]]
+        assert call_kwargs["attention_mask"].tolist() == [[1, 1, 1], [0, 1, 1]]
+        assert [r.tolist() for r in results] == [[9, 9], [9, 9]]
+
+    def test_full_batch_cancels_its_flush_timer(self):
+        model, processor = self._recording_model()
+        batcher = GenerateBatcher(max_batch_size=2, max_delay=0.2)
+
+        async def run():
+            first = [
+                batcher.submit(model, processor, {"input_ids": torch.tensor([p])}, {"max_new_tokens": 2})
+                for p in ([1, 2], [3, 4])
+            ]
+            await asyncio.gather(*first)
+            # Opened after the first batch filled; only its own timer may flush it
+            await asyncio.sleep(0.1)
+            late = asyncio.ensure_future(
+                batcher.submit(model, processor, {"input_ids": torch.tensor([[5, 6]])}, {"max_new_tokens": 2})
+            )
+            await asyncio.sleep(0.15)
+            assert not late.done()
+            await late
+
+        asyncio.run(run())
+        assert model.generate.call_count == 2
+
+    def test_batch_size_one_generates_each_request(self):
+        model, processor = self._recording_model()
+        batcher = GenerateBatcher(max_batch_size=1)
+        self._submit_all(batcher, model, processor, [[1, 2, 3], [4, 5]])
+
+        assert model.generate.call_count == 2
+
+
+# ============================================================================
+# Prefix KV Cache Tests
+# ============================================================================
+
+class _FakeCache:
+    """Stand-in for a transformers DynamicCache holding `length` positions."""
+
+    def __init__(self, length):
+        self.length = length
+
+    def crop(self, length):
+        self.length = length
+
+    def get_seq_length(self):
+        return self.length
+
+
+class TestPrefixKVCache:
+    """Tests for reusing KV caches across conversation turns."""
+
+    def setup_method(self):
+        self.cache = PrefixKVCache(max_entries=2)
+
+    def test_lookup_crops_to_shared_prefix(self):
+        self.cache.store(torch.tensor([1, 2, 3, 4, 5]), _FakeCache(5))
+        cache, reused = self.cache.lookup(torch.tensor([1, 2, 3, 9, 9, 9]))
+        assert reused == 3
+        assert cache.get_seq_length() == 3
+
+    def test_lookup_leaves_last_prompt_token_uncached(self):
+        self.cache.store(torch.tensor([1, 2, 3]), _FakeCache(3))
+        _, reused = self.cache.lookup(torch.tensor([1, 2, 3]))
+        assert reused == 2
+
+    def test_lookup_returns_copy(self):
+        stored = _FakeCache(4)
+        self.cache.store(torch.tensor([1, 2, 3, 4]), stored)
+        self.cache.lookup(torch.tensor([1, 2, 7]))
+        assert stored.get_seq_length() == 4
+
+    def test_miss_and_eviction(self):
+        for start in (10, 20, 30):
+            self.cache.store(torch.tensor([start, start + 1]), _FakeCache(2))
+        assert self.cache.lookup(torch.tensor([10, 11, 12])) == (None, 0)
+        assert self.cache.lookup(torch.tensor([30, 31, 32]))[1] == 2
+
+    def test_store_waits_for_concurrent_lookup(self):
+        self.cache.store(torch.tensor([1, 2, 3]), _FakeCache(3))
+        self.cache.store(torch.tensor([1, 2, 5]), _FakeCache(3))
+        writer = threading.Thread(target=self.cache.store, args=(torch.tensor([7, 8]), _FakeCache(2)))
+
+        class _StoreMidLookup:
+            """Prompt ids that start a store() while lookup() is iterating."""
+            shape = (4,)
+
+            def __getitem__(self, index):
+                if not writer.is_alive() and writer.ident is None:
+                    writer.start()
+                    writer.join(timeout=0.2)
+                return torch.tensor([1, 2, 3, 4])[index]
+
+        # Without the cache's lock, store() would mutate the OrderedDict mid-iteration
+        _, reused = self.cache.lookup(_StoreMidLookup())
+        writer.join()
+        assert reused == 3
+        assert self.cache.lookup(torch.tensor([7, 8, 9]))[1] == 2
+
+
+# ============================================================================
+# Device Transfer Tests
+# ============================================================================
+
+class TestToDevice:
+    """Tests for moving inputs onto a CUDA device, with the CUDA calls mocked."""
+
+    def setup_method(self):
+        # torch is imported lazily, normally by app startup
+        medgemma_backend.ensure_torch()
+        medgemma_backend._copy_stream.cache_clear()
+
+    def teardown_method(self):
+        # Don't leak a mocked stream into later tests
+        medgemma_backend._copy_stream.cache_clear()
+
+    @patch("torch.cuda.stream")
+    @patch("torch.cuda.current_stream")
+    @patch("torch.cuda.Stream")
+    def test_copy_stream_reused_and_device_tensors_kept(self, mock_stream_cls, mock_current, mock_ctx):
+        from medgemma_backend import _to_device
+
+        # A tensor that is not on the host must not be pinned or copied
+        on_device = torch.empty(2, device="meta")
+        for _ in range(2):
+            moved = _to_device({"pixel_values": on_device, "flag": True}, "cuda:0")
+            assert moved["pixel_values"] is on_device
+            assert moved["flag"] is True
+        mock_stream_cls.assert_called_once_with(device=torch.device("cuda", 0))
+
+
 # ============================================================================
 # CORS Tests
 # ============================================================================
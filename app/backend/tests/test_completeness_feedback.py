@@ -18,56 +18,62 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 import pytest
 from validators.completeness_checker import (
-    CompletenessChecker,
     CompletenessResult,
     FieldQuality,
     FieldCheck,
+    PICO_MIN_WORDS,
+    _assess_text_field,
 )
 
 
+LONG_DESCRIPTION = " ".join(["word"] * 250)
+
+
 class TestFieldLevelFeedback:
     """Tests that completeness results provide field-level guidance on what's missing."""
 
-    def setup_method(self):
-        self.checker = CompletenessChecker()
-
-    def test_empty_pico_identifies_all_fields_missing(self):
+    def test_empty_pico_identifies_all_fields_missing(self, completeness_checker):
         """Empty PICO should report all 4 fields as empty."""
-        result = self.checker.check_pico({
+        result = completeness_checker.check_pico({
             "patient": "", "intervention": "", "comparison": "", "outcome": ""
         })
         empty_fields = [fc for fc in result.field_checks if fc.quality == FieldQuality.EMPTY]
         assert len(empty_fields) == 4
 
-    def test_partial_pico_identifies_specific_missing_fields(self):
+    def test_partial_pico_identifies_specific_missing_fields(self, completeness_checker):
         """Partial PICO should name the exact missing fields."""
-        result = self.checker.check_pico({
+        result = completeness_checker.check_pico({
             "patient": "adults with type 2 diabetes",
             "intervention": "semaglutide",
             "comparison": "",
             "outcome": "",
         })
-        field_map = {fc.field_name: fc for fc in result.field_checks}
-        assert field_map["comparison"].quality == FieldQuality.EMPTY
-        assert field_map["outcome"].quality == FieldQuality.EMPTY
-        assert field_map["patient"].quality != FieldQuality.EMPTY
-        assert field_map["intervention"].quality != FieldQuality.EMPTY
+        assert result.get_field("comparison").quality == FieldQuality.EMPTY
+        assert result.get_field("outcome").quality == FieldQuality.EMPTY
+        assert result.get_field("patient").quality != FieldQuality.EMPTY
+        assert result.get_field("intervention").quality != FieldQuality.EMPTY
 
-    def test_issues_list_names_missing_fields(self):
+    def test_issues_list_names_missing_fields(self, completeness_checker):
         """Issues list should contain field names for empty fields."""
-        result = self.checker.check_pico({
+        result = completeness_checker.check_pico({
             "patient": "adults with diabetes mellitus",
             "intervention": "GLP-1 agonists",
             "comparison": "",
             "outcome": "",
         })
-        issue_text = " ".join(result.issues)
+        issue_text = result.issues_text
         assert "comparison" in issue_text
         assert "outcome" in issue_text
+        assert result.missing_field_names() == ("comparison", "outcome")
 
-    def test_vague_field_flagged_with_reason(self):
+    def test_unchecked_field_lookup_raises(self, completeness_checker):
+        result = completeness_checker.check_pico({"patient": "adults with diabetes"})
+        with pytest.raises(KeyError):
+            result.get_field("population")
+
+    def test_vague_field_flagged_with_reason(self, completeness_checker):
         """Vague values should produce an issue explaining the problem."""
-        result = self.checker.check_pico({
+        result = completeness_checker.check_pico({
             "patient": "unknown",
             "intervention": "n/a",
             "comparison": "TBD",
@@ -79,73 +85,68 @@ class TestFieldLevelFeedback:
             # Issue should mention placeholder/vague
             assert "placeholder" in fc.issue or "empty" in fc.issue
 
-    def test_brief_field_flagged_as_minimal(self):
+    def test_brief_field_flagged_as_minimal(self, completeness_checker):
         """Single-word patient (below 3-word min) should be MINIMAL."""
-        result = self.checker.check_pico({
+        result = completeness_checker.check_pico({
             "patient": "adults",
             "intervention": "therapy for stroke rehabilitation",
             "comparison": "placebo",
             "outcome": "motor recovery improvement",
         })
-        field_map = {fc.field_name: fc for fc in result.field_checks}
-        assert field_map["patient"].quality == FieldQuality.MINIMAL
-        assert "brief" in field_map["patient"].issue or "words" in field_map["patient"].issue
+        assert result.get_field("patient").quality == FieldQuality.MINIMAL
+        assert "brief" in result.get_field("patient").issue or "words" in result.get_field("patient").issue
 
-    def test_uncertain_language_flagged(self):
+    def test_uncertain_language_flagged(self, completeness_checker):
         """Fields containing 'ask user' or 'unclear' should be flagged."""
-        result = self.checker.check_pico({
+        result = completeness_checker.check_pico({
             "patient": "adults with diabetes",
             "intervention": "unclear - ask user",
             "comparison": "not specified",
             "outcome": "to be determined",
         })
-        field_map = {fc.field_name: fc for fc in result.field_checks}
-        assert field_map["intervention"].quality == FieldQuality.MINIMAL
-        assert field_map["comparison"].quality == FieldQuality.EMPTY
-        assert field_map["outcome"].quality == FieldQuality.EMPTY
+        assert result.get_field("intervention").quality == FieldQuality.MINIMAL
+        assert result.get_field("comparison").quality == FieldQuality.EMPTY
+        assert result.get_field("outcome").quality == FieldQuality.EMPTY
 
 
 class TestCompletenessGuidance:
     """Tests that completeness results guide the user on how to improve."""
 
-    def setup_method(self):
-        self.checker = CompletenessChecker()
-
-    def test_missing_field_generates_guidance(self):
+    def test_missing_field_generates_guidance(self, completeness_checker):
         """get_guidance() should suggest what to fill next."""
-        result = self.checker.check_pico({
+        result = completeness_checker.check_pico({
             "patient": "adults with knee osteoarthritis",
             "intervention": "",
             "comparison": "",
             "outcome": "",
         })
-        guidance = self.checker.get_guidance(result)
+        guidance = completeness_checker.get_guidance(result)
         assert isinstance(guidance, list)
         assert len(guidance) > 0
         # Should suggest filling the biggest gap
         guidance_text = " ".join(guidance)
         assert "intervention" in guidance_text.lower() or "comparison" in guidance_text.lower() or "outcome" in guidance_text.lower()
 
-    def test_complete_pico_returns_no_guidance(self):
+    def test_complete_pico_returns_no_guidance(self, completeness_checker):
         """Complete PICO should have no improvement guidance."""
-        result = self.checker.check_pico({
+        result = completeness_checker.check_pico({
             "patient": "elderly patients with type 2 diabetes and obesity",
             "intervention": "GLP-1 receptor agonists (semaglutide)",
             "comparison": "sulfonylurea or SGLT2 inhibitors",
             "outcome": "weight loss and cardiovascular outcomes",
         })
-        guidance = self.checker.get_guidance(result)
+        guidance = completeness_checker.get_guidance(result)
         assert len(guidance) == 0
 
-    def test_guidance_prioritizes_empty_over_minimal(self):
+    def test_guidance_prioritizes_empty_over_minimal(self, completeness_checker):
         """Guidance should suggest empty fields before minimal ones."""
-        result = self.checker.check_pico({
+        result = completeness_checker.check_pico({
             "patient": "adults",  # MINIMAL (1 word, needs 3)
             "intervention": "therapy",  # MINIMAL (1 word, needs 2)
             "comparison": "",  # EMPTY
             "outcome": "",  # EMPTY
         })
-        guidance = self.checker.get_guidance(result)
+        guidance = completeness_checker.get_guidance(result)
         assert len(guidance) >= 2
         # Empty fields should come first
         first_guidance = guidance[0].lower()
@@ -156,12 +157,9 @@ class TestClarifyingQuestionTriggers:
     """Tests that incomplete PICO states correctly identify when
     clarifying questions should be asked."""
 
-    def setup_method(self):
-        self.checker = CompletenessChecker()
-
-    def test_score_below_50_needs_clarification(self):
+    def test_score_below_50_needs_clarification(self, completeness_checker):
         """PICO below 50% should indicate clarification needed."""
-        result = self.checker.check_pico({
+        result = completeness_checker.check_pico({
             "patient": "patients with knee OA",
             "intervention": "",
             "comparison": "",
@@ -170,9 +168,9 @@ class TestClarifyingQuestionTriggers:
         assert result.score < 0.5
         assert not result.passed
 
-    def test_score_above_50_can_proceed(self):
+    def test_score_above_50_can_proceed(self, completeness_checker):
         """PICO at 50%+ should allow proceeding to ACQUIRE."""
-        result = self.checker.check_pico({
+        result = completeness_checker.check_pico({
             "patient": "adults with type 2 diabetes",
             "intervention": "GLP-1 agonists",
             "comparison": "",
@@ -181,9 +179,9 @@ class TestClarifyingQuestionTriggers:
         assert result.score >= 0.5
         assert result.passed
 
-    def test_biggest_gap_identification(self):
+    def test_biggest_gap_identification(self, completeness_checker):
         """Should identify which field has the biggest gap."""
-        result = self.checker.check_pico({
+        result = completeness_checker.check_pico({
             "patient": "elderly patients with stroke and hemiparesis",
             "intervention": "OT",  # too brief
             "comparison": "",  # empty
@@ -201,27 +199,23 @@ class TestClarifyingQuestionTriggers:
         assert len(empty_fields) >= 1
         assert any(fc.field_name == "comparison" for fc in empty_fields)
 
-    def test_all_four_quality_levels(self):
+    def test_all_four_quality_levels(self, completeness_checker):
         """Test that all four quality levels can be produced."""
-        result = self.checker.check_pico({
+        result = completeness_checker.check_pico({
             "patient": "68-year-old female retired school teacher with moderate left hemiparesis and neglect post stroke",  # GOOD (many words)
             "intervention": "occupational therapy interventions",  # ADEQUATE
             "comparison": "s",  # MINIMAL (1 char below threshold)
             "outcome": "",  # EMPTY
         })
-        field_map = {fc.field_name: fc for fc in result.field_checks}
-        assert field_map["patient"].quality == FieldQuality.GOOD
-        assert field_map["intervention"].quality in (FieldQuality.ADEQUATE, FieldQuality.GOOD)
-        assert field_map["outcome"].quality == FieldQuality.EMPTY
+        assert result.get_field("patient").quality == FieldQuality.GOOD
+        assert result.get_field("intervention").quality in (FieldQuality.ADEQUATE, FieldQuality.GOOD)
+        assert result.get_field("outcome").quality == FieldQuality.EMPTY
 
 
 class TestWorkflowCompleteness:
     """Tests for workflow-level completeness tracking across all 5 phases."""
 
-    def setup_method(self):
-        self.checker = CompletenessChecker()
-
-    def test_ask_only_workflow_is_incomplete(self):
+    def test_ask_only_workflow_is_incomplete(self, completeness_checker):
         """After only ASK phase, workflow should be incomplete."""
         state = {
             "pico": {
@@ -235,11 +229,11 @@ class TestWorkflowCompleteness:
             "applyPoints": [],
             "assessPoints": [],
         }
-        result = self.checker.check_workflow(state)
+        result = completeness_checker.check_workflow(state)
         # Only PICO filled, 4 sections empty
         assert result.score < 0.5
 
-    def test_progressive_workflow_scores_increase(self):
+    def test_progressive_workflow_scores_increase(self, completeness_checker):
         """Adding data to each phase should increase the score."""
         base_state = {
             "pico": {
@@ -253,25 +247,25 @@ class TestWorkflowCompleteness:
             "applyPoints": [],
             "assessPoints": [],
         }
-        score_after_ask = self.checker.check_workflow(base_state).score
+        score_after_ask = completeness_checker.check_workflow(base_state).score
 
         base_state["references"] = [{"id": "1", "title": "Study A"}, {"id": "2", "title": "Study B"}]
-        score_after_acquire = self.checker.check_workflow(base_state).score
+        score_after_acquire = completeness_checker.check_workflow(base_state).score
         assert score_after_acquire > score_after_ask
 
         base_state["appraisals"] = [{"title": "Design", "verdict": "Positive"}]
-        score_after_appraise = self.checker.check_workflow(base_state).score
+        score_after_appraise = completeness_checker.check_workflow(base_state).score
         assert score_after_appraise > score_after_acquire
 
         base_state["applyPoints"] = [{"action": "Start CIMT", "rationale": "Evidence supports"}]
-        score_after_apply = self.checker.check_workflow(base_state).score
+        score_after_apply = completeness_checker.check_workflow(base_state).score
         assert score_after_apply > score_after_appraise
 
         base_state["assessPoints"] = [{"metric": "FMA-UE", "target": ">50", "frequency": "Weekly"}]
-        score_after_assess = self.checker.check_workflow(base_state).score
+        score_after_assess = completeness_checker.check_workflow(base_state).score
         assert score_after_assess > score_after_apply
 
-    def test_workflow_identifies_missing_sections(self):
+    def test_workflow_identifies_missing_sections(self, completeness_checker):
         """Workflow check should name which sections are empty."""
         state = {
             "pico": {
@@ -285,34 +279,59 @@ class TestWorkflowCompleteness:
             "applyPoints": [],
             "assessPoints": [],
         }
-        result = self.checker.check_workflow(state)
-        issue_text = " ".join(result.issues)
+        result = completeness_checker.check_workflow(state)
+        issue_text = result.issues_text
         assert "appraisals" in issue_text
         assert "actions" in issue_text
         assert "outcomes" in issue_text
 
+    def test_quick_workflow_check_matches_full_verdict(self, completeness_checker):
+        """quick=True may stop early but must reach the same pass/fail verdict."""
+        pico = {
+            "patient": "adults with stroke and hemiparesis",
+            "intervention": "constraint-induced movement therapy",
+            "comparison": "standard OT care",
+            "outcome": "upper extremity function",
+        }
+        sections = ["references", "appraisals", "applyPoints", "assessPoints"]
+        for filled in range(len(sections) + 1):
+            state = {key: [{"id": "1"}] * 3 if i < filled else [] for i, key in enumerate(sections)}
+            for state_pico in (pico, {}):
+                state["pico"] = state_pico
+                full = completeness_checker.check_workflow(state)
+                quick = completeness_checker.check_workflow(state, quick=True)
+                assert quick.passed == full.passed
+
+    def test_quick_workflow_check_stops_once_decided(self, completeness_checker):
+        """An empty workflow can't reach 50% after two empty sections."""
+        state = {"pico": {}, "references": [], "appraisals": [], "applyPoints": [], "assessPoints": []}
+        result = completeness_checker.check_workflow(state, quick=True)
+        assert not result.passed
+        assert [fc.field_name for fc in result.field_checks] == ["pico", "references", "appraisals"]
+
 
 class TestEdgeCases:
     """Edge cases for completeness checking."""
 
-    def setup_method(self):
-        self.checker = CompletenessChecker()
-
-    def test_very_long_patient_description(self):
+    def test_very_long_patient_description(self, completeness_checker):
         """A very long patient description (>200 words) should be GOOD."""
-        long_desc = " ".join(["word"] * 250)
-        result = self.checker.check_pico({
-            "patient": long_desc,
+        result = completeness_checker.check_pico({
+            "patient": LONG_DESCRIPTION,
             "intervention": "some intervention therapy",
             "comparison": "standard care",
             "outcome": "improved outcomes measured",
         })
-        field_map = {fc.field_name: fc for fc in result.field_checks}
-        assert field_map["patient"].quality == FieldQuality.GOOD
+        assert result.get_field("patient").quality == FieldQuality.GOOD
 
-    def test_unicode_in_fields(self):
+    def test_long_single_token_still_minimal(self, completeness_checker):
+        """Capping the word count must not rate one huge token as GOOD."""
+        result = completeness_checker.check_pico({"patient": "x" * 2000})
+        assert result.field_checks[0].quality == FieldQuality.MINIMAL
+        assert "1 words" in result.field_checks[0].issue
+
+    def test_unicode_in_fields(self, completeness_checker):
         """Unicode characters should not break completeness checking."""
-        result = self.checker.check_pico({
+        result = completeness_checker.check_pico({
             "patient": "patients with caf\u00e9-au-lait spots and neurofibromatosis",
             "intervention": "surgical resection \u00b1 chemotherapy",
             "comparison": "observation \u2014 watchful waiting",
@@ -320,9 +339,9 @@ class TestEdgeCases:
         })
         assert result.score > 0
 
-    def test_whitespace_only_is_empty(self):
+    def test_whitespace_only_is_empty(self, completeness_checker):
         """Whitespace-only fields should be treated as empty."""
-        result = self.checker.check_pico({
+        result = completeness_checker.check_pico({
             "patient": "   \t\n  ",
             "intervention": "",
             "comparison": "  ",
@@ -330,9 +349,17 @@ class TestEdgeCases:
         })
         assert result.score == 0.0
 
-    def test_none_values_handled(self):
+    def test_empty_fields_skip_rating(self, completeness_checker):
+        """Empty fields are rated EMPTY without going through the field cache."""
+        before = _assess_text_field.cache_info()
+        result = completeness_checker.check_pico({"patient": "", "intervention": "  "})
+        after = _assess_text_field.cache_info()
+        assert (after.hits, after.misses) == (before.hits, before.misses)
+        assert result.issues == [f"{name}: empty" for name in PICO_MIN_WORDS]
+
+    def test_none_values_handled(self, completeness_checker):
         """None values should be treated as empty."""
-        result = self.checker.check_pico({
+        result = completeness_checker.check_pico({
             "patient": None,
             "intervention": None,
             "comparison": None,
@@ -340,9 +367,24 @@ class TestEdgeCases:
         })
         assert result.score == 0.0
 
-    def test_missing_keys_handled(self):
+    def test_repeated_pico_reuses_field_ratings(self, completeness_checker):
+        """Re-checking the same PICO hits the field cache but returns a fresh result."""
+        pico = {
+            "patient": "adults with type 2 diabetes",
+            "intervention": "GLP-1 agonists",
+            "comparison": "placebo",
+            "outcome": "HbA1c reduction",
+        }
+        first = completeness_checker.check_pico(pico)
+        hits = _assess_text_field.cache_info().hits
+        second = completeness_checker.check_pico(pico)
+        assert _assess_text_field.cache_info().hits == hits + 4
+        assert second == first
+        assert second is not first
+
+    def test_missing_keys_handled(self, completeness_checker):
         """Missing PICO keys should be treated as empty."""
-        result = self.checker.check_pico({"patient": "adults with diabetes"})
+        result = completeness_checker.check_pico({"patient": "adults with diabetes"})
         # Only patient filled
         assert result.score > 0.0
         assert result.score < 0.5
@@ -18,8 +18,10 @@ from eval.eval_runner import (
     extract_json,
     DEMO_CASES,
     MOCK_RESPONSES,
+    MOCK_RESPONSES_PARSED,
     EvalReport,
     CaseResult,
+    _json_default,
 )
 
 
@@ -82,6 +84,15 @@ That looks complete.'''
         clean, data = extract_json(text)
         assert data is None
 
+    @pytest.mark.parametrize("loads", ["json", "orjson"])
+    def test_invalid_json_with_each_parser(self, loads, monkeypatch):
+        from eval import eval_runner
+        module = pytest.importorskip(loads)
+        monkeypatch.setattr(eval_runner, "_json_loads", module.loads)
+        text = '```json\n{"type": "PICO_UPDATE",}\n```'
+        assert eval_runner._extract_json(text) == (text, None)
+        assert eval_runner._extract_json('```json\n{"a": 1}\n```') == ("", {"a": 1})
+
     def test_json_without_language_tag(self):
         text = '''```
 {
@@ -93,6 +104,31 @@ That looks complete.'''
         assert data is not None
         assert data["type"] == "PHASE_CHANGE"
 
+    def test_skips_non_json_fence(self):
+        text = 'Code:\n```python\nprint(1)\n```\nData:\n```JSON\n{"type": "PHASE_CHANGE"}\n```'
+        clean, data = extract_json(text)
+        assert data == {"type": "PHASE_CHANGE"}
+        assert clean == 'Code:\n```python\nprint(1)\n```\nData:'
+
+    def test_unclosed_fence_returns_none(self):
+        text = '```json\n{"type": "PHASE_CHANGE"}'
+        assert extract_json(text) == (text, None)
+
+    def test_repeated_text_is_extracted_once(self, monkeypatch):
+        from eval import eval_runner
+        calls = []
+        parse = eval_runner._extract_json
+        monkeypatch.setattr(eval_runner, "_extract_json", lambda text: calls.append(text) or parse(text))
+        text = '```json\n{"type": "PHASE_CHANGE", "cache": "once"}\n```'
+        assert extract_json(text) == extract_json(text)
+        assert calls == [text]
+
+    def test_cached_data_not_shared_between_callers(self):
+        text = MOCK_RESPONSES["ACQUIRE"]["default"]
+        _, data = extract_json(text)
+        data["type"] = "MUTATED"
+        assert extract_json(text)[1]["type"] != "MUTATED"
+
 
 # ============================================================================
 # Mock Response Tests
@@ -106,6 +142,12 @@ class TestMockResponses:
         for phase in ["ASK", "ACQUIRE", "APPRAISE", "APPLY", "ASSESS"]:
             assert phase in MOCK_RESPONSES, f"Missing mock response for {phase}"
 
+    def test_tables_are_read_only(self):
+        with pytest.raises(TypeError):
+            MOCK_RESPONSES["ASK"]["default"] = "changed"
+        with pytest.raises(TypeError):
+            DEMO_CASES[0]["expected_pico"]["patient"] = "changed"
+
     def test_ask_phase_has_case_specific_responses(self):
         """ASK phase should have responses for each demo case."""
         ask_responses = MOCK_RESPONSES["ASK"]
@@ -115,16 +157,15 @@ class TestMockResponses:
 
     def test_mock_responses_contain_json(self):
         """Mock responses should contain extractable JSON blocks."""
-        for phase, responses in MOCK_RESPONSES.items():
-            for key, text in responses.items():
-                _, data = extract_json(text)
+        for phase, parsed in MOCK_RESPONSES_PARSED.items():
+            assert parsed.keys() == MOCK_RESPONSES[phase].keys()
+            for key, data in parsed.items():
                 assert data is not None, \
                     f"Mock response for {phase}/{key} has no extractable JSON"
 
     def test_ask_responses_produce_pico_update(self):
         """ASK phase mock responses should produce PICO_UPDATE JSON."""
-        for case_id, text in MOCK_RESPONSES["ASK"].items():
-            _, data = extract_json(text)
+        for case_id, data in MOCK_RESPONSES_PARSED["ASK"].items():
             assert data is not None
             assert data.get("type") == "PICO_UPDATE", \
                 f"ASK response for {case_id} doesn't produce PICO_UPDATE"
@@ -133,22 +174,22 @@ class TestMockResponses:
             assert pico.get("intervention"), f"Missing intervention in {case_id}"
 
     def test_acquire_response_produces_references(self):
-        _, data = extract_json(MOCK_RESPONSES["ACQUIRE"]["default"])
+        data = MOCK_RESPONSES_PARSED["ACQUIRE"]["default"]
         assert data["type"] == "REFERENCE_UPDATE"
         assert len(data["data"]) >= 1
 
     def test_appraise_response_produces_appraisals(self):
-        _, data = extract_json(MOCK_RESPONSES["APPRAISE"]["default"])
+        data = MOCK_RESPONSES_PARSED["APPRAISE"]["default"]
         assert data["type"] == "APPRAISAL_UPDATE"
         assert len(data["data"]) >= 1
 
     def test_apply_response_produces_actions(self):
-        _, data = extract_json(MOCK_RESPONSES["APPLY"]["default"])
+        data = MOCK_RESPONSES_PARSED["APPLY"]["default"]
         assert data["type"] == "APPLY_UPDATE"
         assert len(data["data"]) >= 1
 
     def test_assess_response_produces_outcomes(self):
-        _, data = extract_json(MOCK_RESPONSES["ASSESS"]["default"])
+        data = MOCK_RESPONSES_PARSED["ASSESS"]["default"]
         assert data["type"] == "ASSESS_UPDATE"
         assert len(data["data"]) >= 1
 
@@ -243,12 +284,89 @@ class TestEvalRunner:
         result = self.runner.run_case(case)
         assert result.duration_seconds >= 0
 
+    @pytest.mark.parametrize("parallel", [True, False])
+    def test_run_all_keeps_case_order(self, parallel):
+        report = EvalRunner(mock=True, parallel=parallel).run_all()
+        assert [c.case_id for c in report.cases] == [c["id"] for c in DEMO_CASES]
+        assert report.overall_passed
+
     def test_report_summary(self):
         report = self.runner.run_all()
         summary = report.summary
         assert "PASS" in summary or "FAIL" in summary
         assert str(report.total_cases) in summary
 
+    def test_fail_fast_stops_after_safety_error(self, monkeypatch):
+        """A safety error ends the case early in mock mode."""
+        unsafe = "I am prescribing metformin.\n```json\n{\"type\": \"PICO_UPDATE\", \"data\": {}}\n```"
+        monkeypatch.setattr(self.runner, "_get_mock_response", lambda phase, case_id: unsafe)
+        result = self.runner.run_case(DEMO_CASES[0])
+        assert not result.passed
+        assert len(result.phase_results) == 1
+
+    def test_fail_fast_disabled_runs_all_phases(self, monkeypatch):
+        runner = EvalRunner(mock=True, fail_fast=False)
+        unsafe = "I am prescribing metformin."
+        monkeypatch.setattr(runner, "_get_mock_response", lambda phase, case_id: unsafe)
+        result = runner.run_case(DEMO_CASES[0])
+        assert not result.passed
+        assert len(result.phase_results) == 5
+
+    def test_report_serializes_to_json(self):
+        """The --json output path should handle nested dataclasses and enums."""
+        report = self.runner.run_all()
+        data = json.loads(json.dumps(report, default=_json_default))
+        assert data["total_cases"] == report.total_cases
+        field_check = data["cases"][0]["completeness_result"]["field_checks"][0]
+        assert field_check["quality"] == "good"
+
+
+class _BatchRecordingModel:
+    """Model stub that answers each batched phase with the mock responses."""
+
+    model_id = "stub-model"
+
+    def __init__(self):
+        self.batch_sizes = []
+        self.stop_when = None
+
+    def generate_batch(self, prompts, system_prompts, max_new_tokens=512, stop_when=None):
+        self.batch_sizes.append(len(prompts))
+        self.stop_when = stop_when
+        phase = system_prompts[0].split("Current Phase: ")[1].split("\n")[0]
+        responses = MOCK_RESPONSES[phase]
+        return [
+            responses.get(case["id"], responses.get("default"))
+            for case in DEMO_CASES[:len(prompts)]
+        ]
+
+
+class TestEvalRunnerModelMode:
+    """Tests for the EvalRunner with a (stub) real model."""
+
+    def test_phases_batched_across_cases(self):
+        model = _BatchRecordingModel()
+        report = EvalRunner(model=model, mock=False).run_all()
+        assert model.batch_sizes == [len(DEMO_CASES)] * len(EvalRunner.PHASES)
+        assert report.mode == "model"
+        assert report.model_id == "stub-model"
+        assert report.overall_passed
+        for case in report.cases:
+            assert len(case.phase_results) == len(EvalRunner.PHASES)
+
+    def test_model_stops_after_json_block(self):
+        """The runner hands the model a predicate that fires once JSON closes."""
+        model = _BatchRecordingModel()
+        EvalRunner(model=model, mock=False).run_all()
+        response = MOCK_RESPONSES["ACQUIRE"]["default"]
+        assert model.stop_when(response)
+        assert not model.stop_when(response[:response.rindex("```")])
+
+    def test_stop_after_json_can_be_disabled(self):
+        model = _BatchRecordingModel()
+        EvalRunner(model=model, mock=False, stop_after_json=False).run_all()
+        assert model.stop_when is None
+
 
 # ============================================================================
 # State Accumulation Tests
@@ -310,6 +428,12 @@ class TestStateAccumulation:
         assert state["pico"] == {}
         assert len(state["references"]) == 0
 
+    def test_mismatched_data_type_ignored(self):
+        state = self.runner._new_state()
+        self.runner._update_state(state, {"type": "PICO_UPDATE", "data": ["adults"]})
+        self.runner._update_state(state, {"type": "REFERENCE_UPDATE", "data": {"id": "1"}})
+        assert state == self.runner._new_state()
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
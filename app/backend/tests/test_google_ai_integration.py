@@ -17,29 +17,23 @@ from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+import json
 import os
 import pytest
-from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock, AsyncMock
 
+import medgemma_backend
+from medgemma_backend import GOOGLE_AI_MODEL_MAP
 
-# === Fixtures ===
 
-@pytest.fixture
-def client():
-    """Create a test client with Google AI mocked."""
-    from medgemma_backend import app
-    return TestClient(app)
-
-
-@pytest.fixture
-def mock_genai_client():
-    """Mock the genai_client global."""
-    mock_client = MagicMock()
-    mock_response = MagicMock()
-    mock_response.text = "This is a test response from Gemma."
-    mock_client.models.generate_content.return_value = mock_response
-    return mock_client
+# Request bodies posted by several tests, JSON-encoded once
+_JSON_HEADERS = {"content-type": "application/json"}
+_MEDGEMMA_15_BODY = json.dumps({
+    "model_id": "google/medgemma-1.5-4b-it", "message": "test", "history": [],
+}).encode()
+_MEDGEMMA_4B_BODY = json.dumps({
+    "model_id": "google/medgemma-4b-it", "message": "test", "history": [],
+}).encode()
 
 
 # === Health Endpoint ===
@@ -63,9 +57,7 @@ class TestHealthWithGoogleAI:
 
 class TestModelsWithGoogleAI:
 
-    @patch("medgemma_backend.genai_client")
-    def test_models_includes_cloud_models(self, mock_gc, client):
-        mock_gc.__bool__ = lambda self: True
+    def test_models_includes_cloud_models(self, client, truthy_genai_client):
         response = client.get("/models")
         assert response.status_code == 200
         data = response.json()
@@ -83,97 +75,180 @@ class TestModelsWithGoogleAI:
 class TestGenerateGoogleAI:
 
     @patch("medgemma_backend._is_local_model_available", return_value=False)
-    @patch("medgemma_backend.genai_client")
-    def test_generate_routes_to_google_ai(self, mock_gc, mock_local, client):
-        mock_response = MagicMock()
-        mock_response.text = "Test response from cloud model."
-        mock_gc.models.generate_content.return_value = mock_response
-        # Make genai_client truthy
-        mock_gc.__bool__ = lambda self: True
-
-        response = client.post("/generate", json={
-            "model_id": "google/medgemma-1.5-4b-it",
-            "message": "test medical question",
-            "history": [],
-        })
-        assert response.status_code == 200
-        data = response.json()
-        assert "text" in data
+    def test_generate_cloud_variants(self, mock_local, client, truthy_genai_client):
+        """Routing, system prompt, history and model mapping against one mock client."""
+        mock_gc = truthy_genai_client
+        mock_gc.aio.models.generate_content.return_value.text = "Test response from cloud model."
+
+        requests = [
+            {"model_id": "google/medgemma-1.5-4b-it", "message": "test medical question", "history": []},
+            {
+                "model_id": "medgemma-4b-it",
+                "message": "test",
+                "history": [],
+                "system_prompt": "You are a medical EBP copilot.",
+            },
+            {
+                "model_id": "medgemma-4b-it",
+                "message": "follow-up",
+                "history": [
+                    {"role": "user", "content": "first question"},
+                    {"role": "model", "content": "first answer"},
+                ],
+            },
+        ]
+        responses = [client.post("/generate", json=body) for body in requests]
+        assert [r.status_code for r in responses] == [200, 200, 200]
+        calls = mock_gc.aio.models.generate_content.call_args_list
+        assert len(calls) == 3
+
+        # Routed to Google AI, with the MedGemma id mapped to its cloud model
+        data = responses[0].json()
         assert data["text"] == "Test response from cloud model."
         assert "google-ai:" in data["model_used"]
+        assert calls[0].kwargs["model"] == "gemma-3-4b-it"
 
-    @patch("medgemma_backend._is_local_model_available", return_value=False)
-    @patch("medgemma_backend.genai_client")
-    def test_generate_passes_system_prompt(self, mock_gc, mock_local, client):
-        mock_response = MagicMock()
-        mock_response.text = "Response with system prompt."
-        mock_gc.models.generate_content.return_value = mock_response
-        mock_gc.__bool__ = lambda self: True
-
-        response = client.post("/generate", json={
-            "model_id": "medgemma-4b-it",
-            "message": "test",
-            "history": [],
-            "system_prompt": "You are a medical EBP copilot.",
-        })
-        assert response.status_code == 200
         # For Gemma models, system prompt is prepended to user message
-        call_kwargs = mock_gc.models.generate_content.call_args
-        contents = call_kwargs.kwargs.get("contents") or call_kwargs[1].get("contents")
-        user_text = contents[-1]["parts"][-1]["text"]
+        user_text = calls[1].kwargs["contents"][-1]["parts"][-1]["text"]
         assert "medical EBP copilot" in user_text
 
+        # History + new message = 3 items
+        assert len(calls[2].kwargs["contents"]) == 3
+
     @patch("medgemma_backend._is_local_model_available", return_value=False)
-    @patch("medgemma_backend.genai_client")
-    def test_generate_passes_history(self, mock_gc, mock_local, client):
-        mock_response = MagicMock()
-        mock_response.text = "Follow-up response."
-        mock_gc.models.generate_content.return_value = mock_response
-        mock_gc.__bool__ = lambda self: True
-
-        response = client.post("/generate", json={
-            "model_id": "medgemma-4b-it",
+    @patch("medgemma_backend.GEMINI_CACHE", new=True)
+    def test_gemini_history_served_from_context_cache(self, mock_local, client, truthy_genai_client):
+        mock_gc = truthy_genai_client
+        mock_cache = MagicMock()
+        mock_cache.name = "cachedContents/abc123"
+        mock_gc.aio.caches.create = AsyncMock(return_value=mock_cache)
+
+        body = {
+            "model_id": "gemini-2.5-flash",
             "message": "follow-up",
             "history": [
                 {"role": "user", "content": "first question"},
                 {"role": "model", "content": "first answer"},
             ],
-        })
-        assert response.status_code == 200
-        call_kwargs = mock_gc.models.generate_content.call_args
-        contents = call_kwargs.kwargs.get("contents") or call_kwargs[1].get("contents")
-        # History + new message = 3 items
-        assert len(contents) == 3
+            "system_prompt": "You are a medical EBP copilot.",
+        }
+        with patch.dict(medgemma_backend._gemini_context_caches, clear=True):
+            assert client.post("/generate", json=body).status_code == 200
+            assert client.post("/generate", json=body).status_code == 200
+
+        assert mock_gc.aio.caches.create.call_count == 1
+        call_kwargs = mock_gc.aio.models.generate_content.call_args.kwargs
+        assert len(call_kwargs["contents"]) == 1
+        assert call_kwargs["config"]["cached_content"] == "cachedContents/abc123"
+        assert "system_instruction" not in call_kwargs["config"]
 
     @patch("medgemma_backend._is_local_model_available", return_value=False)
-    @patch("medgemma_backend.genai_client")
-    def test_generate_maps_model_to_cloud(self, mock_gc, mock_local, client):
-        mock_response = MagicMock()
-        mock_response.text = "OK"
-        mock_gc.models.generate_content.return_value = mock_response
-        mock_gc.__bool__ = lambda self: True
-
-        response = client.post("/generate", json={
-            "model_id": "google/medgemma-1.5-4b-it",
-            "message": "test",
-            "history": [],
-        })
-        assert response.status_code == 200
-        call_kwargs = mock_gc.models.generate_content.call_args
-        model = call_kwargs.kwargs.get("model") or call_kwargs[1].get("model")
-        assert model == "gemma-3-4b-it"
+    @patch("medgemma_backend.GEMINI_CACHE", new=True)
+    def test_next_turn_reuses_cached_history_prefix(self, mock_local, client, truthy_genai_client):
+        mock_gc = truthy_genai_client
+        mock_cache = MagicMock()
+        mock_cache.name = "cachedContents/turn1"
+        mock_gc.aio.caches.create = AsyncMock(return_value=mock_cache)
+
+        history = [
+            {"role": "user", "content": "first question"},
+            {"role": "model", "content": "first answer"},
+        ]
+        turn = {
+            "model_id": "gemini-2.5-flash",
+            "message": "second question",
+            "history": history,
+            "system_prompt": "You are a medical EBP copilot.",
+        }
+        next_turn = {
+            **turn,
+            "message": "third question",
+            "history": history + [
+                {"role": "user", "content": "second question"},
+                {"role": "model", "content": "second answer"},
+            ],
+        }
+        with patch.dict(medgemma_backend._gemini_context_caches, clear=True):
+            assert client.post("/generate", json=turn).status_code == 200
+            assert client.post("/generate", json=next_turn).status_code == 200
+
+        assert mock_gc.aio.caches.create.call_count == 1
+        call_kwargs = mock_gc.aio.models.generate_content.call_args.kwargs
+        assert call_kwargs["config"]["cached_content"] == "cachedContents/turn1"
+        # The turn added since the cached prefix, then the new message
+        texts = [c["parts"][-1]["text"] for c in call_kwargs["contents"]]
+        assert texts == ["second question", "second answer", "third question"]
+
+    @patch("medgemma_backend._is_local_model_available", return_value=False)
+    @patch("medgemma_backend.GEMINI_CACHE", new=True)
+    def test_failed_cache_creation_not_retried_next_turn(self, mock_local, client, truthy_genai_client):
+        mock_gc = truthy_genai_client
+        mock_gc.aio.caches.create = AsyncMock(side_effect=RuntimeError("too few tokens to cache"))
+
+        history = [
+            {"role": "user", "content": "first question"},
+            {"role": "model", "content": "first answer"},
+        ]
+        turn = {
+            "model_id": "gemini-2.5-flash",
+            "message": "second question",
+            "history": history,
+            "system_prompt": "You are a medical EBP copilot.",
+        }
+        next_turn = {
+            **turn,
+            "message": "third question",
+            "history": history + [
+                {"role": "user", "content": "second question"},
+                {"role": "model", "content": "second answer"},
+            ],
+        }
+        with patch.dict(medgemma_backend._gemini_context_caches, clear=True):
+            assert client.post("/generate", json=turn).status_code == 200
+            assert client.post("/generate", json=next_turn).status_code == 200
+
+        assert mock_gc.aio.caches.create.call_count == 1
+        call_kwargs = mock_gc.aio.models.generate_content.call_args.kwargs
+        assert "cached_content" not in call_kwargs["config"]
+        assert len(call_kwargs["contents"]) == 5
 
     @patch("medgemma_backend._is_local_model_available", return_value=False)
     @patch("medgemma_backend.genai_client", new=None)
     def test_generate_fails_without_cloud_or_local(self, mock_local, client):
-        response = client.post("/generate", json={
-            "model_id": "google/medgemma-1.5-4b-it",
+        response = client.post("/generate", content=_MEDGEMMA_15_BODY, headers=_JSON_HEADERS)
+        assert response.status_code == 500
+        data = response.json()
+        assert "not available locally" in data["detail"]
+
+
+# === Streaming ===
+
+class TestGenerateStream:
+
+    @patch("medgemma_backend._is_local_model_available", return_value=False)
+    def test_stream_cloud_response_as_sse(self, mock_local, client, truthy_genai_client):
+        truthy_genai_client.aio.models.generate_content.return_value.text = "Streamed cloud answer."
+
+        response = client.post("/generate/stream", json={
+            "model_id": "medgemma-27b-text",
             "message": "test",
             "history": [],
         })
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [
+            json.loads(line[len("data: "):])
+            for line in response.text.splitlines() if line.startswith("data: ")
+        ]
+        assert events[0] == {"text": "Streamed cloud answer."}
+        assert events[-1]["done"] is True
+        assert events[-1]["model_used"].startswith("google-ai:")
+
+    @patch("medgemma_backend._is_local_model_available", return_value=False)
+    @patch("medgemma_backend.genai_client", new=None)
+    def test_stream_without_backend_returns_error(self, mock_local, client):
+        response = client.post("/generate/stream", content=_MEDGEMMA_15_BODY, headers=_JSON_HEADERS)
         assert response.status_code == 500
-        data = response.json()
-        assert "not available locally" in data["detail"]
 
 
 # === Generate via Local Model ===
@@ -182,28 +257,12 @@ class TestGenerateLocal:
 
     @patch("medgemma_backend._is_local_model_available", return_value=True)
     @patch("medgemma_backend.get_model_and_processor")
-    def test_generate_prefers_local_model(self, mock_get_model, mock_local, client):
-        import torch
-
-        mock_model = MagicMock()
-        mock_model.device = "cpu"
-
-        # MedGemma uses apply_chat_template with tokenize=True, return_dict=True
-        mock_processor = MagicMock(spec=["apply_chat_template", "__call__", "decode"])
-        mock_input_ids = torch.tensor([[1, 2, 3, 4, 5]])
-        mock_processor.apply_chat_template = MagicMock(return_value={"input_ids": mock_input_ids})
-
-        mock_output = torch.tensor([[1, 2, 3, 4, 5, 6, 7, 8]])
-        mock_model.generate = MagicMock(return_value=[mock_output])
-        mock_processor.decode = MagicMock(return_value="Local model response.")
-
-        mock_get_model.return_value = (mock_model, mock_processor)
+    def test_generate_prefers_local_model(
+        self, mock_get_model, mock_local, client, local_model_and_processor
+    ):
+        mock_get_model.return_value = local_model_and_processor
 
-        response = client.post("/generate", json={
-            "model_id": "google/medgemma-4b-it",
-            "message": "test",
-            "history": [],
-        })
+        response = client.post("/generate", content=_MEDGEMMA_4B_BODY, headers=_JSON_HEADERS)
         assert response.status_code == 200
         data = response.json()
         assert data["model_used"] == "local:google/medgemma-4b-it"
@@ -211,21 +270,13 @@ class TestGenerateLocal:
 
     @patch("medgemma_backend._is_local_model_available", return_value=True)
     @patch("medgemma_backend.get_model_and_processor")
-    @patch("medgemma_backend.genai_client")
     def test_generate_falls_back_to_cloud_on_local_error(
-        self, mock_gc, mock_get_model, mock_local, client
+        self, mock_get_model, mock_local, client, truthy_genai_client
     ):
         mock_get_model.side_effect = RuntimeError("Model load failed")
-        mock_response = MagicMock()
-        mock_response.text = "Cloud fallback response."
-        mock_gc.models.generate_content.return_value = mock_response
-        mock_gc.__bool__ = lambda self: True
+        truthy_genai_client.aio.models.generate_content.return_value.text = "Cloud fallback response."
 
-        response = client.post("/generate", json={
-            "model_id": "google/medgemma-4b-it",
-            "message": "test",
-            "history": [],
-        })
+        response = client.post("/generate", content=_MEDGEMMA_4B_BODY, headers=_JSON_HEADERS)
         assert response.status_code == 200
         data = response.json()
         assert data["text"] == "Cloud fallback response."
@@ -233,15 +284,14 @@ class TestGenerateLocal:
 
 class TestModelMapping:
 
-    def test_medgemma_maps_to_gemma(self):
-        from medgemma_backend import GOOGLE_AI_MODEL_MAP
-        assert GOOGLE_AI_MODEL_MAP["google/medgemma-1.5-4b-it"] == "gemma-3-4b-it"
-        assert GOOGLE_AI_MODEL_MAP["google/medgemma-4b-it"] == "gemma-3-4b-it"
-        assert GOOGLE_AI_MODEL_MAP["google/medgemma-27b-it"] == "gemma-3-27b-it"
-
-    def test_gemini_maps_correctly(self):
-        from medgemma_backend import GOOGLE_AI_MODEL_MAP
-        assert GOOGLE_AI_MODEL_MAP["gemini-2.5-flash"] == "gemini-2.5-flash"
+    @pytest.mark.parametrize("alias,expected", [
+        ("google/medgemma-1.5-4b-it", "gemma-3-4b-it"),
+        ("google/medgemma-4b-it", "gemma-3-4b-it"),
+        ("google/medgemma-27b-it", "gemma-3-27b-it"),
+        ("gemini-2.5-flash", "gemini-2.5-flash"),
+    ])
+    def test_model_maps_to_cloud_id(self, alias, expected):
+        assert GOOGLE_AI_MODEL_MAP[alias] == expected
 
 
 if __name__ == "__main__":
@@ -1,16 +1,22 @@
 """Tests for local MedGemma model routing and inference."""
+import fnmatch
 import pytest
 import torch
 from unittest.mock import patch, MagicMock
 
+import medgemma_backend
+from medgemma_backend import CLOUD_ONLY_MODELS, LOCAL_PREFERRED_MODELS, _is_local_model_available
+
+# Token ids returned by the fake tokenizer and appended by the fake generate
+_PROMPT_IDS = torch.tensor([[7, 7, 7]])
+_REPLY_IDS = torch.tensor([[5, 0]])
+
 
 class TestLocalModelDetection:
     """Test that local model availability is detected correctly."""
 
     @patch("medgemma_backend.resolve_model_id", return_value="google/medgemma-4b-it")
     def test_medgemma_4b_detected_via_hf_cache(self, mock_resolve):
-        from medgemma_backend import _is_local_model_available
-
         with patch("medgemma_backend.Path") as mock_path:
             mock_path.return_value.exists.return_value = False
             with patch(
@@ -21,8 +27,6 @@ class TestLocalModelDetection:
 
     @patch("medgemma_backend.resolve_model_id", return_value="google/medgemma-4b-it")
     def test_non_local_model_returns_false(self, mock_resolve):
-        from medgemma_backend import _is_local_model_available
-
         with patch("medgemma_backend.Path") as mock_path:
             mock_path.return_value.exists.return_value = False
             with patch(
@@ -31,28 +35,60 @@ class TestLocalModelDetection:
                 assert _is_local_model_available("google/medgemma-4b-it") is False
 
 
+class TestModelCache:
+    """Test that aliases share one loaded model and cache hits skip resolution."""
+
+    @patch("medgemma_backend.ensure_transformers")
+    @patch("medgemma_backend.resolve_model_id", return_value="google/medgemma-1.5-4b-it")
+    def test_aliases_share_loaded_model(self, mock_resolve, mock_ensure):
+        model, processor = object(), object()
+        with patch.dict(medgemma_backend._loaded_models, {"google/medgemma-4b-it": model}), \
+                patch.dict(medgemma_backend._loaded_processors, {"google/medgemma-4b-it": processor}), \
+                patch.dict(medgemma_backend._resolved_model_ids, clear=True):
+            assert medgemma_backend.get_model_and_processor("medgemma-4b-it") == (model, processor)
+            assert medgemma_backend.get_model_and_processor("medgemma-4b-it") == (model, processor)
+
+        assert mock_resolve.call_count == 1
+
+
+class TestLocalCheckpoint:
+    """Test fetching checkpoint weights, preferring safetensors over .bin."""
+
+    def _snapshot(self, tmp_path, repo_files):
+        """Fake snapshot_download of a repo holding `repo_files`."""
+        def download(model_id, allow_patterns):
+            for name in repo_files:
+                if any(fnmatch.fnmatch(name, pattern) for pattern in allow_patterns):
+                    (tmp_path / name).touch()
+            return str(tmp_path)
+        return download
+
+    def test_safetensors_fetched_alone(self, tmp_path):
+        with patch("huggingface_hub.snapshot_download", side_effect=self._snapshot(tmp_path, ["model.safetensors", "pytorch_model.bin"])) as dl:
+            assert medgemma_backend._local_checkpoint("org/model") == str(tmp_path)
+        dl.assert_called_once_with("org/model", allow_patterns=medgemma_backend.CHECKPOINT_ALLOW_PATTERNS)
+        assert not (tmp_path / "pytorch_model.bin").exists()
+
+    def test_bin_only_repo_falls_back(self, tmp_path):
+        with patch("huggingface_hub.snapshot_download", side_effect=self._snapshot(tmp_path, ["pytorch_model.bin"])) as dl:
+            assert medgemma_backend._local_checkpoint("org/model") == str(tmp_path)
+        assert dl.call_args.kwargs["allow_patterns"] == medgemma_backend.BIN_CHECKPOINT_ALLOW_PATTERNS
+        assert (tmp_path / "pytorch_model.bin").exists()
+
+
 class TestSmartRouting:
     """Test that models route to local GPU vs cloud API correctly."""
 
-    def test_cloud_only_models_skip_local(self):
-        from medgemma_backend import CLOUD_ONLY_MODELS
-        assert "medgemma-27b-text" in CLOUD_ONLY_MODELS
-        assert "medgemma-27b-mm" in CLOUD_ONLY_MODELS
-        assert "gemini-flash" in CLOUD_ONLY_MODELS
+    @pytest.mark.parametrize("model_id", ["medgemma-27b-text", "medgemma-27b-mm", "gemini-flash"])
+    def test_cloud_only_models_skip_local(self, model_id):
+        assert model_id in CLOUD_ONLY_MODELS
 
-    def test_local_preferred_models(self):
-        from medgemma_backend import LOCAL_PREFERRED_MODELS
-        assert "google/medgemma-4b-it" in LOCAL_PREFERRED_MODELS
-        assert "medgemma-4b-it" in LOCAL_PREFERRED_MODELS
+    @pytest.mark.parametrize("model_id", ["google/medgemma-4b-it", "medgemma-4b-it"])
+    def test_local_preferred_models(self, model_id):
+        assert model_id in LOCAL_PREFERRED_MODELS
 
     @patch("medgemma_backend._is_local_model_available", return_value=False)
-    @patch("medgemma_backend.genai_client")
-    def test_27b_routes_to_cloud(self, mock_gc, mock_local, client):
-        mock_response = MagicMock()
-        mock_response.text = "Cloud 27B response."
-        mock_gc.models.generate_content.return_value = mock_response
-        mock_gc.__bool__ = lambda self: True
-
+    def test_27b_routes_to_cloud(self, mock_local, client, truthy_genai_client):
         response = client.post("/generate", json={
             "model_id": "medgemma-27b-text",
             "message": "test",
@@ -64,18 +100,8 @@ class TestSmartRouting:
 
     @patch("medgemma_backend._is_local_model_available", return_value=True)
     @patch("medgemma_backend.get_model_and_processor")
-    def test_4b_routes_to_local(self, mock_get_model, mock_local, client):
-        mock_model = MagicMock()
-        mock_model.device = "cpu"
-
-        mock_processor = MagicMock(spec=["apply_chat_template", "decode"])
-        mock_input_ids = torch.tensor([[1, 2, 3, 4, 5]])
-        mock_processor.apply_chat_template = MagicMock(
-            return_value={"input_ids": mock_input_ids}
-        )
-        mock_output = torch.tensor([[1, 2, 3, 4, 5, 6, 7, 8]])
-        mock_model.generate = MagicMock(return_value=[mock_output])
-        mock_processor.decode = MagicMock(return_value="Local 4B response.")
+    def test_4b_routes_to_local(self, mock_get_model, mock_local, client, local_model_and_processor):
+        mock_model, mock_processor = local_model_and_processor
         mock_get_model.return_value = (mock_model, mock_processor)
 
         response = client.post("/generate", json={
@@ -93,18 +119,8 @@ class TestMedGemmaMessageFormat:
 
     @patch("medgemma_backend._is_local_model_available", return_value=True)
     @patch("medgemma_backend.get_model_and_processor")
-    def test_medgemma_uses_structured_content(self, mock_get_model, mock_local, client):
-        mock_model = MagicMock()
-        mock_model.device = "cpu"
-
-        mock_processor = MagicMock(spec=["apply_chat_template", "decode"])
-        mock_input_ids = torch.tensor([[1, 2, 3]])
-        mock_processor.apply_chat_template = MagicMock(
-            return_value={"input_ids": mock_input_ids}
-        )
-        mock_output = torch.tensor([[1, 2, 3, 4, 5]])
-        mock_model.generate = MagicMock(return_value=[mock_output])
-        mock_processor.decode = MagicMock(return_value="Response.")
+    def test_medgemma_uses_structured_content(self, mock_get_model, mock_local, client, local_model_and_processor):
+        mock_model, mock_processor = local_model_and_processor
         mock_get_model.return_value = (mock_model, mock_processor)
 
         response = client.post("/generate", json={
@@ -135,19 +151,9 @@ class TestMedGemmaMessageFormat:
 
     @patch("medgemma_backend._is_local_model_available", return_value=True)
     @patch("medgemma_backend.get_model_and_processor")
-    def test_medgemma_apply_chat_template_kwargs(self, mock_get_model, mock_local, client):
+    def test_medgemma_apply_chat_template_kwargs(self, mock_get_model, mock_local, client, local_model_and_processor):
         """Ensure tokenize=True and return_dict=True are passed."""
-        mock_model = MagicMock()
-        mock_model.device = "cpu"
-
-        mock_processor = MagicMock(spec=["apply_chat_template", "decode"])
-        mock_input_ids = torch.tensor([[1, 2, 3]])
-        mock_processor.apply_chat_template = MagicMock(
-            return_value={"input_ids": mock_input_ids}
-        )
-        mock_output = torch.tensor([[1, 2, 3, 4]])
-        mock_model.generate = MagicMock(return_value=[mock_output])
-        mock_processor.decode = MagicMock(return_value="Ok.")
+        mock_model, mock_processor = local_model_and_processor
         mock_get_model.return_value = (mock_model, mock_processor)
 
         client.post("/generate", json={
@@ -162,6 +168,366 @@ class TestMedGemmaMessageFormat:
         assert call_kwargs["return_tensors"] == "pt"
         assert call_kwargs["add_generation_prompt"] is True
 
+    @patch("medgemma_backend._is_local_model_available", return_value=True)
+    @patch("medgemma_backend.get_model_and_processor")
+    def test_repeated_conversation_renders_template_once(self, mock_get_model, mock_local, client, local_model_and_processor):
+        mock_model, mock_processor = local_model_and_processor
+        mock_get_model.return_value = (mock_model, mock_processor)
+
+        body = {"model_id": "medgemma-4b-it", "message": "same question", "history": []}
+        client.post("/generate", json=body)
+        client.post("/generate", json=body)
+        client.post("/generate", json={**body, "message": "different question"})
+
+        assert mock_processor.apply_chat_template.call_count == 2
+        assert mock_model.generate.call_count == 3
+
+
+class TestConversationKVCache:
+    """Test that EBP conversation turns continue from the previous turn's KV cache."""
+
+    def _model(self):
+        from types import SimpleNamespace
+        from medgemma_real import MedGemmaModel
+
+        model = MedGemmaModel.__new__(MedGemmaModel)
+        model.processor = None
+        model.tokenizer = MagicMock(
+            side_effect=lambda text, **kw: {"input_ids": _PROMPT_IDS}
+        )
+        model.tokenizer.eos_token_id = 0
+        model.tokenizer.chat_template = None
+        model.tokenizer.decode = MagicMock(return_value="Reply.")
+        model.pad_token_id = 0
+        model.stop_token_ids = {0}
+        model.model = MagicMock(return_value=SimpleNamespace(past_key_values="prefix-cache"))
+        model.model.device = "cpu"
+        model.model.generate = MagicMock(side_effect=lambda input_ids, past_key_values, **kw: SimpleNamespace(
+            sequences=torch.cat([input_ids, _REPLY_IDS], dim=-1),
+            past_key_values=f"cache-{input_ids.shape[-1]}",
+        ))
+        return model
+
+    def setup_method(self):
+        from medgemma_real import _prefill_system_prefix
+        _prefill_system_prefix.cache_clear()
+
+    def test_follow_up_turn_extends_cached_tokens(self):
+        from test_medgemma_local import EBPConversation
+
+        model = self._model()
+        conv = EBPConversation(model)
+        assert conv.send_message("first") == "Reply."
+        conv.send_message("second")
+
+        first, second = model.model.generate.call_args_list
+        # System prefix + patient context and user turn
+        assert first.kwargs["past_key_values"] == "prefix-cache"
+        assert second.kwargs["past_key_values"] == "cache-6"
+        # Previous prompt + reply (trailing EOS dropped) + new turn
+        assert second.kwargs["input_ids"].tolist() == [[7] * 6 + [5] + [7] * 3]
+
+    def _streaming(self, model):
+        def generate_stream(prompt, system_prompt="", **kw):
+            yield "Rep"
+            yield "ly."
+            return "Reply.", "streamed-cache", torch.tensor([[1, 2]])
+        model.generate_stream = generate_stream
+        return model
+
+    def test_streamed_turn_keeps_cache(self):
+        from test_medgemma_local import EBPConversation
+
+        conv = EBPConversation(self._streaming(self._model()))
+        assert list(conv.stream_message("first")) == ["Rep", "ly."]
+        assert conv.past_key_values == "streamed-cache"
+        assert conv.state.history[-1] == {"role": "assistant", "content": "Reply."}
+
+    def test_interrupted_stream_drops_cache(self):
+        from test_medgemma_local import EBPConversation
+
+        conv = EBPConversation(self._streaming(self._model()))
+        conv.send_message("first")
+        stream = conv.stream_message("second")
+        next(stream)
+        stream.close()
+
+        assert conv.past_key_values is None
+        assert len(conv.state.history) == 2
+
+    def test_chat_template_renders_turns(self):
+        from test_medgemma_local import EBPConversation
+
+        class TemplateTokenizer:
+            chat_template = "{{ messages }}"
+            eos_token_id = 0
+
+            def __init__(self):
+                self.texts = []
+
+            def apply_chat_template(self, messages, tokenize, add_generation_prompt):
+                text = "<bos>" + "".join(f"<{m['role']}>{m['content']}<end>" for m in messages)
+                return text + "<model>" if add_generation_prompt else text
+
+            def __call__(self, text, add_special_tokens=True, return_tensors=None):
+                self.texts.append((text, add_special_tokens))
+                return {"input_ids": _PROMPT_IDS}
+
+            def decode(self, ids, skip_special_tokens=True):
+                return "Reply."
+
+        model = self._model()
+        model.tokenizer = TemplateTokenizer()
+        conv = EBPConversation(model)
+        conv.send_message("first")
+        conv.send_message("second")
+
+        (prefix, prefix_special), (rest, _), (followup, _) = model.tokenizer.texts
+        assert prefix.startswith("<bos><system>") and prefix.endswith("clinically relevant.")
+        assert prefix_special is False
+        assert rest.startswith("\nPatient Context:") and rest.endswith("<user>first<end><model>")
+        assert followup == "<end><user>second<end><model>"
+
+    def test_history_keeps_recent_turns(self):
+        from test_medgemma_local import EBPConversation, HISTORY_TURNS
+
+        conv = EBPConversation(self._model())
+        for i in range(HISTORY_TURNS + 5):
+            conv.record_exchange(f"q{i}", f"a{i}")
+
+        assert len(conv.state.history) == 2 * HISTORY_TURNS
+        assert conv.state.history[0] == {"role": "user", "content": "q5"}
+
+    def test_structured_phases_decode_greedily(self):
+        from test_medgemma_local import EBPConversation
+
+        model = self._model()
+        conv = EBPConversation(model)
+        conv.send_message("case")
+        conv.advance_phase()
+        conv.send_message("find evidence")
+
+        ask, acquire = model.model.generate.call_args_list
+        assert ask.kwargs["do_sample"] is True
+        assert ask.kwargs["max_new_tokens"] == 256
+        assert acquire.kwargs["do_sample"] is False
+        assert "temperature" not in acquire.kwargs
+        assert acquire.kwargs["max_new_tokens"] == 384
+
+    def test_follow_up_turn_encodes_only_new_text(self):
+        from test_medgemma_local import EBPConversation
+
+        model = self._model()
+        conv = EBPConversation(model)
+        conv.send_message("first")
+        model.tokenizer.reset_mock()
+        conv.send_message("second")
+
+        texts = [call.args[0] for call in model.tokenizer.call_args_list]
+        assert texts == ["\n\nUser: second\nAssistant:"]
+
+    def test_stateless_generate_decodes_only_new_tokens(self):
+        model = self._model()
+        model.model.generate = MagicMock(return_value=torch.tensor([[7, 7, 7, 5, 6]]))
+
+        assert model.generate("question", "system") == "Reply."
+        assert model.tokenizer.decode.call_args.args[0].tolist() == [5, 6]
+
+    def test_phase_change_restarts_from_system_prefix(self):
+        from test_medgemma_local import EBPConversation
+
+        model = self._model()
+        conv = EBPConversation(model)
+        conv.send_message("first")
+        conv.advance_phase()
+        conv.send_message("second")
+
+        assert model.model.generate.call_args.kwargs["past_key_values"] == "prefix-cache"
+        assert model.model.call_count == 2
+
+    def test_system_prefix_prefilled_once_per_role_and_phase(self):
+        from test_medgemma_local import EBPConversation
+
+        model = self._model()
+        for context in ("65yo with back pain", "40yo with migraine"):
+            conv = EBPConversation(model)
+            conv.set_patient_context(context)
+            conv.send_message("question")
+
+        assert model.model.call_count == 1
+        assert model.model.generate.call_count == 2
+
+
+class _BatchTokenizer:
+    """Fake tokenizer recording each batch call along with its padding settings."""
+
+    chat_template = None
+    eos_token = "<eos>"
+    pad_token_id = 0
+
+    def __init__(self):
+        self.padding_side = "right"
+        self.pad_token = None
+        self.calls = []
+
+    def __call__(self, texts, **kwargs):
+        self.calls.append((texts, kwargs, self.padding_side, self.pad_token))
+        return {
+            "input_ids": _PROMPT_IDS.repeat(len(texts), 1),
+            "attention_mask": torch.ones(len(texts), 3, dtype=torch.long),
+        }
+
+    def batch_decode(self, ids, **kwargs):
+        return [f"r{len(ids)}"] * len(ids)
+
+
+class TestGenerateBatch:
+    """Test batched first turns on the real model wrapper, with a fake tokenizer."""
+
+    def _model(self):
+        from medgemma_real import MedGemmaModel
+
+        model = MedGemmaModel.__new__(MedGemmaModel)
+        model.processor = None
+        model.tokenizer = _BatchTokenizer()
+        model.model = MagicMock()
+        model.model.device = "cpu"
+        model.model.generate = MagicMock(side_effect=lambda input_ids, **kw: torch.cat(
+            [input_ids, _REPLY_IDS.repeat(input_ids.shape[0], 1)], dim=-1
+        ))
+        return model
+
+    def test_prompts_batched_by_phase_settings(self):
+        from test_medgemma_local import PHASE_GEN_KWARGS, Phase
+
+        model = self._model()
+        phases = [Phase.ASK, Phase.ACQUIRE, Phase.ASK]
+        texts = model.generate_batch(
+            ["q1", "q2", "q3"], ["s1", "s2", "s3"],
+            gen_kwargs=[PHASE_GEN_KWARGS[phase] for phase in phases],
+        )
+
+        sampled, greedy = (c.kwargs for c in model.model.generate.call_args_list)
+        assert sampled["input_ids"].shape[0] == 2
+        assert sampled["do_sample"] is True and sampled["max_new_tokens"] == 256
+        assert greedy["input_ids"].shape[0] == 1
+        assert greedy["do_sample"] is False and "temperature" not in greedy
+        # Results come back in prompt order
+        assert texts == ["r2", "r1", "r2"]
+
+    def test_padding_set_on_private_tokenizer_copy(self):
+        model = self._model()
+        model.generate_batch(["q1", "q2"], ["s", "s"])
+
+        model.model.generate.assert_called_once()
+        [(texts, kwargs, padding_side, pad_token)] = model._batch_tokenizer.calls
+        assert texts == ["s\n\nUser: q1\nAssistant:", "s\n\nUser: q2\nAssistant:"]
+        assert padding_side == "left" and pad_token == "<eos>"
+        assert "padding_side" not in kwargs
+        # The shared, cached tokenizer is left untouched
+        assert model.tokenizer.calls == []
+        assert model.tokenizer.padding_side == "right" and model.tokenizer.pad_token is None
+
+
+class TestAutomatedTest:
+    """Test the scripted run through all EBP phases."""
+
+    def test_phases_generated_in_one_batch(self, capsys):
+        from test_medgemma_local import MockMedGemmaModel, PHASE_GEN_KWARGS, Phase, run_automated_test
+
+        model = MockMedGemmaModel()
+        with patch.object(model, "generate_batch", wraps=model.generate_batch) as batch, \
+                patch.object(model, "generate_turn") as turn, \
+                patch("test_medgemma_local._phase_from_system_prompt") as parse:
+            conv = run_automated_test(model)
+
+        batch.assert_called_once()
+        turn.assert_not_called()
+        # Each prompt's phase is passed explicitly, not read back from its system prompt
+        parse.assert_not_called()
+        assert batch.call_args.kwargs["phases"] == list(Phase)
+        assert batch.call_args.kwargs["gen_kwargs"] == list(PHASE_GEN_KWARGS.values())
+        assert len(conv.state.history) == 10
+        assert "Outcome assessment plan" in conv.state.history[-1]["content"]
+
+
+class TestMockModel:
+    """Test the canned per-phase responses of the mock model."""
+
+    def test_phase_read_from_system_prompt(self):
+        from test_medgemma_local import (
+            MOCK_PHASE_RESPONSES, MockMedGemmaModel, Phase, Role, get_system_prompt,
+        )
+
+        model = MockMedGemmaModel()
+        for phase in Phase:
+            response = model.generate("q", get_system_prompt(Role.NURSE, phase, ""))
+            assert response is MOCK_PHASE_RESPONSES[phase]
+
+    def test_explicit_phase_and_default(self):
+        from test_medgemma_local import MOCK_ASK_RESPONSE, MOCK_ASSESS_RESPONSE, MockMedGemmaModel, Phase
+
+        model = MockMedGemmaModel()
+        assert model.generate("q", "", phase=Phase.ASSESS) is MOCK_ASSESS_RESPONSE
+        assert model.generate("q", "Current Phase: UNKNOWN") is MOCK_ASK_RESPONSE
+
+    def test_conversation_passes_phase_from_state(self):
+        from test_medgemma_local import (
+            MOCK_PHASE_RESPONSES, EBPConversation, MockMedGemmaModel, Phase,
+        )
+
+        conv = EBPConversation(MockMedGemmaModel())
+        conv.advance_phase()
+        with patch("test_medgemma_local._phase_from_system_prompt") as parse:
+            assert conv.send_message("find evidence") is MOCK_PHASE_RESPONSES[Phase.ACQUIRE]
+            conv.advance_phase()
+            list(conv.stream_message("appraise"))
+        parse.assert_not_called()
+        assert conv.state.history[-1]["content"] == MOCK_PHASE_RESPONSES[Phase.APPRAISE]
+
+
+class TestMedGemmaFactory:
+    """Test that the local test script loads each model once per process."""
+
+    @patch("medgemma_real.MedGemmaModel")
+    def test_repeated_requests_share_instance(self, mock_cls):
+        import test_medgemma_local
+
+        with patch.dict(test_medgemma_local._medgemma_models, clear=True):
+            first = test_medgemma_local.get_medgemma("google/medgemma-4b-it", "cpu")
+            assert test_medgemma_local.get_medgemma("google/medgemma-4b-it", "cpu") is first
+        assert mock_cls.call_count == 1
+
+    @patch("medgemma_real.release_model_memory")
+    @patch("medgemma_real.MedGemmaModel", side_effect=lambda model_id, **kw: model_id)
+    def test_least_recently_used_model_is_evicted(self, mock_cls, mock_release):
+        import test_medgemma_local
+
+        with patch.dict(test_medgemma_local._medgemma_models, clear=True), \
+                patch.object(test_medgemma_local, "_MEDGEMMA_CACHE_SIZE", 2):
+            test_medgemma_local.get_medgemma("a")
+            test_medgemma_local.get_medgemma("b")
+            test_medgemma_local.get_medgemma("a")
+            test_medgemma_local.get_medgemma("c")
+            assert list(test_medgemma_local._medgemma_models) == [("a", "auto", True, "none"), ("c", "auto", True, "none")]
+        mock_release.assert_called_once()
+
+    def test_mock_path_does_not_import_torch(self):
+        import subprocess
+        import sys
+        from pathlib import Path
+
+        script = (
+            "import sys, test_medgemma_local\n"
+            "test_medgemma_local.run_automated_test(test_medgemma_local.MockMedGemmaModel())\n"
+            "sys.exit('torch' in sys.modules or 'transformers' in sys.modules)"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=Path(__file__).parent.parent, capture_output=True,
+        )
+        assert result.returncode == 0
+
 
 class TestModelResolverUpdates:
     """Test updated model resolver aliases."""
@@ -174,9 +540,45 @@ class TestModelResolverUpdates:
         from model_resolver import HF_TO_ENV_OVERRIDES
         assert "google/medgemma-4b-it" in HF_TO_ENV_OVERRIDES
 
-
-@pytest.fixture
-def client():
-    from medgemma_backend import app
-    from fastapi.testclient import TestClient
-    return TestClient(app)
+    def test_env_override_requires_refresh(self, monkeypatch):
+        import model_resolver
+
+        monkeypatch.setenv("MEDGEMMA_4B_MODEL_ID", "/models/medgemma-4b")
+        try:
+            model_resolver.refresh_model_resolution()
+            assert model_resolver.resolve_model_id("medgemma-4b-it") == "/models/medgemma-4b"
+            monkeypatch.delenv("MEDGEMMA_4B_MODEL_ID")
+            # Memoized until the environment is re-read
+            assert model_resolver.resolve_model_id("medgemma-4b-it") == "/models/medgemma-4b"
+        finally:
+            model_resolver.refresh_model_resolution()
+        assert model_resolver.resolve_model_id("medgemma-4b-it") != "/models/medgemma-4b"
+
+    def test_model_mounted_after_miss_is_found(self, tmp_path):
+        import model_resolver
+
+        with patch.object(model_resolver, "KAGGLE_INPUT", tmp_path), \
+                patch.object(model_resolver, "_kaggle_manifest", None):
+            assert model_resolver.resolve_model_id("medgemma-27b-text") == "google/medgemma-27b-it"
+
+            model_dir = tmp_path / "medgemma-27b-text/1"
+            model_dir.mkdir(parents=True)
+            (model_dir / "config.json").write_text("{}")
+            # The miss is not memoized; the next manifest refresh picks it up
+            model_resolver.kaggle_model_dirs(refresh=True)
+            assert model_resolver.resolve_model_id("medgemma-27b-text") == str(model_dir)
+
+    def test_kaggle_manifest_is_walked_once(self, tmp_path):
+        import model_resolver
+
+        for name in ("medgemma-4b-it/transformers/default/1", "medgemma-27b-text/1"):
+            model_dir = tmp_path / name
+            model_dir.mkdir(parents=True)
+            (model_dir / "config.json").write_text("{}")
+
+        with patch.object(model_resolver, "KAGGLE_INPUT", tmp_path), \
+                patch.object(model_resolver, "_kaggle_manifest", None), \
+                patch.object(model_resolver, "_walk_model_dirs", wraps=model_resolver._walk_model_dirs) as walk:
+            assert model_resolver._scan_kaggle_input("google/medgemma-4b-it").endswith("default/1")
+            assert model_resolver._scan_kaggle_input("google/medgemma-27b-it").endswith("medgemma-27b-text/1")
+            assert walk.call_count == 1
@@ -20,14 +20,19 @@ Run with:
 
 import sys
 from pathlib import Path
+from types import MappingProxyType
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 import pytest
+from unittest.mock import patch
+from eval import eval_runner
 from eval.eval_runner import EvalRunner, extract_json, MOCK_RESPONSES
 from validators.citation_validator import CitationValidator
-from validators.completeness_checker import CompletenessChecker
-from validators.safety_checker import SafetyChecker
+from validators.completeness_checker import FieldQuality
+
+# The workflow fixtures below run the whole case; keep them on one xdist worker
+pytestmark = pytest.mark.xdist_group("stroke_case")
 
 
 # ============================================================================
@@ -86,6 +91,39 @@ This patient presents with several interrelated challenges that may benefit from
 }
 ```"""
 
+# Reduced versions of the stroke PICO for the narrative edge cases (read-only)
+MINIMAL_PICO = MappingProxyType({
+    "patient": "stroke patient",
+    "intervention": "OT",
+    "comparison": "",
+    "outcome": "",
+})
+
+PARTIAL_PICO = MappingProxyType({
+    "patient": "68-year-old female post stroke with hemiparesis",
+    "intervention": "occupational therapy interventions",
+    "comparison": "",
+    "outcome": "",
+})
+
+LONG_PICO = MappingProxyType({
+    "patient": (
+        "68-year-old female retired school teacher, 3 months post "
+        "right-sided ischemic stroke with moderate left hemiparesis "
+        "and left-sided neglect, living independently in 2-story house, "
+        "daughter visits daily, well-controlled hypertension"
+    ),
+    "intervention": "constraint-induced movement therapy combined with task-specific ADL training",
+    "comparison": "standard outpatient OT without structured protocol",
+    "outcome": "independence with dressing, grooming, meal preparation, and modified gardening",
+})
+
+
+@pytest.fixture(scope="module")
+def ot_ask_parsed():
+    """(clean_text, json_data) extracted once from the OT stroke ASK response."""
+    return extract_json(OT_STROKE_ASK_MOCK)
+
 
 # ============================================================================
 # PICO Extraction Tests
@@ -94,53 +132,53 @@ This patient presents with several interrelated challenges that may benefit from
 class TestStrokeCasePicoExtraction:
     """Tests for PICO extraction from the OT stroke case."""
 
-    def test_extract_pico_from_mock_response(self):
+    def test_extract_pico_from_mock_response(self, ot_ask_parsed):
         """Mock ASK response should produce valid PICO_UPDATE JSON."""
-        clean, data = extract_json(OT_STROKE_ASK_MOCK)
+        clean, data = ot_ask_parsed
         assert data is not None
         assert data["type"] == "PICO_UPDATE"
 
-    def test_pico_contains_all_fields(self):
-        _, data = extract_json(OT_STROKE_ASK_MOCK)
+    def test_pico_contains_all_fields(self, ot_ask_parsed):
+        _, data = ot_ask_parsed
         pico = data["data"]
         assert pico["patient"], "Patient field should not be empty"
         assert pico["intervention"], "Intervention field should not be empty"
         assert pico["comparison"], "Comparison field should not be empty"
         assert pico["outcome"], "Outcome field should not be empty"
 
-    def test_pico_captures_stroke_diagnosis(self):
+    def test_pico_captures_stroke_diagnosis(self, ot_ask_parsed):
         """Patient field should mention stroke."""
-        _, data = extract_json(OT_STROKE_ASK_MOCK)
+        _, data = ot_ask_parsed
         patient = data["data"]["patient"].lower()
         assert "stroke" in patient
 
-    def test_pico_captures_hemiparesis(self):
+    def test_pico_captures_hemiparesis(self, ot_ask_parsed):
         """Patient field should mention hemiparesis or motor deficit."""
-        _, data = extract_json(OT_STROKE_ASK_MOCK)
+        _, data = ot_ask_parsed
         patient = data["data"]["patient"].lower()
         assert "hemiparesis" in patient or "motor" in patient
 
-    def test_pico_captures_neglect(self):
+    def test_pico_captures_neglect(self, ot_ask_parsed):
         """Patient field should mention neglect."""
-        _, data = extract_json(OT_STROKE_ASK_MOCK)
+        _, data = ot_ask_parsed
         patient = data["data"]["patient"].lower()
         assert "neglect" in patient
 
-    def test_pico_intervention_is_ot_specific(self):
+    def test_pico_intervention_is_ot_specific(self, ot_ask_parsed):
         """Intervention should be OT-focused."""
-        _, data = extract_json(OT_STROKE_ASK_MOCK)
+        _, data = ot_ask_parsed
         intervention = data["data"]["intervention"].lower()
         assert any(kw in intervention for kw in ["ot", "occupational", "task", "movement", "training"])
 
-    def test_pico_outcomes_include_adl(self):
+    def test_pico_outcomes_include_adl(self, ot_ask_parsed):
         """Outcomes should include ADL goals."""
-        _, data = extract_json(OT_STROKE_ASK_MOCK)
+        _, data = ot_ask_parsed
         outcome = data["data"]["outcome"].lower()
         assert any(kw in outcome for kw in ["dressing", "adl", "independence", "grooming", "function"])
 
-    def test_pico_completeness_is_100(self):
+    def test_pico_completeness_is_100(self, ot_ask_parsed):
         """Well-described case should yield 100% completeness."""
-        _, data = extract_json(OT_STROKE_ASK_MOCK)
+        _, data = ot_ask_parsed
         assert data["data"]["completeness"] == 100
 
 
@@ -151,29 +189,25 @@ class TestStrokeCasePicoExtraction:
 class TestStrokeCaseCompleteness:
     """Tests that the extracted PICO passes completeness checks."""
 
-    def setup_method(self):
-        self.checker = CompletenessChecker()
-
-    def test_extracted_pico_passes_completeness(self):
+    def test_extracted_pico_passes_completeness(self, ot_ask_parsed, completeness_checker):
         """PICO extracted from stroke case should pass completeness."""
-        _, data = extract_json(OT_STROKE_ASK_MOCK)
+        _, data = ot_ask_parsed
         pico = data["data"]
-        result = self.checker.check_pico(pico)
+        result = completeness_checker.check_pico(pico)
         assert result.passed
         assert result.score >= 0.75
 
-    def test_expected_pico_passes_completeness(self):
+    def test_expected_pico_passes_completeness(self, completeness_checker):
         """The expected PICO from the case definition should pass."""
-        result = self.checker.check_pico(OT_STROKE_CASE["expected_pico"])
+        result = completeness_checker.check_pico(OT_STROKE_CASE["expected_pico"])
         assert result.passed
         assert result.score >= 0.75
 
-    def test_all_fields_are_adequate_or_better(self):
+    def test_all_fields_are_adequate_or_better(self, ot_ask_parsed, completeness_checker):
         """Each PICO field should be at least adequate."""
-        _, data = extract_json(OT_STROKE_ASK_MOCK)
+        _, data = ot_ask_parsed
         pico = data["data"]
-        result = self.checker.check_pico(pico)
-        from validators.completeness_checker import FieldQuality
+        result = completeness_checker.check_pico(pico)
         for fc in result.field_checks:
             assert fc.quality in (FieldQuality.ADEQUATE, FieldQuality.GOOD), \
                 f"Field '{fc.field_name}' is {fc.quality.value}, expected adequate+"
@@ -186,16 +220,13 @@ class TestStrokeCaseCompleteness:
 class TestStrokeCaseSafety:
     """Tests that stroke case responses pass safety checks."""
 
-    def setup_method(self):
-        self.checker = SafetyChecker()
-
-    def test_ask_response_passes_safety(self):
+    def test_ask_response_passes_safety(self, ot_ask_parsed, safety_checker):
         """The ASK phase mock response should pass safety."""
-        clean, _ = extract_json(OT_STROKE_ASK_MOCK)
-        result = self.checker.check(clean)
+        clean, _ = ot_ask_parsed
+        result = safety_checker.check(clean)
         assert result.passed, f"Safety failed: {result.summary}"
 
-    def test_ot_recommendation_with_hedging_passes(self):
+    def test_ot_recommendation_with_hedging_passes(self, safety_checker):
         """OT-specific recommendations with appropriate hedging should pass."""
         text = (
             "Based on the current evidence, constraint-induced movement therapy "
@@ -205,20 +236,20 @@ class TestStrokeCaseSafety:
             "and progression of therapy. The evidence suggests that higher-dose "
             "OT could improve ADL outcomes."
         )
-        result = self.checker.check(text)
+        result = safety_checker.check(text)
         assert result.passed
         assert result.has_hedging
 
-    def test_prescriptive_ot_plan_fails_safety(self):
+    def test_prescriptive_ot_plan_fails_safety(self, safety_checker):
         """Overly prescriptive therapy plans should fail safety."""
         text = (
             "You must perform constraint-induced movement therapy for 6 hours daily. "
             "I am prescribing this exact protocol. The diagnosis is left-sided neglect."
         )
-        result = self.checker.check(text)
+        result = safety_checker.check(text)
         assert not result.passed
 
-    def test_fall_safety_recommendation_passes(self):
+    def test_fall_safety_recommendation_passes(self, safety_checker):
         """Fall prevention recommendations with hedging should pass."""
         text = (
             "Given this patient's concerns about falling, consider implementing "
@@ -226,7 +257,7 @@ class TestStrokeCaseSafety:
             "assessment and modification may reduce fall risk in stroke survivors. "
             "A structured home evaluation could identify specific hazards."
         )
-        result = self.checker.check(text)
+        result = safety_checker.check(text)
         assert result.passed
 
 
@@ -234,55 +265,40 @@ class TestStrokeCaseSafety:
 # Full Workflow with Stroke Case Mock
 # ============================================================================
 
+@pytest.fixture(scope="module")
+def stroke_result():
+    """Run the stroke case once, serving its ASK response alongside the (read-only) mock table."""
+    responses = dict(MOCK_RESPONSES)
+    responses["ASK"] = {**MOCK_RESPONSES["ASK"], "ot-stroke-rehab": OT_STROKE_ASK_MOCK}
+    with patch.object(eval_runner, "mock_responses", lambda: responses):
+        return EvalRunner(mock=True).run_case(OT_STROKE_CASE)
+
+
 class TestStrokeCaseWorkflow:
     """Tests running the full 5-phase workflow with the stroke case."""
 
-    def setup_method(self):
-        self.runner = EvalRunner(mock=True)
-
-    def test_stroke_case_runs_through_all_phases(self):
+    def test_stroke_case_runs_through_all_phases(self, stroke_result):
         """The stroke case should complete all 5 phases."""
-        # Add the OT stroke ASK response to mock responses temporarily
-        original_ask = MOCK_RESPONSES["ASK"].get("ot-stroke-rehab")
-        MOCK_RESPONSES["ASK"]["ot-stroke-rehab"] = OT_STROKE_ASK_MOCK
-        try:
-            result = self.runner.run_case(OT_STROKE_CASE)
-            assert len(result.phase_results) == 5
-            # ASK phase should extract JSON
-            assert result.phase_results[0].json_extracted
-        finally:
-            # Restore
-            if original_ask is None:
-                del MOCK_RESPONSES["ASK"]["ot-stroke-rehab"]
-            else:
-                MOCK_RESPONSES["ASK"]["ot-stroke-rehab"] = original_ask
-
-    def test_stroke_case_pico_accumulates(self):
+        assert len(stroke_result.phase_results) == 5
+        # ASK phase should extract JSON
+        assert stroke_result.phase_results[0].json_extracted
+
+    def test_stroke_case_pico_accumulates(self, stroke_result):
         """PICO state should be populated after ASK phase."""
-        MOCK_RESPONSES["ASK"]["ot-stroke-rehab"] = OT_STROKE_ASK_MOCK
-        try:
-            result = self.runner.run_case(OT_STROKE_CASE)
-            assert result.completeness_result is not None
-            score = result.completeness_result.get("score", 0)
-            assert score > 0.5, f"Completeness score too low: {score}"
-        finally:
-            del MOCK_RESPONSES["ASK"]["ot-stroke-rehab"]
-
-    def test_stroke_case_safety_passes_all_phases(self):
+        assert stroke_result.completeness_result is not None
+        score = stroke_result.completeness_result.get("score", 0)
+        assert score > 0.5, f"Completeness score too low: {score}"
+
+    def test_stroke_case_safety_passes_all_phases(self, stroke_result):
         """All phases should pass safety validation."""
-        MOCK_RESPONSES["ASK"]["ot-stroke-rehab"] = OT_STROKE_ASK_MOCK
-        try:
-            result = self.runner.run_case(OT_STROKE_CASE)
-            for pr in result.phase_results:
-                assert pr.safety_result is not None
-                safety_errors = [
-                    v for v in pr.safety_result.get("violations", [])
-                    if v.get("severity") == "error"
-                ]
-                assert len(safety_errors) == 0, \
-                    f"Phase {pr.phase} has safety errors: {safety_errors}"
-        finally:
-            del MOCK_RESPONSES["ASK"]["ot-stroke-rehab"]
+        for pr in stroke_result.phase_results:
+            assert pr.safety_result is not None
+            safety_errors = [
+                v for v in pr.safety_result.get("violations", [])
+                if v.get("severity") == "error"
+            ]
+            assert len(safety_errors) == 0, \
+                f"Phase {pr.phase} has safety errors: {safety_errors}"
 
 
 # ============================================================================
@@ -292,57 +308,28 @@ class TestStrokeCaseWorkflow:
 class TestComplexNarrativePicoExtraction:
     """Tests for PICO extraction from various complex clinical narratives."""
 
-    def setup_method(self):
-        self.checker = CompletenessChecker()
-
-    def test_ot_stroke_expected_pico_has_good_patient_field(self):
-        """The stroke patient description should be rated GOOD (long, detailed)."""
-        result = self.checker.check_pico(OT_STROKE_CASE["expected_pico"])
-        from validators.completeness_checker import FieldQuality
-        field_map = {fc.field_name: fc for fc in result.field_checks}
-        assert field_map["patient"].quality == FieldQuality.GOOD
-
-    def test_minimal_stroke_pico_scores_lower(self):
-        """A minimal version of the stroke PICO should score lower."""
-        minimal_pico = {
-            "patient": "stroke patient",
-            "intervention": "OT",
-            "comparison": "",
-            "outcome": "",
-        }
-        result = self.checker.check_pico(minimal_pico)
-        assert result.score < 0.5
-
-    def test_partial_stroke_pico_identifies_gaps(self):
-        """Partial PICO should identify what's missing."""
-        partial_pico = {
-            "patient": "68-year-old female post stroke with hemiparesis",
-            "intervention": "occupational therapy interventions",
-            "comparison": "",
-            "outcome": "",
-        }
-        result = self.checker.check_pico(partial_pico)
-        issues = [fc for fc in result.field_checks if fc.issue]
-        missing_fields = [fc.field_name for fc in issues]
-        assert "comparison" in missing_fields
-        assert "outcome" in missing_fields
-
-    def test_long_narrative_patient_field(self):
-        """Very long patient description should be rated GOOD."""
-        pico = {
-            "patient": (
-                "68-year-old female retired school teacher, 3 months post "
-                "right-sided ischemic stroke with moderate left hemiparesis "
-                "and left-sided neglect, living independently in 2-story house, "
-                "daughter visits daily, well-controlled hypertension"
-            ),
-            "intervention": "constraint-induced movement therapy combined with task-specific ADL training",
-            "comparison": "standard outpatient OT without structured protocol",
-            "outcome": "independence with dressing, grooming, meal preparation, and modified gardening",
-        }
-        result = self.checker.check_pico(pico)
-        assert result.passed
-        assert result.score >= 0.75
+    @pytest.mark.parametrize("pico,check", [
+        pytest.param(
+            OT_STROKE_CASE["expected_pico"],
+            # The stroke patient description is long and detailed
+            lambda r: r.get_field("patient").quality == FieldQuality.GOOD,
+            id="ot-stroke-good-patient-field",
+        ),
+        pytest.param(MINIMAL_PICO, lambda r: r.score < 0.5, id="minimal-scores-lower"),
+        pytest.param(
+            PARTIAL_PICO,
+            # Partial PICO names what's missing
+            lambda r: {"comparison", "outcome"} <= set(r.missing_field_names()),
+            id="partial-identifies-gaps",
+        ),
+        pytest.param(
+            LONG_PICO,
+            lambda r: r.passed and r.score >= 0.75,
+            id="long-narrative-passes",
+        ),
+    ])
+    def test_pico(self, completeness_checker, pico, check):
+        assert check(completeness_checker.check_pico(pico))
 
 
 if __name__ == "__main__":
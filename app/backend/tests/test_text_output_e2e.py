@@ -16,6 +16,7 @@ import json
 import re
 import urllib.request
 import urllib.error
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import urllib.parse
 
@@ -39,6 +40,8 @@ TRANSCRIPT_PATH = os.environ.get(
 SHORT_DIRECT_TRANSCRIPT_PATH = os.environ.get(
     "LLM_E2E_SHORT_DIRECT_TRANSCRIPT_PATH", "/tmp/medgemma_text_e2e_short_direct_transcript.txt"
 )
+# Cap on concurrent user-simulator requests, to stay within API rate limits
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_E2E_MAX_CONCURRENCY", "4"))
 
 PHASE_OUTPUT_FORMATS = {
     "ASK": """Return a short response, then output JSON:\n```json\n{\n  "type": "PICO_UPDATE",\n  "data": {\n    "patient": "...",\n    "intervention": "...",\n    "comparison": "...",\n    "outcome": "...",\n    "completeness": 100\n  }\n}\n```""",
@@ -683,23 +686,39 @@ def test_text_output_e2e_llm_flow():
 
     history = []
 
-    # Step 1: User simulator (Codex 5.2) creates a free-text clinical narrative.
-    user_story = _call_openai_chat(
-        USER_SIM_MODEL,
-        [
-            {
-                "role": "system",
-                "content": (
-                    "You are a clinician user. Write a single free-text clinical story "
-                    "for an occupational therapy case (any diagnosis). Include patient "
-                    "context, intervention consideration, comparison, and outcomes. "
-                    "Output only the user message."
-                ),
-            },
-            {"role": "user", "content": "Write the story now."},
-        ],
-        temperature=0.6,
-    )
+    # The user simulator sees neither the story nor the system replies when
+    # writing the phase follow-ups, so all of its messages are independent:
+    # request them concurrently up front instead of one per step.
+    with ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY) as executor:
+        # Step 1: User simulator (Codex 5.2) creates a free-text clinical narrative.
+        story_future = executor.submit(
+            _call_openai_chat,
+            USER_SIM_MODEL,
+            [
+                {
+                    "role": "system",
+                    "content": (
+                        "You are a clinician user. Write a single free-text clinical story "
+                        "for an occupational therapy case (any diagnosis). Include patient "
+                        "context, intervention consideration, comparison, and outcomes. "
+                        "Output only the user message."
+                    ),
+                },
+                {"role": "user", "content": "Write the story now."},
+            ],
+            temperature=0.6,
+        )
+        # Steps 3-6: follow-ups asking to move to ACQUIRE, APPRAISE, APPLY and ASSESS.
+        user_followup, user_appraise, user_apply, user_assess = executor.map(_simulate_user_followup, [
+            "Write a short follow-up message asking to move to ACQUIRE and find evidence.",
+            "Ask to move to APPRAISE and request a critical appraisal of the evidence. "
+            "Mention you'd like the appraisal to reference the listed studies.",
+            "Ask to move to APPLY and request specific clinical recommendations "
+            "(assessment, diagnostics, treatment plan, safety, and follow-up).",
+            "Ask to move to ASSESS and request outcome measures to track. "
+            "Include a short list of options like PHQ-9, GAD-7, WSAS, and ask which to use.",
+        ])
+        user_story = story_future.result()
     assert len(user_story) > 60
     history.append({"role": "user", "content": user_story})
 
@@ -713,11 +732,7 @@ def test_text_output_e2e_llm_flow():
     assert pico_json is not None and pico_json.get("type") == "PICO_UPDATE"
     history.append({"role": "assistant", "content": ask_response})
 
-    # Step 3: User simulator asks to move to ACQUIRE.
-    user_followup = _simulate_user_followup(
-        "Write a short follow-up message asking to move to ACQUIRE and find evidence.",
-        temperature=0.4,
-    )
+    # Step 3: User asks to move to ACQUIRE.
     assert len(user_followup) > 10
     history.append({"role": "user", "content": user_followup})
 
@@ -786,12 +801,7 @@ def test_text_output_e2e_llm_flow():
     clean_acquire = (clean_acquire or _summarize_references(references)) + " Prioritized systematic reviews, guidelines, and RCTs."
     history.append({"role": "assistant", "content": _format_assistant_response(clean_acquire, acquire_json)})
 
-    # Step 4: User simulator asks to move to APPRAISE.
-    user_appraise = _simulate_user_followup(
-        "Ask to move to APPRAISE and request a critical appraisal of the evidence. "
-        "Mention you'd like the appraisal to reference the listed studies.",
-        temperature=0.4,
-    )
+    # Step 4: User asks to move to APPRAISE.
     history.append({"role": "user", "content": user_appraise})
 
     appraise_response, clean_appraise, appraise_json = _generate_phase_response(
@@ -808,12 +818,7 @@ def test_text_output_e2e_llm_flow():
     assert isinstance(appraise_json.get("data"), list) and appraise_json["data"]
     history.append({"role": "assistant", "content": appraise_response})
 
-    # Step 5: User simulator asks to move to APPLY.
-    user_apply = _simulate_user_followup(
-        "Ask to move to APPLY and request specific clinical recommendations "
-        "(assessment, diagnostics, treatment plan, safety, and follow-up).",
-        temperature=0.4,
-    )
+    # Step 5: User asks to move to APPLY.
     history.append({"role": "user", "content": user_apply})
 
     apply_response, clean_apply, apply_json = _generate_phase_response(
@@ -830,12 +835,7 @@ def test_text_output_e2e_llm_flow():
     assert isinstance(apply_json.get("data"), list) and apply_json["data"]
     history.append({"role": "assistant", "content": apply_response})
 
-    # Step 6: User simulator asks to move to ASSESS.
-    user_assess = _simulate_user_followup(
-        "Ask to move to ASSESS and request outcome measures to track. "
-        "Include a short list of options like PHQ-9, GAD-7, WSAS, and ask which to use.",
-        temperature=0.4,
-    )
+    # Step 6: User asks to move to ASSESS.
     history.append({"role": "user", "content": user_assess})
 
     assess_response, clean_assess, assess_json = _generate_phase_response(
@@ -14,8 +14,8 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 import pytest
 from validators.citation_validator import CitationValidator, CitationResult
-from validators.completeness_checker import CompletenessChecker, CompletenessResult, FieldQuality
-from validators.safety_checker import SafetyChecker, SafetyResult
+from validators.completeness_checker import CompletenessResult, FieldQuality
+from validators.safety_checker import SafetyResult
 
 
 # ============================================================================
@@ -129,6 +129,13 @@ class TestCitationValidator:
         # In non-strict mode, one ungrounded out of two should still pass
         assert result.passed
 
+    def test_error_violations_follow_strictness(self):
+        text = "Wilson (1990) and [1] both suggest benefit."
+        strict = self.validator.validate(text, self.sample_refs, strict=True)
+        lenient = self.validator.validate(text, self.sample_refs, strict=False)
+        assert len(strict.error_violations) == 1
+        assert lenient.error_violations == []
+
 
 class TestCitationExtraction:
     """Tests for citation pattern extraction."""
@@ -173,8 +180,9 @@ class TestCitationExtraction:
 class TestCompletenessChecker:
     """Tests for CompletenessChecker."""
 
-    def setup_method(self):
-        self.checker = CompletenessChecker()
+    @pytest.fixture(autouse=True)
+    def _checker(self, completeness_checker):
+        self.checker = completeness_checker
 
     # --- PICO Tests ---
 
@@ -231,8 +239,7 @@ class TestCompletenessChecker:
         }
         result = self.checker.check_pico(pico)
         # "adults" is only 1 word, below the 3-word minimum for patient
-        field_checks = {fc.field_name: fc for fc in result.field_checks}
-        assert field_checks["patient"].quality in (FieldQuality.MINIMAL, FieldQuality.EMPTY)
+        assert result.get_field("patient").quality in (FieldQuality.MINIMAL, FieldQuality.EMPTY)
 
     def test_pico_completeness_scoring(self):
         pico = {
@@ -316,8 +323,9 @@ class TestCompletenessChecker:
 class TestSafetyChecker:
     """Tests for SafetyChecker."""
 
-    def setup_method(self):
-        self.checker = SafetyChecker()
+    @pytest.fixture(autouse=True)
+    def _checker(self, safety_checker):
+        self.checker = safety_checker
 
     def test_safe_response_passes(self):
         text = (
@@ -404,6 +412,13 @@ class TestSafetyChecker:
         assert result.passed
         assert any(v.category == "scope_overreach" for v in result.violations)
 
+    def test_error_violations_exclude_warnings(self):
+        text = "I am prescribing metformin. If symptoms worsen, call 911."
+        result = self.checker.check(text)
+        assert [v.category for v in result.error_violations] == ["prescriptive"]
+        assert result.error_count == 1
+        assert result.warning_count == 1
+
     def test_clinical_recommendation_with_hedging_passes(self):
         text = (
             "Based on the retrieved evidence, consider initiating GLP-1 agonist "
@@ -445,10 +460,11 @@ class TestSafetyChecker:
 class TestValidatorIntegration:
     """Integration tests combining multiple validators."""
 
-    def setup_method(self):
+    @pytest.fixture(autouse=True)
+    def _validators(self, completeness_checker, safety_checker):
         self.citation = CitationValidator()
-        self.completeness = CompletenessChecker()
-        self.safety = SafetyChecker()
+        self.completeness = completeness_checker
+        self.safety = safety_checker
 
     def test_full_good_response(self):
         """A well-crafted AI response should pass all validators."""
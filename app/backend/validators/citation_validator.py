@@ -17,7 +17,7 @@ from dataclasses import dataclass, field
 from typing import List, Dict, Optional
 
 
-@dataclass
+@dataclass(slots=True)
 class CitationViolation:
     """A single citation grounding violation."""
     citation_text: str
@@ -25,7 +25,7 @@ class CitationViolation:
     severity: str  # "error" or "warning"
 
 
-@dataclass
+@dataclass(slots=True)
 class CitationResult:
     """Result of citation validation."""
     passed: bool
@@ -35,6 +35,10 @@ class CitationResult:
     violations: List[CitationViolation] = field(default_factory=list)
     coverage_score: float = 0.0  # 0.0-1.0: what fraction of retrieved refs are cited
 
+    @property
+    def error_violations(self) -> List[CitationViolation]:
+        return [v for v in self.violations if v.severity == "error"]
+
     @property
     def summary(self) -> str:
         if self.passed:
@@ -42,7 +46,7 @@ class CitationResult:
                 f"PASS: {self.grounded_citations}/{self.total_citations_found} "
                 f"citations grounded (coverage: {self.coverage_score:.0%})"
             )
-        violations_str = "; ".join(v.citation_text for v in self.violations if v.severity == "error")
+        violations_str = "; ".join(v.citation_text for v in self.error_violations)
         return (
             f"FAIL: {self.ungrounded_citations} ungrounded citation(s). "
             f"Violations: {violations_str}"
@@ -71,6 +75,9 @@ class CitationValidator:
     # Pattern for "Study X" or "Reference X" style
     STUDY_REF_PATTERN = re.compile(r'(?:study|reference|ref|source)\s*#?\s*(\d+)', re.IGNORECASE)
 
+    # 4-digit year inside reference year strings like "Mar 2023"
+    YEAR_PATTERN = re.compile(r'(\d{4})')
+
     def validate(
         self,
         response_text: str,
@@ -230,7 +237,7 @@ class CitationValidator:
             # Index by year
             year = ref.get("year", "")
             # Extract 4-digit year from strings like "Mar 2023"
-            year_match = re.search(r'(\d{4})', str(year))
+            year_match = self.YEAR_PATTERN.search(str(year))
             if year_match:
                 yr = year_match.group(1)
                 lookup["by_year"].setdefault(yr, []).append(ref_entry)
@@ -15,6 +15,7 @@ Usage:
     result = checker.check_workflow(workflow_state)
 """
 
+import functools
 import re
 from dataclasses import dataclass, field
 from typing import List, Dict, Optional, Any
@@ -29,7 +30,7 @@ class FieldQuality(Enum):
     GOOD = "good"             # Well-populated
 
 
-@dataclass
+@dataclass(slots=True)
 class FieldCheck:
     """Result for a single field check."""
     field_name: str
@@ -38,7 +39,7 @@ class FieldCheck:
     issue: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class CompletenessResult:
     """Result of completeness validation."""
     passed: bool
@@ -46,6 +47,23 @@ class CompletenessResult:
     field_checks: List[FieldCheck] = field(default_factory=list)
     issues: List[str] = field(default_factory=list)
 
+    @property
+    def issues_text(self) -> str:
+        """All issues as one space-separated string, for substring checks."""
+        return " ".join(self.issues)
+
+    def get_field(self, name: str) -> FieldCheck:
+        """The check for one field by name; raises KeyError if it wasn't checked."""
+        # At most five checks per result, so a scan beats building an index
+        for fc in self.field_checks:
+            if fc.field_name == name:
+                return fc
+        raise KeyError(name)
+
+    def missing_field_names(self) -> tuple:
+        """Names of the fields flagged with an issue, in check order."""
+        return tuple(fc.field_name for fc in self.field_checks if fc.issue)
+
     @property
     def summary(self) -> str:
         status = "PASS" if self.passed else "FAIL"
@@ -61,13 +79,78 @@ PICO_MIN_WORDS = {
     "outcome": 2,       # e.g., "weight loss"
 }
 
+# (field, minimum words, words for GOOD), in PICO order
+_PICO_FIELD_SPECS = tuple(
+    (name, min_words, min_words * 2) for name, min_words in PICO_MIN_WORDS.items()
+)
+
 # Vague/placeholder values that don't count as real content
-VAGUE_VALUES = {
+VAGUE_VALUES = frozenset({
     "unknown", "unclear", "n/a", "na", "none", "tbd", "to be determined",
     "not specified", "not yet", "any", "all", "various", "...", "?",
+})
+
+# EBP data sections checked by check_workflow, after PICO:
+# (state key, section label, min items, items for GOOD)
+_WORKFLOW_SECTIONS = (
+    ("references", "references", 1, 3),     # ACQUIRE
+    ("appraisals", "appraisals", 1, 3),     # APPRAISE
+    ("applyPoints", "actions", 1, 2),       # APPLY
+    ("assessPoints", "outcomes", 1, 2),     # ASSESS
+)
+
+# Uncertain wording anywhere in a field ("unclear - ask user"), matched in one pass
+_UNCERTAIN_RE = re.compile(r'\b(ask\s+user|unclear|not\s+specified|unknown)\b', re.IGNORECASE)
+
+_QUALITY_SCORES = {
+    FieldQuality.EMPTY: 0.0,
+    FieldQuality.MINIMAL: 0.25,
+    FieldQuality.ADEQUATE: 0.75,
+    FieldQuality.GOOD: 1.0,
 }
 
 
+def _empty_field(field_name: str) -> tuple:
+    """The (FieldQuality, issue) rating of a field with no value."""
+    return FieldQuality.EMPTY, f"{field_name}: empty"
+
+
+@functools.lru_cache(maxsize=256)
+def _assess_text_field(
+    field_name: str, value: str, min_words: int, good_words: int
+) -> tuple:
+    """Rate one stripped text field; returns (FieldQuality, issue or None).
+
+    Cached because sessions and eval runs re-check the same PICO values;
+    the result is an immutable pair, so it is safe to share.
+    """
+    if not value:
+        return _empty_field(field_name)
+
+    normalized = value.lower().strip()
+
+    # Check for vague/placeholder values
+    if normalized in VAGUE_VALUES:
+        return FieldQuality.EMPTY, f"{field_name}: contains only placeholder value '{value}'"
+
+    # Check for "ask user" type patterns
+    if _UNCERTAIN_RE.search(normalized):
+        return FieldQuality.MINIMAL, f"{field_name}: contains uncertain language"
+
+    # Check word count. Counts above good_words don't change the rating, so
+    # cap the split there rather than tokenizing long clinical notes in full.
+    word_count = len(value.split(maxsplit=good_words))
+
+    if word_count < min_words:
+        return FieldQuality.MINIMAL, f"{field_name}: too brief ({word_count} words, need {min_words}+)"
+
+    # Good quality
+    if word_count >= good_words:
+        return FieldQuality.GOOD, None
+
+    return FieldQuality.ADEQUATE, None
+
+
 class CompletenessChecker:
     """Validates completeness of PICO and EBP workflow data."""
 
@@ -90,27 +173,19 @@ class CompletenessChecker:
         issues = []
         total_score = 0.0
 
-        for field_name in ["patient", "intervention", "comparison", "outcome"]:
+        for field_name, min_words, good_words in _PICO_FIELD_SPECS:
             value = str(pico.get(field_name, "")).strip()
-            quality, issue = self._assess_field(field_name, value)
-            checks.append(FieldCheck(
-                field_name=field_name,
-                quality=quality,
-                value=value,
-                issue=issue,
-            ))
-
-            if quality == FieldQuality.GOOD:
-                total_score += 1.0
-            elif quality == FieldQuality.ADEQUATE:
-                total_score += 0.75
-            elif quality == FieldQuality.MINIMAL:
-                total_score += 0.25
-
+            if not value:
+                # Nothing to rate; skip the rating call and its cache lookup
+                quality, issue = _empty_field(field_name)
+            else:
+                quality, issue = self._assess_field(field_name, value, min_words, good_words)
+            checks.append(FieldCheck(field_name, quality, value, issue))
+            total_score += _QUALITY_SCORES[quality]
             if issue:
                 issues.append(issue)
 
-        score = total_score / 4.0  # 4 PICO fields
+        score = total_score / len(_PICO_FIELD_SPECS)
         passed = score >= pass_threshold
 
         return CompletenessResult(
@@ -124,6 +199,7 @@ class CompletenessChecker:
         self,
         state: Dict[str, Any],
         pass_threshold: float = 0.5,
+        quick: bool = False,
     ) -> CompletenessResult:
         """
         Check overall EBP workflow completeness.
@@ -135,6 +211,10 @@ class CompletenessChecker:
                 'appraisals': list of appraisal dicts
                 'applyPoints': list of action dicts
                 'assessPoints': list of outcome metric dicts
+            pass_threshold: Minimum score (0-1) to pass
+            quick: Stop as soon as the remaining sections can no longer
+                change the pass/fail verdict. Only `passed` is final then;
+                score, field_checks and issues cover the sections checked.
 
         Returns:
             CompletenessResult
@@ -142,7 +222,7 @@ class CompletenessChecker:
         checks = []
         issues = []
         total_score = 0.0
-        n_sections = 5  # PICO + 4 EBP data sections
+        n_sections = 1 + len(_WORKFLOW_SECTIONS)  # PICO + EBP data sections
 
         # 1. PICO completeness
         pico = state.get("pico", {})
@@ -161,45 +241,22 @@ class CompletenessChecker:
         if pico_check.issue:
             issues.append(pico_check.issue)
 
-        # 2. References (ACQUIRE phase)
-        refs = state.get("references", [])
-        ref_quality, ref_issue = self._assess_list_section(
-            "references", refs, min_count=1, good_count=3
-        )
-        checks.append(FieldCheck("references", ref_quality, f"{len(refs)} items", ref_issue))
-        total_score += self._quality_to_score(ref_quality)
-        if ref_issue:
-            issues.append(ref_issue)
-
-        # 3. Appraisals (APPRAISE phase)
-        appraisals = state.get("appraisals", [])
-        apr_quality, apr_issue = self._assess_list_section(
-            "appraisals", appraisals, min_count=1, good_count=3
-        )
-        checks.append(FieldCheck("appraisals", apr_quality, f"{len(appraisals)} items", apr_issue))
-        total_score += self._quality_to_score(apr_quality)
-        if apr_issue:
-            issues.append(apr_issue)
-
-        # 4. Action items (APPLY phase)
-        actions = state.get("applyPoints", [])
-        act_quality, act_issue = self._assess_list_section(
-            "actions", actions, min_count=1, good_count=2
-        )
-        checks.append(FieldCheck("actions", act_quality, f"{len(actions)} items", act_issue))
-        total_score += self._quality_to_score(act_quality)
-        if act_issue:
-            issues.append(act_issue)
-
-        # 5. Outcome measures (ASSESS phase)
-        outcomes = state.get("assessPoints", [])
-        out_quality, out_issue = self._assess_list_section(
-            "outcomes", outcomes, min_count=1, good_count=2
-        )
-        checks.append(FieldCheck("outcomes", out_quality, f"{len(outcomes)} items", out_issue))
-        total_score += self._quality_to_score(out_quality)
-        if out_issue:
-            issues.append(out_issue)
+        # 2-5. EBP data sections (ACQUIRE, APPRAISE, APPLY, ASSESS)
+        for i, (key, label, min_count, good_count) in enumerate(_WORKFLOW_SECTIONS):
+            if quick:
+                # Each unchecked section can add at most 1.0 to the total
+                unchecked = len(_WORKFLOW_SECTIONS) - i
+                if (total_score / n_sections >= pass_threshold
+                        or (total_score + unchecked) / n_sections < pass_threshold):
+                    break
+            items = state.get(key, [])
+            quality, issue = self._assess_list_section(
+                label, items, min_count=min_count, good_count=good_count
+            )
+            checks.append(FieldCheck(label, quality, f"{len(items)} items", issue))
+            total_score += _QUALITY_SCORES[quality]
+            if issue:
+                issues.append(issue)
 
         score = total_score / n_sections
         passed = score >= pass_threshold
@@ -211,33 +268,11 @@ class CompletenessChecker:
             issues=issues,
         )
 
-    def _assess_field(self, field_name: str, value: str) -> tuple:
-        """Assess quality of a single text field."""
-        if not value:
-            return FieldQuality.EMPTY, f"{field_name}: empty"
-
-        normalized = value.lower().strip()
-
-        # Check for vague/placeholder values
-        if normalized in VAGUE_VALUES:
-            return FieldQuality.EMPTY, f"{field_name}: contains only placeholder value '{value}'"
-
-        # Check for "ask user" type patterns
-        if re.search(r'\b(ask\s+user|unclear|not\s+specified|unknown)\b', normalized, re.IGNORECASE):
-            return FieldQuality.MINIMAL, f"{field_name}: contains uncertain language"
-
-        # Check word count
-        word_count = len(value.split())
-        min_words = PICO_MIN_WORDS.get(field_name, 2)
-
-        if word_count < min_words:
-            return FieldQuality.MINIMAL, f"{field_name}: too brief ({word_count} words, need {min_words}+)"
-
-        # Good quality
-        if word_count >= min_words * 2:
-            return FieldQuality.GOOD, None
-
-        return FieldQuality.ADEQUATE, None
+    def _assess_field(
+        self, field_name: str, value: str, min_words: int, good_words: int
+    ) -> tuple:
+        """Assess a stripped text field against its word-count thresholds."""
+        return _assess_text_field(field_name, value, min_words, good_words)
 
     def _assess_list_section(
         self,
@@ -296,9 +331,4 @@ class CompletenessChecker:
 
     def _quality_to_score(self, quality: FieldQuality) -> float:
         """Convert quality enum to numeric score."""
-        return {
-            FieldQuality.EMPTY: 0.0,
-            FieldQuality.MINIMAL: 0.25,
-            FieldQuality.ADEQUATE: 0.75,
-            FieldQuality.GOOD: 1.0,
-        }[quality]
+        return _QUALITY_SCORES[quality]
@@ -23,7 +23,7 @@ from dataclasses import dataclass, field
 from typing import List, Optional
 
 
-@dataclass
+@dataclass(slots=True)
 class SafetyViolation:
     """A single safety violation."""
     category: str           # e.g., "prescriptive", "definitive_diagnosis"
@@ -33,7 +33,7 @@ class SafetyViolation:
     suggestion: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class SafetyResult:
     """Result of safety validation."""
     passed: bool
@@ -42,9 +42,13 @@ class SafetyResult:
     has_disclaimer: bool = False
     has_hedging: bool = False
 
+    @property
+    def error_violations(self) -> List[SafetyViolation]:
+        return [v for v in self.violations if v.severity == "error"]
+
     @property
     def error_count(self) -> int:
-        return sum(1 for v in self.violations if v.severity == "error")
+        return len(self.error_violations)
 
     @property
     def warning_count(self) -> int: